@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import time
+
+import main
+
+# Latência simulada de cada chamada à API do YouTube (segundos)
+LATENCIA_API = float(sys.argv[1]) if len(sys.argv) > 1 else 0.4
+REPETICOES = 5
+
+
+# Requisição falsa: espera a latência configurada e devolve a resposta pronta
+class RequisicaoFalsa:
+    def __init__(self, resposta):
+        self.resposta = resposta
+
+    def execute(self):
+        time.sleep(LATENCIA_API)
+        return self.resposta
+
+
+class StreamsFalsos:
+    def insert(self, part, body):
+        return RequisicaoFalsa({
+            "id": f"stream-{time.time_ns()}",
+            "cdn": {"ingestionInfo": {"ingestionAddress": "rtmp://localhost/live", "streamName": "chave"}},
+        })
+
+
+class BroadcastsFalsos:
+    def insert(self, part, body):
+        return RequisicaoFalsa({"id": f"broadcast-{time.time_ns()}"})
+
+    def bind(self, part, id, streamId):
+        return RequisicaoFalsa({"id": id})
+
+    def delete(self, id):
+        return RequisicaoFalsa({})
+
+
+class YoutubeFalso:
+    def liveStreams(self):
+        return StreamsFalsos()
+
+    def liveBroadcasts(self):
+        return BroadcastsFalsos()
+
+
+class Objeto:
+    def __init__(self, **atributos):
+        self.__dict__.update(atributos)
+
+
+# OBS falso: nunca está transmitindo, então todo go-live passa pelo caminho completo
+class OBSFalso:
+    def get_stream_status(self):
+        return Objeto(output_active=False)
+
+    def get_scene_list(self):
+        return Objeto(scenes=[])
+
+    def set_stream_service_settings(self, tipo, configuracoes):
+        pass
+
+    def start_stream(self):
+        pass
+
+
+class SupabaseFalso:
+    def __getattr__(self, nome):
+        return lambda *args, **kwargs: self
+
+
+def medir(rotulo, antes_de_cada=None):
+    tempos = []
+    for _ in range(REPETICOES):
+        if antes_de_cada:
+            antes_de_cada()
+        inicio = time.time()
+        main.configurar_e_iniciar_stream_youtube(OBSFalso(), youtube)
+        tempos.append((time.time() - inicio) * 1000)
+    print(f"⏱️ {rotulo}: média {sum(tempos) / len(tempos):.0f} ms, máx {max(tempos):.0f} ms")
+
+
+if __name__ == "__main__":
+    youtube = YoutubeFalso()
+    main.supabase = SupabaseFalso()
+    # O go-live registra o status "Ao Vivo": num armazém temporário, para que os eventos
+    # da medição nunca sejam sincronizados com o ngrok_links de produção
+    pasta = tempfile.mkdtemp()
+    main.armazem_eventos = main.ArmazemEventos(os.path.join(pasta, "eventos_locais.db"))
+
+    main.pool_youtube = None
+    medir("sem pool")
+
+    # Reabastece fora da medição, como a thread de fundo faria entre dois alertas
+    arquivo = os.path.join(pasta, "youtube_pool.json")
+    main.pool_youtube = main.PoolYoutube(lambda: youtube, arquivo=arquivo)
+
+    def reabastecer():
+        main.pool_youtube.liberar()
+        main.pool_youtube.reabastecer()
+
+    medir("com pool", reabastecer)
+    print(main.pool_youtube.estatisticas())
@@ -0,0 +1,57 @@
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import main
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+CAIXAS = [(1, (100, 120, 400, 650)), (2, (700, 150, 950, 700))]
+FACE = np.full((200, 200, 3), 128, dtype=np.uint8)
+
+
+# Overlay como era feito antes: cópia do frame inteiro e addWeighted em 1280x720
+def overlay_anterior(display, caixas, face_img, status_text, fps_calc):
+    main.desenhar_deteccoes(display, caixas, face_img)
+    overlay = display.copy()
+    cv2.rectangle(overlay, (0, 0), (1280, 40), (0, 0, 0), -1)
+    alpha = 0.4
+    cv2.addWeighted(overlay, alpha, display, 1 - alpha, 0, display)
+    cv2.putText(display, status_text, (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+    cv2.putText(display, f"FPS: {fps_calc:.1f}", (10, 70),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+
+def overlay_atual(display, caixas, face_img, status_text, fps_calc):
+    main.desenhar_deteccoes(display, caixas, face_img)
+    main.desenhar_status(display, status_text, fps_calc)
+
+
+def medir(rotulo, funcao, frames):
+    display = np.empty((main.ALTURA_FRAME, main.LARGURA_FRAME, 3), dtype=np.uint8)
+    tempos = []
+    tracemalloc.start()
+    for frame in frames:
+        np.copyto(display, frame)
+        inicio = time.perf_counter()
+        funcao(display, CAIXAS, FACE, "Gravando...", 30.0)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"⏱️ {rotulo}: {sum(tempos) / len(tempos):.3f} ms/frame (máx {max(tempos):.3f} ms), "
+          f"pico alocado {pico / 1024:.0f} KB")
+    return display
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (main.ALTURA_FRAME, main.LARGURA_FRAME, 3), dtype=np.uint8) for _ in range(8)]
+    frames = [frames[i % len(frames)] for i in range(FRAMES)]
+
+    anterior = medir("overlay anterior", overlay_anterior, frames)
+    atual = medir("overlay atual", overlay_atual, frames)
+    diferenca = int(np.abs(anterior.astype(np.int16) - atual.astype(np.int16)).max())
+    print(f"Diferença máxima entre os dois resultados: {diferenca}")
@@ -0,0 +1,111 @@
+import base64
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+
+# Servidor local que imita o endpoint TUS do Supabase Storage; FALHAR_A_CADA > 0 faz
+# um em cada N chunks falhar, para exercitar a retomada
+TAMANHO_MB = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+ARQUIVOS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+FALHAR_A_CADA = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+LATENCIA_CHUNK = 0.05
+
+uploads = {}   # id -> {"tamanho", "recebido"}
+objetos = {}   # caminho remoto -> bytes
+lock = threading.Lock()
+chunks_recebidos = 0
+
+
+class ArmazenamentoLocal(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, **cabecalhos):
+        self.send_response(status)
+        for nome, valor in cabecalhos.items():
+            self.send_header(nome.replace("_", "-"), valor)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        metadados = dict(par.split(" ") for par in self.headers["Upload-Metadata"].split(","))
+        nome = base64.b64decode(metadados["objectName"]).decode()
+        with lock:
+            identificador = str(len(uploads))
+            uploads[identificador] = {"nome": nome, "tamanho": int(self.headers["Upload-Length"]), "recebido": bytearray()}
+        self._responder(201, Location=f"/upload/{identificador}")
+
+    def do_HEAD(self):
+        upload = uploads.get(self.path.rsplit("/", 1)[-1])
+        if upload is None:
+            self._responder(404)
+            return
+        self._responder(200, Upload_Offset=str(len(upload["recebido"])), Upload_Length=str(upload["tamanho"]))
+
+    def do_PATCH(self):
+        global chunks_recebidos
+        upload = uploads[self.path.rsplit("/", 1)[-1]]
+        corpo = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(LATENCIA_CHUNK)
+        with lock:
+            chunks_recebidos += 1
+            if FALHAR_A_CADA and chunks_recebidos % FALHAR_A_CADA == 0:
+                self._responder(500)
+                return
+            if int(self.headers["Upload-Offset"]) != len(upload["recebido"]):
+                self._responder(409)
+                return
+            upload["recebido"] += corpo
+            if len(upload["recebido"]) == upload["tamanho"]:
+                objetos[upload["nome"]] = bytes(upload["recebido"])
+        self._responder(204, Upload_Offset=str(len(upload["recebido"])))
+
+
+if __name__ == "__main__":
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ArmazenamentoLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_port}"
+    main.ESPERA_MAXIMA_UPLOAD = 0.2
+
+    pasta = tempfile.mkdtemp()
+    arquivo_fila = os.path.join(pasta, "fila_uploads.json")
+    esperados = {}
+    for i in range(ARQUIVOS):
+        caminho = os.path.join(pasta, f"gravacao_{i}.mp4")
+        with open(caminho, "wb") as f:
+            f.write(os.urandom(TAMANHO_MB * 1024 * 1024))
+        esperados[f"gravacoes/teste/gravacao_{i}.mp4"] = caminho
+
+    # Primeira instância: enfileira tudo e é interrompida no meio, como numa queda do processo
+    fila = main.FilaUploads(url=f"{base}/upload", arquivo=arquivo_fila, ao_concluir=lambda item: True)
+    for remoto, caminho in esperados.items():
+        fila.enfileirar(caminho, remoto, "video/mp4")
+    inicio = time.time()
+    fila.iniciar()
+    while fila.bytes_enviados < TAMANHO_MB * ARQUIVOS * 1024 * 1024 / 2:
+        time.sleep(0.01)
+    fila.parar()
+    print(f"⏹️ Interrompida: {fila.estatisticas()}")
+
+    # Segunda instância: retoma a partir do arquivo da fila
+    fila = main.FilaUploads(url=f"{base}/upload", arquivo=arquivo_fila, ao_concluir=lambda item: True)
+    fila.iniciar()
+    while fila.estatisticas()["na_fila"]:
+        time.sleep(0.05)
+    duracao = time.time() - inicio
+    fila.parar()
+
+    for remoto, caminho in esperados.items():
+        with open(caminho, "rb") as f:
+            assert objetos[remoto] == f.read(), f"conteúdo divergente em {remoto}"
+    total_mb = TAMANHO_MB * ARQUIVOS
+    print(f"⏱️ {total_mb} MB em {duracao:.2f} s ({total_mb / duracao:.1f} MB/s), {chunks_recebidos} chunks recebidos")
+    print(fila.estatisticas())
+    servidor.shutdown()
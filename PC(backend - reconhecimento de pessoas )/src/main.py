@@ -2,56 +2,86 @@
 import json
 import os
 import time
+import socket
 import threading
 import subprocess
+import shutil
+import glob
+import base64
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 import psutil
-from flask import Flask, Response
+from collections import deque
+import asyncio
+from flask import Flask, jsonify
 
 # 2. Manipulação de Imagens e Vídeos
 import numpy as np
 import cv2
-import pyvirtualcam
 from pathlib import Path
-import screeninfo
 
 # 3. Controle de Datas e Horários
 from datetime import datetime, timedelta
 
-# 4. Integração com o OBS Studio (Gravação/Transmissão)
-import obsws_python
-from obsws_python import ReqClient
-import obsws_python as obs
-
 # 5. Comunicação HTTP
 import requests
+from urllib.parse import urlsplit, parse_qs, urljoin
+from requests.adapters import HTTPAdapter
 
-# 6. Modelo de Detecção de Objetos (YOLO)
-from ultralytics import YOLO
-
-# 7. Detecção de Rostos e Poses (MediaPipe)
-import mediapipe as mp
-
-# 8. Comunicação via MQTT (Mensageria)
+# 6. Comunicação via MQTT (Mensageria)
 import paho.mqtt.client as mqtt
 
-# 9. Carregamento de Variáveis de Ambiente (.env)
+# 7. Carregamento de Variáveis de Ambiente (.env)
 from dotenv import load_dotenv
 
-# 10. Integração com Banco de Dados Supabase
-from supabase import create_client, Client
-
-# 11. Google OAuth2 (Autenticação com Google)
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+# 8. Google OAuth2 (Autenticação com Google)
 import pickle
 from googleapiclient.errors import HttpError
 
+# Importados sob demanda (ver CarregamentoSobDemanda): ultralytics, mediapipe, supabase,
+# obsws_python, screeninfo e os clientes OAuth/discovery do Google
+
 
 # Configurações
 load_dotenv()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+
+# Tempo de cada fase da inicialização, em ms (exposto em /metricas)
+tempos_inicializacao = {}
+
+
+def registrar_fase(nome, inicio):
+    tempos_inicializacao[nome] = round((time.time() - inicio) * 1000)
+    print(f"⏱️ {nome}: {tempos_inicializacao[nome]} ms")
+
+
+# Objeto construído no primeiro uso: tira os imports e carregamentos pesados
+# (torch, mediapipe, supabase) da importação do módulo. Pode ser pré-carregado
+# em segundo plano com carregar(); chamadas concorrentes esperam o mesmo carregamento.
+class CarregamentoSobDemanda:
+    def __init__(self, nome, fabrica):
+        self._nome = nome
+        self._fabrica = fabrica
+        self._objeto = None
+        self._lock = threading.Lock()
+
+    def carregar(self):
+        if self._objeto is None:
+            with self._lock:
+                if self._objeto is None:
+                    inicio = time.time()
+                    self._objeto = self._fabrica()
+                    registrar_fase(self._nome, inicio)
+        return self._objeto
+
+    def __getattr__(self, atributo):
+        return getattr(self.carregar(), atributo)
+
+    def __call__(self, *args, **kwargs):
+        return self.carregar()(*args, **kwargs)
+
 # Configura OBS
 OBS_WS_HOST = "192.168.1.2"
 OBS_WS_PORT = 4455
@@ -65,20 +95,24 @@ NOME_CENA = "Detecção"
 # Banco de dados
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
-supabase = create_client(supabase_url, supabase_key)
+
+
+def criar_cliente_supabase():
+    from supabase import create_client
+    return create_client(supabase_url, supabase_key)
+
+
+supabase = CarregamentoSobDemanda("supabase", criar_cliente_supabase)
 usuario_id = "aQOzP7V12TgUUqmSUWC7d020jWu2"
 
 
 # Inicializa variáveis
 obs = None
-grava = False 
-transmite = False
 fps = 30  
 
 # Caminho do token e do client_secret
 TOKEN_PICKLE = os.path.join(os.getcwd(), 'src', 'token.pickle')
 client_secrets_file = os.path.join(os.getcwd(), 'src', 'client_secret.json')
-mp_face = mp.solutions.face_detection
 SCOPES = ['https://www.googleapis.com/auth/youtube'] 
 
 # Verificar se os arquivos existem
@@ -94,21 +128,30 @@ else:
     print(f"❌ Client Secret não encontrado em: {client_secrets_file}")
 print()  # Linha em branco
 
-# Verificar se o arquivo do modelo YOLO existe antes de carregá-lo
+# Verificar se o arquivo do modelo YOLO existe; o modelo só é carregado no primeiro uso
 yolo_model_path = os.path.join(BASE_DIR, "models", "yolov8n.pt")
 if os.path.exists(yolo_model_path):
-    yolo_model = YOLO(yolo_model_path)
     print(f"✅ Modelo YOLO encontrado: {yolo_model_path}")
 else:
     print(f"❌ Modelo YOLO não encontrado em: {yolo_model_path}")
 print()  # Linha em branco
 
-# Verificar se o módulo MediaPipe foi carregado corretamente
-if mp_face:
+
+def carregar_yolo():
+    from ultralytics import YOLO
+    if not os.path.exists(yolo_model_path):
+        raise FileNotFoundError(f"Modelo YOLO não encontrado em: {yolo_model_path}")
+    return YOLO(yolo_model_path)
+
+
+def carregar_mediapipe():
+    import mediapipe as mp
     print("✅ Módulo de detecção de rosto MediaPipe carregado com sucesso.")
-else:
-    print("❌ Módulo de detecção de rosto MediaPipe não carregado.")
-print()  # Linha em branco
+    return mp.solutions.face_detection
+
+
+yolo_model = CarregamentoSobDemanda("yolo", carregar_yolo)
+mp_face = CarregamentoSobDemanda("mediapipe", carregar_mediapipe)
 
 streaming_output = None
 
@@ -119,8 +162,9 @@ IP_WEBCAM_USER = None
 IP_WEBCAM_PASS = None 
 
 app = Flask(__name__)
-latest_frame = None
-frame_lock = threading.Lock()
+motor_ativo = None
+hubs_frames = {}  # hub de JPEGs por câmera ("principal" = primeira câmera)
+hubs_lock = threading.Lock()
 
 #  Esta função verifica se o OBS Studio (versão 64 bits) está rodando.
 def is_obs_running():
@@ -161,6 +205,20 @@ def debug_obs_config():
     except Exception as e:
         print(f"Erro no debug: {e}")
 
+# Espera até a porta aceitar conexões (em vez de um sleep fixo)
+TIMEOUT_INICIO_OBS = 30
+
+
+def aguardar_porta(host, porta, timeout):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            with socket.create_connection((host, porta), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
 # Inicio o OBS 
 def iniciar_obs():
     try:
@@ -170,7 +228,7 @@ def iniciar_obs():
         obs_path = r"C:\Program Files\obs-studio\bin\64bit\obs64.exe"
         subprocess.Popen([obs_path], cwd=os.path.dirname(obs_path))
         print("🔄 Iniciando OBS...")
-        time.sleep(10) 
+        aguardar_porta(OBS_WS_HOST, OBS_WS_PORT, TIMEOUT_INICIO_OBS)
         return True
         
     except Exception as e:
@@ -181,6 +239,7 @@ def iniciar_obs():
 def conectar_obs():
     global obs
     try:
+        from obsws_python import ReqClient
         obs = ReqClient(
             host=OBS_WS_HOST,
             port=OBS_WS_PORT,
@@ -193,6 +252,8 @@ def conectar_obs():
         print(f"• WebSocket v{version.obs_web_socket_version}")
         print(f"• Plataforma: {version.platform}")
         
+        reconciliador_obs.conectar_eventos()
+
         try:
             obs.get_stats()
             print("🔓 Permissões do WebSocket validadas")
@@ -205,190 +266,485 @@ def conectar_obs():
         print(f"❌ Falha na conexão OBS: {str(e)}")
         return False
 
-# Função para configurar a cena no OBS usando a webcam virtual
-def configurar_cena_obs(nome_fonte="Camera_Seguranca"):
-    global obs, NOME_CENA
-    
-    try:
-        print("\nConfigurando OBS com  servidor Flask...")
-        # 1. Verificar/Criar cena
+# Cache de estado do OBS sem eventos (WebSocket sem EventClient) vale por este tempo
+VALIDADE_CACHE_OBS = 60
+
+
+# Reconciliador da cena do OBS: guarda o estado observado (cenas, entradas, itens da
+# cena e cena de programa), compara com o desejado e envia só as requisições que faltam.
+# Os eventos do OBS mantêm o cache atualizado, então um alerta repetido sem mudanças
+# não envia nada. A fonte nunca é recriada se já existir com o tipo certo (navegador
+# no MJPEG, dispositivo de captura na câmera virtual): só as configurações diferentes
+# são ajustadas.
+class ReconciliadorOBS:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.estado = None          # None = precisa reler do OBS
+        self.lido_em = 0
+        self.eventos = None         # EventClient do obsws_python
+        self.configuracoes = None
+        self.servico_stream = None  # (servidor, chave) aplicados no OBS
+        # Padrões de cada tipo de fonte: GetInputSettings e InputSettingsChanged só trazem
+        # as chaves alteradas, então a comparação é feita sobre os padrões + as atuais
+        self.padroes = {}
+        self.reconciliacoes = 0
+        self.sem_alteracoes = 0
+        self.requisicoes_enviadas = 0
+
+    # Nova conexão com o OBS: descarta o cache e volta a ouvir os eventos
+    def conectar_eventos(self):
+        with self.lock:
+            self.estado = None
+            self.servico_stream = None
         try:
-            cenas = obs.get_scene_list().scenes
-            if not any(c['sceneName'] == NOME_CENA for c in cenas):
-                obs.send("CreateScene", {"sceneName": NOME_CENA})
-                print(f"Cena '{NOME_CENA}' criada")
-                time.sleep(1)
+            if self.eventos is not None:
+                self.eventos.disconnect()
+        except Exception:
+            pass
+        try:
+            from obsws_python import EventClient
+            self.eventos = EventClient(host=OBS_WS_HOST, port=OBS_WS_PORT, password=OBS_WS_PASSWORD, timeout=10)
+            self.eventos.callback.register([
+                self.on_scene_created, self.on_scene_removed, self.on_scene_name_changed,
+                self.on_input_created, self.on_input_removed, self.on_input_name_changed,
+                self.on_input_settings_changed, self.on_scene_item_created, self.on_scene_item_removed,
+                self.on_scene_item_enable_state_changed, self.on_current_program_scene_changed,
+            ])
         except Exception as e:
-            print(f"Erro ao verificar/criar cena: {str(e)}")
-            return False
-
-        # Obtém a resolução da tela
-        screen = screeninfo.get_monitors()[0]
-        screen_width = screen.width
-        screen_height = screen.height
-
-        #2. Configurações da webcam virtual
-        settings = {
-            "url": "http://localhost:5000/video_feed",
-            "width": screen_width,
-            "height": screen_height,
-            "fps": 30,
+            self.eventos = None
+            print(f"⚠️ Eventos do OBS indisponíveis, cache valerá {VALIDADE_CACHE_OBS} s: {e}")
+
+    def configuracoes_desejadas(self):
+        if self.configuracoes is None:
+            # Obtém a resolução da tela
+            import screeninfo
+            screen = screeninfo.get_monitors()[0]
+            self.configuracoes = {
+                "url": f"http://localhost:{PORTA_STREAMING}/video_feed",
+                "width": screen.width,
+                "height": screen.height,
+                "fps": 30,
+            }
+        return self.configuracoes
+
+    # (tipo, configurações) da fonte: a câmera virtual quando estiver aberta, senão o MJPEG
+    def fonte_desejada(self):
+        if saida_camera_virtual is not None:
+            if os.name == "nt":
+                return "dshow_input", {"video_device_id": f"{saida_camera_virtual.dispositivo}:"}
+            return "v4l2_input", {"device_id": saida_camera_virtual.dispositivo}
+        return "browser_source", self.configuracoes_desejadas()
+
+    def _ler_estado(self, nome_fonte):
+        cenas = obs.send("GetSceneList")
+        entradas = obs.send("GetInputList").inputs
+        estado = {
+            "cenas": {c['sceneName'] for c in cenas.scenes},
+            "programa": cenas.current_program_scene_name,
+            "entradas": {i['inputName']: i['inputKind'] for i in entradas},
+            "configuracoes": {},
+            "itens": {},
         }
+        if nome_fonte in estado["entradas"]:
+            estado["configuracoes"][nome_fonte] = obs.send("GetInputSettings", {"inputName": nome_fonte}).input_settings
+        if NOME_CENA in estado["cenas"]:
+            itens = obs.send("GetSceneItemList", {"sceneName": NOME_CENA}).scene_items
+            estado["itens"] = {i['sourceName']: {"id": i['sceneItemId'], "ativo": i['sceneItemEnabled']} for i in itens}
+        return estado
+
+    def _planejar(self, estado, nome_fonte):
+        tipo_desejado, desejadas = self.fonte_desejada()
+        plano = []
+        if NOME_CENA not in estado["cenas"]:
+            plano.append(("CreateScene", {"sceneName": NOME_CENA}))
+
+        tipo = estado["entradas"].get(nome_fonte)
+        if tipo is not None and tipo != tipo_desejado:
+            plano.append(("RemoveInput", {"inputName": nome_fonte}))
+            tipo = None
+
+        if tipo is None:
+            plano.append(("CreateInput", {
+                "sceneName": NOME_CENA,
+                "inputName": nome_fonte,
+                "inputKind": tipo_desejado,
+                "inputSettings": desejadas,
+                "sceneItemEnabled": True,
+            }))
+        else:
+            atuais = {**self.padroes.get(tipo, {}), **estado["configuracoes"].get(nome_fonte, {})}
+            diferentes = {k: v for k, v in desejadas.items() if atuais.get(k) != v}
+            if diferentes:
+                plano.append(("SetInputSettings", {"inputName": nome_fonte, "inputSettings": diferentes, "overlay": True}))
+
+            item = estado["itens"].get(nome_fonte)
+            if item is None:
+                plano.append(("CreateSceneItem", {"sceneName": NOME_CENA, "sourceName": nome_fonte, "sceneItemEnabled": True}))
+            elif not item["ativo"]:
+                plano.append(("SetSceneItemEnabled", {"sceneName": NOME_CENA, "sceneItemId": item["id"], "sceneItemEnabled": True}))
+
+        if estado["programa"] != NOME_CENA:
+            plano.append(("SetCurrentProgramScene", {"sceneName": NOME_CENA}))
+        return plano
+
+    # Registra no cache o efeito das requisições enviadas (os eventos confirmam depois)
+    def _aplicar(self, estado, requisicao, dados, resposta):
+        if requisicao == "CreateScene":
+            estado["cenas"].add(dados["sceneName"])
+        elif requisicao == "RemoveInput":
+            estado["entradas"].pop(dados["inputName"], None)
+            estado["configuracoes"].pop(dados["inputName"], None)
+            estado["itens"].pop(dados["inputName"], None)
+        elif requisicao == "CreateInput":
+            estado["entradas"][dados["inputName"]] = dados["inputKind"]
+            estado["configuracoes"][dados["inputName"]] = dict(dados["inputSettings"])
+            estado["itens"][dados["inputName"]] = {"id": getattr(resposta, "scene_item_id", None), "ativo": True}
+        elif requisicao == "SetInputSettings":
+            estado["configuracoes"].setdefault(dados["inputName"], {}).update(dados["inputSettings"])
+        elif requisicao == "CreateSceneItem":
+            estado["itens"][dados["sourceName"]] = {"id": getattr(resposta, "scene_item_id", None), "ativo": True}
+        elif requisicao == "SetSceneItemEnabled":
+            for item in estado["itens"].values():
+                if item["id"] == dados["sceneItemId"]:
+                    item["ativo"] = True
+        elif requisicao == "SetCurrentProgramScene":
+            estado["programa"] = dados["sceneName"]
+
+    def reconciliar(self, nome_fonte):
+        with self.lock:
+            self.reconciliacoes += 1
+            vencido = self.eventos is None and time.time() - self.lido_em > VALIDADE_CACHE_OBS
+            try:
+                if self.estado is None or vencido:
+                    self.estado = self._ler_estado(nome_fonte)
+                    self.lido_em = time.time()
+                elif nome_fonte in self.estado["entradas"] and nome_fonte not in self.estado["configuracoes"]:
+                    self.estado["configuracoes"][nome_fonte] = obs.send("GetInputSettings", {"inputName": nome_fonte}).input_settings
+                tipo = self.estado["entradas"].get(nome_fonte)
+                if tipo is not None and tipo not in self.padroes:
+                    self.padroes[tipo] = obs.send("GetInputDefaultSettings", {"inputKind": tipo}).default_input_settings
+
+                plano = self._planejar(self.estado, nome_fonte)
+                if not plano:
+                    self.sem_alteracoes += 1
+                    print("🎬 OBS já configurado, nenhuma requisição enviada")
+                    return True
+
+                for requisicao, dados in plano:
+                    resposta = obs.send(requisicao, dados)
+                    self.requisicoes_enviadas += 1
+                    self._aplicar(self.estado, requisicao, dados, resposta)
+                    print(f"🎬 OBS: {requisicao}")
+                return True
+            except Exception as e:
+                self.estado = None
+                print(f"Erro ao reconciliar a cena do OBS: {str(e)}")
+                return False
+
+    # Só reenvia as configurações de stream se servidor ou chave mudaram
+    def configurar_servico_stream(self, obs_client, servidor, chave):
+        with self.lock:
+            if self.servico_stream == (servidor, chave):
+                return
+        obs_client.set_stream_service_settings("rtmp_custom", {"server": servidor, "key": chave, "use_auth": False})
+        with self.lock:
+            self.servico_stream = (servidor, chave)
+            self.requisicoes_enviadas += 1
+
+    def programa_atual(self):
+        with self.lock:
+            return self.estado["programa"] if self.estado else None
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "eventos_ativos": self.eventos is not None,
+                "cache_valido": self.estado is not None,
+                "reconciliacoes": self.reconciliacoes,
+                "sem_alteracoes": self.sem_alteracoes,
+                "requisicoes_enviadas": self.requisicoes_enviadas,
+            }
 
-        # 3. Verificar se a fonte já existe
-        try:
-            inputs = obs.get_input_list().inputs
-            fonte_existe = any(i['inputName'] == nome_fonte for i in inputs)
+    # Eventos do OBS (nomes exigidos pelo obsws_python: on_<evento em snake_case>)
+    def _atualizar(self, funcao):
+        with self.lock:
+            if self.estado is not None:
+                funcao(self.estado)
 
-            if fonte_existe:
-                # Apagar a fonte existente antes de criar uma nova
-                obs.send("RemoveInput", {"inputName": nome_fonte})
-                print(f"Fonte '{nome_fonte}' removida")
-                time.sleep(0.5)
+    def _invalidar(self, dados=None):
+        with self.lock:
+            self.estado = None
 
-            # Criar nova fonte
-            obs.send("CreateInput", {
-                "sceneName": NOME_CENA,
-                "inputName": nome_fonte,
-                "inputKind": "browser_source",
-                "inputSettings": settings
-            })
-            print(f"Fonte '{nome_fonte}' criada")
-            
-            # Adicionar à cena se não estiver presente
-            items = obs.send("GetSceneItemList", {"sceneName": NOME_CENA}).scene_items
-            if not any(i['sourceName'] == nome_fonte for i in items):
-                obs.send("CreateSceneItem", {
-                    "sceneName": NOME_CENA,
-                    "sourceName": nome_fonte,
-                    "sceneItemEnabled": True
-                })
-                print(f"Fonte adicionada à cena '{NOME_CENA}'")
+    def on_scene_created(self, dados):
+        self._atualizar(lambda e: e["cenas"].add(dados.scene_name))
 
-        except Exception as e:
-            print(f"Erro ao configurar fonte: {str(e)}")
-            return False
+    def on_scene_removed(self, dados):
+        def remover(e):
+            e["cenas"].discard(dados.scene_name)
+            if dados.scene_name == NOME_CENA:
+                e["itens"].clear()
+        self._atualizar(remover)
 
-        # 4. Definir cena ativa
-        obs.send("SetCurrentProgramScene", {"sceneName": NOME_CENA})
-        print("Configuração concluída com sucesso!")
-        return True
+    def on_scene_name_changed(self, dados):
+        self._invalidar()
 
-    except Exception as e:
-        print(f"ERRO CRÍTICO: {str(e)}")
-        
-        return False
+    def on_input_created(self, dados):
+        def criar(e):
+            e["entradas"][dados.input_name] = dados.input_kind
+            e["configuracoes"][dados.input_name] = dict(dados.input_settings)
+        self._atualizar(criar)
 
+    def on_input_removed(self, dados):
+        def remover(e):
+            e["entradas"].pop(dados.input_name, None)
+            e["configuracoes"].pop(dados.input_name, None)
+            e["itens"].pop(dados.input_name, None)
+        self._atualizar(remover)
 
-def autenticar_google_api():
-    creds = None
+    def on_input_name_changed(self, dados):
+        self._invalidar()
 
-    try:
-        if os.path.exists(TOKEN_PICKLE):
-            with open(TOKEN_PICKLE, 'rb') as token:
-                creds = pickle.load(token)
+    def on_input_settings_changed(self, dados):
+        self._atualizar(lambda e: e["configuracoes"].__setitem__(dados.input_name, dict(dados.input_settings)))
+
+    def on_scene_item_created(self, dados):
+        if dados.scene_name == NOME_CENA:
+            self._atualizar(lambda e: e["itens"].__setitem__(dados.source_name, {"id": dados.scene_item_id, "ativo": True}))
+
+    def on_scene_item_removed(self, dados):
+        if dados.scene_name == NOME_CENA:
+            self._atualizar(lambda e: e["itens"].pop(dados.source_name, None))
 
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
+    def on_scene_item_enable_state_changed(self, dados):
+        def alternar(e):
+            for item in e["itens"].values():
+                if item["id"] == dados.scene_item_id:
+                    item["ativo"] = dados.scene_item_enabled
+        if dados.scene_name == NOME_CENA:
+            self._atualizar(alternar)
+
+    def on_current_program_scene_changed(self, dados):
+        self._atualizar(lambda e: e.__setitem__("programa", dados.scene_name))
+
+
+reconciliador_obs = ReconciliadorOBS()
+
+
+# Função para configurar a cena no OBS usando a webcam virtual
+def configurar_cena_obs(nome_fonte="Camera_Seguranca"):
+    print("\nConfigurando OBS com  servidor de streaming...")
+    return reconciliador_obs.reconciliar(nome_fonte)
+
+
+# Renova o token alguns minutos antes de expirar, fora do caminho do alerta
+MARGEM_RENOVACAO_TOKEN = 300
+
+
+# Credenciais e cliente do YouTube compartilhados por todo o processo: o token é lido
+# do disco uma vez, renovado em segundo plano antes de expirar e salvo de forma atômica,
+# e o cliente é construído uma única vez. Cada requisição usa seu próprio Http
+# (requestBuilder), então o mesmo cliente pode ser usado por várias threads.
+class CredenciaisGoogle:
+    def __init__(self, arquivo_token=TOKEN_PICKLE, arquivo_segredo=client_secrets_file, escopos=SCOPES):
+        self.arquivo_token = arquivo_token
+        self.arquivo_segredo = arquivo_segredo
+        self.escopos = escopos
+        self.lock = threading.RLock()
+        self.creds = None
+        self.youtube = None
+        self.renovacoes = 0
+        self.ultima_renovacao = None
+        self.parar_evento = threading.Event()
+        self.thread = None
+
+    def _salvar_token(self):
+        temporario = self.arquivo_token + ".tmp"
+        with open(temporario, 'wb') as token:
+            pickle.dump(self.creds, token)
+        os.replace(temporario, self.arquivo_token)
+
+    def _renovar(self):
+        from google.auth.transport.requests import Request
+        self.creds.refresh(Request())
+        self._salvar_token()
+        self.renovacoes += 1
+        self.ultima_renovacao = datetime.now()
+        print("🔄 Token atualizado com sucesso!")
+
+    def _autorizar(self):
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        if not os.path.exists(self.arquivo_segredo):
+            print(f"❌ Erro: Arquivo de cliente 'client_secret.json' não encontrado em: {self.arquivo_segredo}")
+            return None
+        print("🔐 Iniciando novo fluxo de autenticação com o Google...")
+        flow = InstalledAppFlow.from_client_secrets_file(self.arquivo_segredo, self.escopos)
+        self.creds = flow.run_local_server(port=0)
+        self._salvar_token()
+        print("✅ Token salvo com sucesso!")
+        return self.creds
+
+    def credenciais(self):
+        with self.lock:
+            if self.creds is None and os.path.exists(self.arquivo_token):
+                with open(self.arquivo_token, 'rb') as token:
+                    self.creds = pickle.load(token)
+
+            if self.creds and not self.creds.valid and self.creds.expired and self.creds.refresh_token:
                 try:
-                    creds.refresh(Request())
+                    self._renovar()
                 except Exception as e:
                     print(f"⚠️ Erro ao tentar atualizar o token expirado: {e}")
-                    creds = None  
+                    self.creds = None
+
+            if not self.creds or not self.creds.valid:
+                self.creds = None
+                self._autorizar()
+            return self.creds
+
+    def cliente(self):
+        with self.lock:
+            if self.youtube is not None:
+                return self.youtube
+            try:
+                creds = self.credenciais()
+                if creds is None:
+                    return None
+
+                import httplib2
+                import google_auth_httplib2
+                from googleapiclient.discovery import build
+                from googleapiclient.http import HttpRequest
+
+                def nova_requisicao(http, *args, **kwargs):
+                    return HttpRequest(google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http()), *args, **kwargs)
+
+                self.youtube = build('youtube', 'v3', credentials=creds, requestBuilder=nova_requisicao, cache_discovery=False)
+                print("🎉 Autenticação concluída com sucesso!")
+                return self.youtube
+            except Exception as e:
+                print(f"❌ Erro na autenticação com Google API: {e}")
+                return None
+
+    # Descarta o cliente após um erro; o próximo uso reconstrói a partir das credenciais
+    def descartar(self):
+        with self.lock:
+            self.youtube = None
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._executar, daemon=True, name="credenciais-google")
+            self.thread.start()
+
+    def _executar(self):
+        while not self.parar_evento.is_set():
+            with self.lock:
+                creds = self.creds
+            if creds is None or creds.expiry is None or not creds.refresh_token:
+                espera = 60
             else:
-                creds = None  
+                espera = (creds.expiry - datetime.utcnow()).total_seconds() - MARGEM_RENOVACAO_TOKEN
+            if espera <= 0:
+                try:
+                    with self.lock:
+                        self._renovar()
+                    continue
+                except Exception as e:
+                    print(f"⚠️ Erro ao renovar o token do Google: {e}")
+                    espera = 60
+            self.parar_evento.wait(timeout=min(espera, 3600))
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "cliente_pronto": self.youtube is not None,
+                "expira_em": self.creds.expiry.isoformat() if self.creds is not None and self.creds.expiry else None,
+                "renovacoes": self.renovacoes,
+                "ultima_renovacao": self.ultima_renovacao.isoformat() if self.ultima_renovacao else None,
+            }
 
-        
-        if not creds:
-            print("🔐 Iniciando novo fluxo de autenticação com o Google...")
-            flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, SCOPES)
-            creds = flow.run_local_server(port=0)
+    def parar(self):
+        self.parar_evento.set()
 
-            with open(TOKEN_PICKLE, 'wb') as token:
-                pickle.dump(creds, token)
 
-        youtube = build('youtube', 'v3', credentials=creds)
-        return youtube
+credenciais_google = CredenciaisGoogle()
 
-    except Exception as e:
-        print(f"❌ Erro na autenticação com Google API: {e}")
-        return None
+
+def autenticar_google_api():
+    return credenciais_google.cliente()
 
 
 
-def configurar_e_iniciar_stream_youtube(obs_client, youtube):
+def configurar_e_iniciar_stream_youtube(obs_client, youtube, cancelado=None):
     global usuario_id
     max_tentativas = 3
     tentativa = 0
-    
+    transmissao = None  # broadcast retirado do pool nesta chamada
+    iniciado = False    # start_stream já foi chamado com ele
 
     while tentativa < max_tentativas:
+        if alerta_cancelado(cancelado):
+            print("🛑 Configuração do YouTube interrompida: alerta cancelado")
+            return False
         try:
             # Verificar conexão com o OBS
             if obs_client is None:
                 print("OBS não está conectado! Tentando reconectar...")
                 obs_client = conectar_obs() 
                 if not obs_client:
-                    time.sleep(2)
+                    aguardar_ou_cancelar(cancelado, 2)
                     tentativa += 1
                     continue
 
             # Verificar status de transmissão no OBS
             status = obs_client.get_stream_status()
             if not status.output_active:
-                # Configurar cena se necessário
-                cenas = obs_client.get_scene_list()
-                nomes_cenas = [scene['sceneName'] for scene in cenas.scenes]
-                
-                if NOME_CENA in nomes_cenas:
-                    obs_client.set_current_program_scene(NOME_CENA)
-                    print(f"Mudando para cena: {NOME_CENA}")
-
-                # 1️⃣ Criar Stream no YouTube
-                stream_url, stream_key, stream_id = criar_stream_youtube(youtube)
-                print("✅ Stream criado com sucesso!")
-
-                # 2️⃣ Criar Broadcast no YouTube
-                broadcast_id, live_url = criar_broadcast_youtube(youtube)
-                print("✅ Broadcast criado com sucesso!")
-
-                # 3️⃣ Vincular o Stream à Broadcast
-                vincular_stream_a_broadcast(youtube, broadcast_id, stream_id)
-                print(f"✅ Stream vinculado com sucesso ao broadcast.")
+                # Configurar cena se necessário (o reconciliador já costuma tê-la deixado ativa)
+                if reconciliador_obs.programa_atual() != NOME_CENA:
+                    cenas = obs_client.get_scene_list()
+                    nomes_cenas = [scene['sceneName'] for scene in cenas.scenes]
+
+                    if NOME_CENA in nomes_cenas:
+                        obs_client.set_current_program_scene(NOME_CENA)
+                        print(f"Mudando para cena: {NOME_CENA}")
+
+                # Stream e broadcast já prontos no pool: nenhuma chamada à API aqui
+                transmissao = pool_youtube.retirar() if pool_youtube is not None else None
+                if transmissao:
+                    stream_url, stream_key, broadcast_id, live_url = transmissao
+                    print(f"✅ Broadcast {broadcast_id} retirado do pool")
+                else:
+                    # 1️⃣ Criar Stream no YouTube
+                    stream_url, stream_key, stream_id = criar_stream_youtube(youtube)
+                    print("✅ Stream criado com sucesso!")
+
+                    # 2️⃣ Criar Broadcast no YouTube
+                    broadcast_id, live_url = criar_broadcast_youtube(youtube)
+                    print("✅ Broadcast criado com sucesso!")
+
+                    # 3️⃣ Vincular o Stream à Broadcast
+                    vincular_stream_a_broadcast(youtube, broadcast_id, stream_id)
+                    print(f"✅ Stream vinculado com sucesso ao broadcast.")
+
+                if alerta_cancelado(cancelado):
+                    print("🛑 Alerta cancelado antes de iniciar a transmissão")
+                    if transmissao is not None:
+                        pool_youtube.devolver()
+                    return False
 
                 # 4️⃣ Configurar Stream no OBS - MÉTODO CORRETO para obsws_python
-                obs_client.set_stream_service_settings(
-                    "rtmp_custom",  
-                    {
-                        "server": stream_url,
-                        "key": stream_key,
-                        "use_auth": False
-                    }
-                    )
+                reconciliador_obs.configurar_servico_stream(obs_client, stream_url, stream_key)
                 print("✅ Configurações de stream no OBS aplicadas.")
 
                 # 5️⃣ Iniciar transmissão no OBS
+                iniciado = transmissao is not None
                 obs_client.start_stream()
                 print("🎥 Transmissão iniciada automaticamente!")
 
-                # 6️⃣ Salvar URL da transmissão no Supabase
-                try:
-                    if not usuario_id:
-                        print("❌ Erro: ID_Usuarios não fornecido!")
-                        return None
-
-                    supabase.table('ngrok_links').upsert({
-                        'ID_Usuarios': usuario_id,
-                        'url': live_url,
-                        'created_at': datetime.utcnow().isoformat(),
-                        'updated_at': datetime.utcnow().isoformat(),
-                        'AoVivo': True
-                    }).execute()
-
-                    print("✅ URL salva no Supabase com sucesso.")
-
-                except Exception as e:
-                    print(f"⚠️ Erro ao salvar URL no Supabase: {e}")
+                # 6️⃣ Salvar URL da transmissão no Supabase (em segundo plano, junto com o AoVivo)
+                if not usuario_id:
+                    print("❌ Erro: ID_Usuarios não fornecido!")
+                    return None
+                repositorio_status.definir(True, url=live_url)
 
                 return True
             else:
@@ -397,7 +753,14 @@ def configurar_e_iniciar_stream_youtube(obs_client, youtube):
 
         except Exception as e:
             print(f"Erro ao iniciar transmissão (tentativa {tentativa + 1}/{max_tentativas}): {str(e)}")
-            time.sleep(2)
+            if transmissao is not None:
+                if iniciado:
+                    pool_youtube.descartar()
+                else:
+                    pool_youtube.devolver()
+                transmissao = None
+                iniciado = False
+            aguardar_ou_cancelar(cancelado, 2)
             tentativa += 1
             if tentativa < max_tentativas:
                 try:
@@ -411,7 +774,7 @@ def configurar_e_iniciar_stream_youtube(obs_client, youtube):
 
 
 # Função para criar stream no YouTube
-def criar_stream_youtube(youtube):
+def criar_stream_youtube(youtube, reutilizavel=False):
     try:
         print("🎛️ Criando stream no YouTube...")
 
@@ -427,7 +790,7 @@ def criar_stream_youtube(youtube):
                 "ingestionType": "rtmp"
             },
             "contentDetails": {
-                "isReusable": False
+                "isReusable": reutilizavel
             }
         }
 
@@ -485,7 +848,7 @@ def criar_broadcast_youtube(youtube):
                 "enableAutoStart": True,
                 "enableAutoStop": True,
 
-                "enableEmbed": True  # Permite incorporação
+                "enableEmbed": True,  # Permite incorporação
 
                 "enableDvr": True,
 
@@ -565,6 +928,192 @@ def vincular_stream_a_broadcast(youtube, broadcast_id, stream_id):
 
 
 
+# Pool de transmissões do YouTube
+TAMANHO_POOL_YOUTUBE = 2              # broadcasts prontos aguardando um alerta
+VALIDADE_BROADCAST_HORAS = 24         # broadcasts mais antigos são descartados e recriados
+INTERVALO_REABASTECIMENTO = 600       # segundos entre verificações do pool
+ARQUIVO_POOL_YOUTUBE = os.path.join(BASE_DIR, "youtube_pool.json")
+
+
+# Mantém um stream de ingestão reutilizável e alguns broadcasts já criados, com o
+# primeiro da fila vinculado ao stream: no alerta só falta configurar o OBS e iniciar.
+# O próximo broadcast só é vinculado com a transmissão parada, para o auto-start não
+# disparar um broadcast extra. Cada retirada dispara o reabastecimento em segundo plano.
+# O estado fica em disco para sobreviver a reinícios do serviço.
+class PoolYoutube:
+    def __init__(self, obter_cliente, arquivo=ARQUIVO_POOL_YOUTUBE, tamanho=TAMANHO_POOL_YOUTUBE):
+        self.obter_cliente = obter_cliente
+        self.arquivo = arquivo
+        self.tamanho = tamanho
+        self.lock = threading.Lock()
+        self.stream = None          # {"id", "url", "chave"}
+        self.broadcasts = deque()   # {"id", "url", "vinculado", "criado_em"}
+        self.em_uso = None          # broadcast da transmissão atual
+        self.pedido = threading.Event()
+        self.parar_evento = threading.Event()
+        self.thread = None
+        self.acertos = 0
+        self.faltas = 0
+        self.tempos_retirada_ms = deque(maxlen=100)
+        self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.arquivo, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+            self.stream = estado.get("stream")
+            self.broadcasts = deque(estado.get("broadcasts", []))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Estado do pool do YouTube ignorado: {e}")
+
+    def _salvar(self):
+        try:
+            with open(self.arquivo, "w", encoding="utf-8") as f:
+                json.dump({"stream": self.stream, "broadcasts": list(self.broadcasts)}, f)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar o pool do YouTube: {e}")
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._executar, daemon=True, name="pool-youtube")
+            self.thread.start()
+
+    def _executar(self):
+        while not self.parar_evento.is_set():
+            try:
+                self.reabastecer()
+            except Exception as e:
+                print(f"⚠️ Erro ao reabastecer o pool do YouTube: {e}")
+            self.pedido.wait(timeout=INTERVALO_REABASTECIMENTO)
+            self.pedido.clear()
+
+    def reabastecer(self):
+        youtube = self.obter_cliente()
+        if youtube is None:
+            return
+
+        if self.stream is None:
+            stream_url, stream_key, stream_id = criar_stream_youtube(youtube, reutilizavel=True)
+            if stream_id is None:
+                return
+            with self.lock:
+                self.stream = {"id": stream_id, "url": stream_url, "chave": stream_key}
+                self._salvar()
+
+        limite = time.time() - VALIDADE_BROADCAST_HORAS * 3600
+        with self.lock:
+            vencidos = [b for b in self.broadcasts if b["criado_em"] < limite]
+            self.broadcasts = deque(b for b in self.broadcasts if b["criado_em"] >= limite)
+            faltam = self.tamanho - len(self.broadcasts)
+        for broadcast in vencidos:
+            try:
+                youtube.liveBroadcasts().delete(id=broadcast["id"]).execute()
+            except Exception as e:
+                print(f"⚠️ Erro ao excluir broadcast vencido {broadcast['id']}: {e}")
+
+        for _ in range(faltam):
+            broadcast_id, live_url = criar_broadcast_youtube(youtube)
+            if broadcast_id is None:
+                break
+            with self.lock:
+                self.broadcasts.append({"id": broadcast_id, "url": live_url, "vinculado": False, "criado_em": time.time()})
+
+        with self.lock:
+            proximo = None
+            if self.broadcasts and self.em_uso is None and not self.broadcasts[0]["vinculado"]:
+                proximo = self.broadcasts[0]
+        if proximo is not None and vincular_stream_a_broadcast(youtube, proximo["id"], self.stream["id"]):
+            proximo["vinculado"] = True
+
+        with self.lock:
+            self._salvar()
+            print(f"📦 Pool do YouTube: {len(self.broadcasts)} broadcasts prontos")
+
+    # Entrega (stream_url, stream_key, broadcast_id, live_url) ou None se o pool estiver vazio
+    def retirar(self):
+        inicio = time.time()
+        with self.lock:
+            if self.stream is None or not self.broadcasts:
+                self.faltas += 1
+                self.pedido.set()
+                return None
+            broadcast = self.broadcasts.popleft()
+            stream = dict(self.stream)
+            self.em_uso = broadcast
+            self._salvar()
+
+        if not broadcast["vinculado"]:
+            youtube = self.obter_cliente()
+            if youtube is None or not vincular_stream_a_broadcast(youtube, broadcast["id"], stream["id"]):
+                # O broadcast continua válido: volta para o início da fila e o reabastecimento
+                # tenta vinculá-lo de novo
+                with self.lock:
+                    self.broadcasts.appendleft(broadcast)
+                    self.em_uso = None
+                    self.faltas += 1
+                    self._salvar()
+                self.pedido.set()
+                return None
+
+        with self.lock:
+            self.acertos += 1
+            self.tempos_retirada_ms.append((time.time() - inicio) * 1000)
+        self.pedido.set()
+        return stream["url"], stream["chave"], broadcast["id"], broadcast["url"]
+
+    # Transmissão encerrada: libera o vínculo do próximo broadcast
+    def liberar(self):
+        with self.lock:
+            self.em_uso = None
+        self.pedido.set()
+
+    # Alerta abortado antes do start: o broadcast retirado (já vinculado, nunca iniciado)
+    # volta para o início da fila em vez de ficar preso em em_uso
+    def devolver(self):
+        with self.lock:
+            if self.em_uso is not None:
+                self.broadcasts.appendleft(self.em_uso)
+                self.em_uso = None
+                self._salvar()
+        self.pedido.set()
+
+    # Falha depois do start: o broadcast pode ter entrado no ar, então é excluído para
+    # que o próximo não fique vinculado ao mesmo stream junto com ele
+    def descartar(self):
+        with self.lock:
+            broadcast, self.em_uso = self.em_uso, None
+        if broadcast is not None:
+            try:
+                youtube = self.obter_cliente()
+                if youtube is not None:
+                    youtube.liveBroadcasts().delete(id=broadcast["id"]).execute()
+            except Exception as e:
+                print(f"⚠️ Erro ao excluir o broadcast {broadcast['id']}: {e}")
+        self.pedido.set()
+
+    def estatisticas(self):
+        with self.lock:
+            tempos = list(self.tempos_retirada_ms)
+            return {
+                "stream": self.stream["id"] if self.stream else None,
+                "broadcasts_prontos": len(self.broadcasts),
+                "proximo_vinculado": bool(self.broadcasts and self.broadcasts[0]["vinculado"]),
+                "em_uso": self.em_uso["id"] if self.em_uso else None,
+                "acertos": self.acertos,
+                "faltas": self.faltas,
+                "retirada_ms_media": round(sum(tempos) / len(tempos), 1) if tempos else None,
+            }
+
+    def parar(self):
+        self.parar_evento.set()
+        self.pedido.set()
+
+
+pool_youtube = None
+
+
 # Função para obter o channelId
 def get_channel_id(access_token):
     # URL para obter as informações do canal
@@ -641,31 +1190,11 @@ def parar_transmissao(obs_client):
             # 2. Parar a transmissão
             obs_client.stop_stream()
             print("🛑 Transmissão parada com sucesso no OBS")
+            if pool_youtube is not None:
+                pool_youtube.liberar()
             
-            # 3. Atualizar o último registro no banco de dados
-            try:
-                last_record = supabase.table('ngrok_links')\
-                    .select('ID')\
-                    .eq('ID_Usuarios', usuario_id)\
-                    .order('created_at', desc=True)\
-                    .limit(1)\
-                    .execute()
-
-                if last_record.data:
-                    last_record_id = last_record.data[0]['ID']
-
-                    # Atualizar o registro mais recente
-                    supabase.table('ngrok_links').update({
-                        'AoVivo': False,
-                        'updated_at': datetime.utcnow().isoformat()
-                    }).eq('ID', last_record_id).execute()
-
-                    print(f"✅ Registro {last_record_id} atualizado com AoVivo: False")
-                else:
-                    print("ℹ️ Nenhum registro encontrado para o usuário.")
-
-            except Exception as db_error:
-                print(f"⚠️ Erro ao atualizar banco de dados: {db_error}")
+            # 3. Atualizar o registro no banco de dados
+            repositorio_status.definir(False)
             
             return True
         else:
@@ -677,38 +1206,267 @@ def parar_transmissao(obs_client):
         return False
 
 
-def atualizar_ao_vivo_no_db(status: bool):
-    global usuario_id
-    try:
-        # Buscar o registro mais recente desse usuário
+# Armazém local de eventos (offline first): toda mudança de estado destinada ao Supabase é
+# gravada primeiro num SQLite local, em microssegundos, e replicada depois por uma thread de
+# sincronização em lotes. Com a rede lenta ou fora, o alerta e a gravação não esperam e
+# nada se perde: os eventos ficam no disco até o Supabase confirmar.
+ARQUIVO_EVENTOS = os.path.join(BASE_DIR, "eventos_locais.db")
+ESPERA_MAXIMA_SINCRONIZACAO = 300  # teto do backoff após falhas (segundos)
+RETENCAO_EVENTOS_DIAS = 7          # eventos já sincronizados ficam como histórico local
+
+
+# Cada tipo de evento tem um replicador com:
+#   tipo, tamanho_lote, janela (segundos que o evento mais antigo espera por outros)
+#   replicar(eventos) -> envia os eventos ao Supabase; exceção mantém todos pendentes
+class ArmazemEventos:
+    def __init__(self, arquivo=ARQUIVO_EVENTOS):
+        self.cond = threading.Condition()
+        # Autocommit em WAL com synchronous=NORMAL: cada registro é uma escrita no log, sem fsync
+        self.banco = sqlite3.connect(arquivo, check_same_thread=False, isolation_level=None)
+        self.banco.execute("PRAGMA journal_mode=WAL")
+        self.banco.execute("PRAGMA synchronous=NORMAL")
+        self.banco.execute("CREATE TABLE IF NOT EXISTS eventos ("
+                           "id INTEGER PRIMARY KEY AUTOINCREMENT, chave TEXT UNIQUE NOT NULL, tipo TEXT NOT NULL, "
+                           "dados TEXT NOT NULL, criado_em REAL NOT NULL, sincronizado_em REAL)")
+        self.banco.execute("CREATE INDEX IF NOT EXISTS eventos_pendentes ON eventos (sincronizado_em, tipo, id)")
+        self.replicadores = {}
+        self.tentativas = {}       # tipo -> falhas seguidas
+        self.proxima_tentativa = {}
+        self.pendentes = dict(self.banco.execute(
+            "SELECT tipo, COUNT(*) FROM eventos WHERE sincronizado_em IS NULL GROUP BY tipo").fetchall())
+        self.registrados = 0
+        self.sincronizados = 0
+        self.falhas = 0
+        self.tempos_registro_us = deque(maxlen=1000)
+        self.ultima_limpeza = 0
+        self.parar_evento = threading.Event()
+        self.thread = None
+        if any(self.pendentes.values()):
+            print(f"📥 Eventos locais pendentes de sincronização: {self.pendentes}")
+
+    def adicionar_replicador(self, replicador):
+        self.replicadores[replicador.tipo] = replicador
+
+    # Grava o evento localmente e acorda a sincronização. Uma chave repetida é ignorada,
+    # o que torna o registro idempotente para quem reenviar o mesmo evento.
+    def registrar(self, tipo, dados, chave=None):
+        inicio = time.perf_counter_ns()
+        chave = chave or f"{tipo}:{uuid.uuid4().hex}"
+        with self.cond:
+            cursor = self.banco.execute(
+                "INSERT OR IGNORE INTO eventos (chave, tipo, dados, criado_em) VALUES (?, ?, ?, ?)",
+                (chave, tipo, json.dumps(dados), time.time()))
+            if cursor.rowcount:
+                self.pendentes[tipo] = self.pendentes.get(tipo, 0) + 1
+                self.registrados += 1
+                self.cond.notify_all()
+            self.tempos_registro_us.append((time.perf_counter_ns() - inicio) / 1000)
+        return chave
+
+    def iniciar(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._executar, daemon=True, name="sincronizacao")
+                self.thread.start()
+
+    def parar(self):
+        self.parar_evento.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    # Chamado com a condição adquirida: próximo tipo pronto para replicar, ou o tempo até haver um
+    def _proximo_lote(self):
+        agora = time.time()
+        espera = None
+        for tipo, replicador in self.replicadores.items():
+            if not self.pendentes.get(tipo):
+                continue
+            mais_antigo = self.banco.execute(
+                "SELECT MIN(criado_em) FROM eventos WHERE sincronizado_em IS NULL AND tipo = ?", (tipo,)).fetchone()[0]
+            pronto_em = max(self.proxima_tentativa.get(tipo, 0), agora if self.pendentes[tipo] >= replicador.tamanho_lote
+                            else mais_antigo + replicador.janela)
+            if pronto_em <= agora:
+                linhas = self.banco.execute(
+                    "SELECT id, chave, dados, criado_em FROM eventos WHERE sincronizado_em IS NULL AND tipo = ? "
+                    "ORDER BY id LIMIT ?", (tipo, replicador.tamanho_lote)).fetchall()
+                eventos = [{"id": i, "chave": c, "dados": json.loads(d), "criado_em": t} for i, c, d, t in linhas]
+                return replicador, eventos, None
+            espera = pronto_em - agora if espera is None else min(espera, pronto_em - agora)
+        return None, None, espera
+
+    def _executar(self):
+        while not self.parar_evento.is_set():
+            with self.cond:
+                replicador, eventos, espera = self._proximo_lote()
+                if replicador is None:
+                    self.cond.wait(timeout=espera)
+                    continue
+
+            tipo = replicador.tipo
+            try:
+                replicador.replicar(eventos)
+            except Exception as e:
+                with self.cond:
+                    self.falhas += 1
+                    self.tentativas[tipo] = self.tentativas.get(tipo, 0) + 1
+                    espera = min(2 ** self.tentativas[tipo], ESPERA_MAXIMA_SINCRONIZACAO)
+                    self.proxima_tentativa[tipo] = time.time() + espera
+                print(f"❌ Erro ao sincronizar {len(eventos)} eventos '{tipo}' (nova tentativa em {espera} s): {e}")
+                continue
+
+            agora = time.time()
+            with self.cond:
+                self.banco.executemany("UPDATE eventos SET sincronizado_em = ? WHERE id = ?",
+                                       [(agora, evento["id"]) for evento in eventos])
+                self.pendentes[tipo] -= len(eventos)
+                self.sincronizados += len(eventos)
+                self.tentativas.pop(tipo, None)
+                self.proxima_tentativa.pop(tipo, None)
+                if agora - self.ultima_limpeza > 3600:
+                    self.banco.execute("DELETE FROM eventos WHERE sincronizado_em < ?",
+                                       (agora - RETENCAO_EVENTOS_DIAS * 86400,))
+                    self.ultima_limpeza = agora
+                self.cond.notify_all()
+
+    # Espera todos os eventos chegarem ao Supabase (usado no encerramento)
+    def esvaziar(self, timeout=10):
+        with self.cond:
+            self.proxima_tentativa.clear()
+            self.cond.notify_all()
+            return self.cond.wait_for(lambda: not any(self.pendentes.values()), timeout=timeout)
+
+    def estatisticas(self):
+        with self.cond:
+            mais_antigo = self.banco.execute("SELECT MIN(criado_em) FROM eventos WHERE sincronizado_em IS NULL").fetchone()[0]
+            tempos = list(self.tempos_registro_us)
+            return {
+                "pendentes": {tipo: n for tipo, n in self.pendentes.items() if n},
+                "atraso_sincronizacao_s": round(time.time() - mais_antigo, 1) if mais_antigo is not None else 0,
+                "registrados": self.registrados,
+                "sincronizados": self.sincronizados,
+                "falhas": self.falhas,
+                "registro_us_medio": round(sum(tempos) / len(tempos), 1) if tempos else None,
+                "registro_us_max": round(max(tempos), 1) if tempos else None,
+            }
+
+
+# Criado no primeiro uso (o main() inicia a sincronização), para que importar o módulo
+# não abra o banco local
+def criar_armazem_eventos():
+    armazem = ArmazemEventos()
+    armazem.adicionar_replicador(repositorio_status)
+    armazem.adicionar_replicador(escritor_filmagens)
+    return armazem
+
+
+armazem_eventos = CarregamentoSobDemanda("eventos_locais", criar_armazem_eventos)
+
+
+# Status "Ao Vivo" no banco
+JANELA_COALESCENCIA_STATUS = 0.3  # segundos para absorver alternâncias rápidas antes de gravar
+
+
+# Replicador do registro de ngrok_links do usuário: guarda o ID da linha em memória
+# (uma única consulta por processo) e aplica os eventos "status" pendentes combinados num
+# único update. true -> false -> true dentro da janela não chega a ir ao banco.
+# Conflitos: o update só vale se a linha no banco for mais antiga que o evento local; se
+# outro cliente a alterou depois (ex.: o app), a mudança mais recente prevalece.
+class RepositorioStatus:
+    tipo = "status"
+    tamanho_lote = 1000
+    janela = JANELA_COALESCENCIA_STATUS
+
+    def __init__(self, id_usuario):
+        self.id_usuario = id_usuario
+        self.lock = threading.Lock()
+        self.id_registro = None
+        self.confirmado = {}   # último estado gravado no banco
+        self.idas_ao_banco = 0
+        self.escritas = 0
+        self.combinadas = 0
+        self.conflitos = 0
+
+    def definir(self, ao_vivo, url=None):
+        mudanca = {"AoVivo": ao_vivo}
+        if url is not None:
+            mudanca["url"] = url
+        armazem_eventos.registrar(self.tipo, mudanca)
+
+    def _resolver_registro(self):
         res_busca = supabase.table('ngrok_links')\
-            .select('*')\
-            .eq("ID_Usuarios", usuario_id)\
+            .select('ID')\
+            .eq("ID_Usuarios", self.id_usuario)\
             .order("created_at", desc=True)\
             .limit(1)\
             .execute()
+        self.idas_ao_banco += 1
+        self.id_registro = res_busca.data[0]['ID'] if res_busca.data else None
+
+    def replicar(self, eventos):
+        desejado = {}
+        for evento in eventos:
+            desejado.update(evento["dados"])
+        with self.lock:
+            mudancas = {k: v for k, v in desejado.items() if self.confirmado.get(k) != v}
+            self.combinadas += len(eventos) - (1 if mudancas else 0)
+        if not mudancas:
+            return
+        instante = datetime.utcfromtimestamp(eventos[-1]["criado_em"]).isoformat()
 
-        if res_busca.data:
-            # Se registro existir, atualiza o registro encontrado
-            id_registro = res_busca.data[0]['ID']
-            supabase.table('ngrok_links')\
-                .update({"AoVivo": status, "updated_at": datetime.utcnow().isoformat()})\
-                .eq("ID", id_registro)\
-                .execute()
-            print(f"✅ Registro {id_registro} atualizado com status AoVivo: {status}")
-        else:
-            # Se não existir, cria novo
+        if self.id_registro is None:
+            self._resolver_registro()
+
+        if self.id_registro is None:
             res_insert = supabase.table('ngrok_links').insert({
-                "ID_Usuarios": usuario_id,
-                "AoVivo": status,
-                "url": "",  # opcional: coloque a URL atual se quiser
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
+                "ID_Usuarios": self.id_usuario,
+                "AoVivo": False,
+                "url": "",
+                "created_at": instante,
+                "updated_at": instante,
+                **mudancas,
             }).execute()
-            print(f"✅ Novo registro criado para {usuario_id} com status AoVivo: {status}")
+            self.idas_ao_banco += 1
+            self.id_registro = res_insert.data[0]['ID']
+            print(f"✅ Novo registro criado para {self.id_usuario} com {mudancas}")
+        else:
+            res_update = supabase.table('ngrok_links')\
+                .update({"updated_at": instante, **mudancas})\
+                .eq("ID", self.id_registro)\
+                .lt("updated_at", instante)\
+                .execute()
+            self.idas_ao_banco += 1
+            if not res_update.data:
+                # Nenhuma linha mais antiga: ou o registro sumiu, ou foi alterado depois do evento
+                self._resolver_registro()
+                if self.id_registro is None:
+                    return self.replicar(eventos)
+                with self.lock:
+                    self.conflitos += 1
+                print(f"⚠️ Registro {self.id_registro} alterado depois de {instante}; mudança local {mudancas} descartada")
+                return
+            print(f"✅ Registro {self.id_registro} atualizado com {mudancas}")
+
+        with self.lock:
+            self.confirmado.update(mudancas)
+            self.escritas += 1
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "id_registro": self.id_registro,
+                "confirmado": dict(self.confirmado),
+                "idas_ao_banco": self.idas_ao_banco,
+                "escritas": self.escritas,
+                "combinadas": self.combinadas,
+                "conflitos": self.conflitos,
+            }
 
-    except Exception as e:
-        print(f"❌ Erro ao atualizar banco de dados: {e}")
+
+repositorio_status = RepositorioStatus(usuario_id)
+
+
+def atualizar_ao_vivo_no_db(status: bool):
+    repositorio_status.definir(status)
 
 
 
@@ -737,7 +1495,9 @@ def converter_para_mp4_compativel(caminho_entrada, caminho_saida):
         print(f"❌ Erro na conversão: {e.stderr.decode()}")
         return False
 
-def enviar_video_supabase(caminho_local):
+# Prepara a gravação e a coloca na fila de upload retomável; a filmagem é registrada
+# no banco quando o upload termina, mesmo que isso aconteça depois de um reinício
+def enviar_video_supabase(caminho_local, inicio, fim, duracao, dispositivo, evento):
     global usuario_id
     try:
         # Verificar se o usuário_id foi fornecido
@@ -749,492 +1509,2466 @@ def enviar_video_supabase(caminho_local):
             print("❌ Erro: Arquivo de vídeo inválido ou vazio!")
             return None
 
-        if not verificar_video_valido(caminho_local):
+        # O manifesto do gravador já traz a contagem de frames; sem ele (gravações antigas)
+        # o arquivo é aberto para conferir
+        manifesto = ler_manifesto(caminho_local)
+        if manifesto is not None and manifesto["frames"] == 0:
+            print("❌ Erro: Gravação sem frames!")
+            return None
+
+        # Gravações do ffmpeg já saem em MP4 H.264 prontas para o navegador
+        if not caminho_local.endswith(".mp4") and manifesto is None and not verificar_video_valido(caminho_local):
             print("⚠️ Vídeo incompatível - convertendo para formato MP4 padrão...")
             temp_path = caminho_local + ".converted.mp4"
             if converter_para_mp4_compativel(caminho_local, temp_path):
                 caminho_local = temp_path
+                manifesto = None
             else:
                 return None
 
         nome_arquivo = os.path.basename(caminho_local)
         tamanho_mb = os.path.getsize(caminho_local) / (1024 * 1024)
-        print(f"📤 Enviando {nome_arquivo} (Tamanho: {tamanho_mb:.2f} MB)")
-
-        upload_options = {
-            "content-type": "video/x-matroska",  # ou "video/mp4" se já convertido
-            "cache-control": "3600",
-            "x-upsert": "true"
-        }
-        chunk_size = 1024 * 1024 * 5  # 5 MB por chunk
-        file_size = os.path.getsize(caminho_local)
+        print(f"📥 {nome_arquivo} na fila de upload (Tamanho: {tamanho_mb:.2f} MB)")
 
+        tipo = "video/mp4" if caminho_local.endswith(".mp4") else "video/x-matroska"
         # 📁 Define o caminho com subpasta do usuário
         path = f"gravacoes/{usuario_id}/{nome_arquivo}"
+        registro = {"inicio": inicio.isoformat(), "fim": fim.isoformat(), "duracao": duracao,
+                    "dispositivo": dispositivo, "evento": evento}
+        return fila_uploads.enfileirar(caminho_local, path, tipo, registro)
 
-        with open(caminho_local, "rb") as f:
-            if file_size > chunk_size:
-                response = supabase.storage.from_("filmagens").upload(
-                    path=path,
-                    file=f,
-                    file_options=upload_options,
-                    chunk_size=chunk_size
-                )
-            else:
-                response = supabase.storage.from_("filmagens").upload(
-                    path=path,
-                    file=f,
-                    file_options=upload_options
-                )
+    except Exception as e:
+        print(f"❌ Erro ao enviar vídeo para o Supabase: {e}")
+        return None
 
-        if not response or hasattr(response, 'error'):
-            print("❌ Erro no upload:", getattr(response, 'error', 'Resposta inválida'))
-            return None
 
-        # Gera URL pública e força cache-buster
-        url_publica = supabase.storage.from_("filmagens").get_public_url(path)
-        url_publica += f"?t={int(time.time())}"
+# Resolução padrão dos frames do pipeline de captura
+LARGURA_FRAME = 1280
+ALTURA_FRAME = 720
+CAPACIDADE_BUFFER_FRAMES = 8  # ~0,25 s de folga a 30 fps
+
+# Cores e configurações de exibição
+COR_PESSOA = (61, 0, 134)
+COR_TEXTO = (61, 0, 134)
+
+
+# Buffer circular de tamanho fixo com frames pré-alocados.
+# O produtor nunca bloqueia: com o buffer cheio, o frame mais antigo é sobrescrito.
+class BufferCircularFrames:
+    def __init__(self, capacidade=CAPACIDADE_BUFFER_FRAMES, largura=LARGURA_FRAME, altura=ALTURA_FRAME):
+        self.capacidade = capacidade
+        self.largura = largura
+        self.altura = altura
+        self.frames = np.zeros((capacidade, altura, largura, 3), dtype=np.uint8)
+        self.sequencia = 0  # sequência do último frame publicado (0 = vazio)
+        self.fechado = False
+        self.cond = threading.Condition()
+
+    # Copia o frame para o próximo slot, redimensionando direto no slot se necessário
+    def publicar(self, frame):
+        with self.cond:
+            destino = self.frames[self.sequencia % self.capacidade]
+            if frame.shape[:2] == (self.altura, self.largura):
+                np.copyto(destino, frame)
+            else:
+                cv2.resize(frame, (self.largura, self.altura), dst=destino)
+            self.sequencia += 1
+            self.cond.notify_all()
+            return self.sequencia
+
+    # Aguarda um frame mais novo que 'ultima_sequencia' e copia para 'destino'.
+    # Com em_ordem=True entrega o próximo frame ainda disponível (para o gravador não pular
+    # frames enquanto houver folga); senão entrega sempre o mais recente.
+    # Retorna a sequência do frame copiado ou 0 se expirou o timeout / o buffer foi fechado.
+    def ler(self, destino, ultima_sequencia=0, em_ordem=False, timeout=1.0):
+        with self.cond:
+            self.cond.wait_for(lambda: self.fechado or self.sequencia > ultima_sequencia, timeout)
+            if self.sequencia <= ultima_sequencia:
+                return 0
+            if em_ordem:
+                mais_antiga = max(1, self.sequencia - self.capacidade + 1)
+                sequencia = max(ultima_sequencia + 1, mais_antiga)
+            else:
+                sequencia = self.sequencia
+            np.copyto(destino, self.frames[(sequencia - 1) % self.capacidade])
+            return sequencia
+
+    def fechar(self):
+        with self.cond:
+            self.fechado = True
+            self.cond.notify_all()
+
+
+# Rastreamento entre keyframes do YOLO e passo adaptativo da detecção (em frames da câmera)
+PASSO_DETECCAO_INICIAL = 2
+PASSO_DETECCAO_MIN = 1
+PASSO_DETECCAO_MAX = 15
+IOU_MINIMO_RASTREIO = 0.3
+MAX_DETECCOES_PERDIDAS = 3
+HORIZONTE_MAXIMO_PREVISAO = PASSO_DETECCAO_MAX  # frames além do último keyframe que a velocidade ainda vale
+
+
+# Interseção sobre união de duas caixas (x1, y1, x2, y2)
+def calcular_iou(a, b):
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return float(inter / (area_a + area_b - inter))
+
+
+# Trilha de uma pessoa: caixa e velocidade (pixels por frame) estimadas por um filtro alfa-beta
+class TrilhaPessoa:
+    def __init__(self, id_trilha, caixa, sequencia):
+        self.id = id_trilha
+        self.caixa = np.array(caixa, dtype=np.float32)
+        self.velocidade = np.zeros(4, dtype=np.float32)
+        self.sequencia = sequencia
+        self.perdidas = 0
+
+    # A extrapolação para no horizonte máximo: sem keyframe novo a caixa não segue andando
+    def prever(self, sequencia):
+        passos = min(sequencia - self.sequencia, HORIZONTE_MAXIMO_PREVISAO)
+        return self.caixa + self.velocidade * passos
+
+
+# Rastreador IoU: associa as detecções de cada keyframe às trilhas existentes, mantendo IDs
+# estáveis, e propaga as caixas nos frames intermediários pela velocidade estimada
+class RastreadorPessoas:
+    ALFA = 0.6
+    BETA = 0.2
+
+    def __init__(self, largura=LARGURA_FRAME, altura=ALTURA_FRAME):
+        self.lock = threading.Lock()
+        self.trilhas = []
+        self.proximo_id = 1
+        self.limites = np.array([largura - 1, altura - 1, largura - 1, altura - 1], dtype=np.float32)
+
+    # Atualiza com as detecções de um keyframe.
+    # Retorna o ID da trilha de cada detecção e a incerteza do keyframe (0 a 1).
+    def atualizar(self, detections, sequencia):
+        with self.lock:
+            previstas = [t.prever(sequencia) for t in self.trilhas]
+
+            # Associação gulosa pelos maiores IoUs
+            pares = sorted(((calcular_iou(p, d), i, j)
+                            for i, p in enumerate(previstas)
+                            for j, d in enumerate(detections)), reverse=True)
+            trilha_da_deteccao = {}
+            associadas = set()
+            for iou, i, j in pares:
+                if iou < IOU_MINIMO_RASTREIO:
+                    break
+                if i in associadas or j in trilha_da_deteccao:
+                    continue
+                associadas.add(i)
+                trilha_da_deteccao[j] = i
+
+            residuo_total = 0.0
+            for j, i in trilha_da_deteccao.items():
+                trilha = self.trilhas[i]
+                passos = max(1, sequencia - trilha.sequencia)
+                residuo = np.asarray(detections[j], dtype=np.float32) - previstas[i]
+                trilha.caixa = previstas[i] + self.ALFA * residuo
+                trilha.velocidade += self.BETA * residuo / passos
+                trilha.sequencia = sequencia
+                trilha.perdidas = 0
+                altura = max(1.0, float(trilha.caixa[3] - trilha.caixa[1]))
+                residuo_total += min(1.0, float(np.abs(residuo).max()) / altura)
+
+            # Trilhas sem detecção ficam paradas na posição prevista até expirarem
+            perdidas = 0
+            for i, trilha in enumerate(self.trilhas):
+                if i not in associadas:
+                    trilha.caixa = previstas[i]
+                    trilha.velocidade[:] = 0
+                    trilha.sequencia = sequencia
+                    trilha.perdidas += 1
+                    perdidas += 1
+
+            ids = []
+            novas = 0
+            for j, caixa in enumerate(detections):
+                if j in trilha_da_deteccao:
+                    ids.append(self.trilhas[trilha_da_deteccao[j]].id)
+                else:
+                    trilha = TrilhaPessoa(self.proximo_id, caixa, sequencia)
+                    self.proximo_id += 1
+                    self.trilhas.append(trilha)
+                    ids.append(trilha.id)
+                    novas += 1
+
+            self.trilhas = [t for t in self.trilhas if t.perdidas <= MAX_DETECCOES_PERDIDAS]
+
+            total = max(1, len(detections), len(previstas))
+            incerteza = min(1.0, (novas + perdidas + residuo_total) / total)
+            return ids, incerteza
+
+    # Frame barrado pelo filtro de movimento: a cena não mudou, então as trilhas ficam
+    # paradas onde estão (observação estática, velocidade zerada)
+    def congelar(self, sequencia):
+        with self.lock:
+            for trilha in self.trilhas:
+                trilha.caixa = np.clip(trilha.prever(sequencia), 0, self.limites)
+                trilha.velocidade[:] = 0
+                trilha.sequencia = sequencia
+
+    # Caixas previstas para o frame 'sequencia' das trilhas atualmente visíveis
+    def prever(self, sequencia):
+        with self.lock:
+            caixas = []
+            for trilha in self.trilhas:
+                if trilha.perdidas:
+                    continue
+                x1, y1, x2, y2 = np.clip(trilha.prever(sequencia), 0, self.limites).astype(int)
+                caixas.append((trilha.id, (int(x1), int(y1), int(x2), int(y2))))
+            return caixas
+
+    # Maior velocidade entre as trilhas visíveis, em pixels por frame
+    def movimento(self):
+        with self.lock:
+            velocidades = [float(np.abs(t.velocidade).max()) for t in self.trilhas if not t.perdidas]
+            return max(velocidades, default=0.0)
+
+
+# Decide de quantos em quantos frames o YOLO roda: alarga o passo com a cena parada
+# e estreita quando as trilhas ficam incertas ou as pessoas se movem rápido
+class AgendadorDeteccao:
+    def __init__(self):
+        self.passo = PASSO_DETECCAO_INICIAL
+        self.keyframes = 0
+
+    def registrar(self, incerteza, movimento):
+        self.keyframes += 1
+        if incerteza > 0.3 or movimento > 4.0:
+            self.passo = max(PASSO_DETECCAO_MIN, self.passo // 2)
+        elif incerteza < 0.1 and movimento < 1.0:
+            self.passo = min(PASSO_DETECCAO_MAX, self.passo + 1)
+
+
+# Pré-filtro de movimento: o YOLO só roda quando a área alterada passa do limiar
+# ou quando a câmera ficou tempo demais sem nenhuma avaliação
+LARGURA_FILTRO_MOVIMENTO = 160
+ALTURA_FILTRO_MOVIMENTO = 90
+LIMIAR_PIXEL_MOVIMENTO = 25      # diferença mínima de intensidade (0-255) para contar um pixel
+LIMIAR_AREA_MOVIMENTO = 0.005    # fração da imagem que precisa mudar
+INTERVALO_MAXIMO_OCIOSO = 5.0    # segundos sem YOLO antes de forçar uma avaliação
+
+
+# Diferença de frames numa cópia reduzida em tons de cinza, comparada com o último
+# frame que passou pelo YOLO (assim mudanças lentas também acabam sendo avaliadas)
+class FiltroMovimento:
+    def __init__(self, limiar_area=LIMIAR_AREA_MOVIMENTO, intervalo_maximo=INTERVALO_MAXIMO_OCIOSO):
+        self.limiar_area = limiar_area
+        self.intervalo_maximo = intervalo_maximo
+        tamanho = (ALTURA_FILTRO_MOVIMENTO, LARGURA_FILTRO_MOVIMENTO)
+        self.reduzido = np.empty(tamanho + (3,), dtype=np.uint8)
+        self.cinza = np.empty(tamanho, dtype=np.uint8)
+        self.diferenca = np.empty(tamanho, dtype=np.uint8)
+        self.referencia = None
+        self.ultima_avaliacao = 0.0
+        self.area_alterada = 0.0
+        self.avaliados = 0
+        self.bloqueados = 0
+
+    # Retorna True se o frame deve passar pelo YOLO
+    def avaliar(self, frame):
+        cv2.resize(frame, (LARGURA_FILTRO_MOVIMENTO, ALTURA_FILTRO_MOVIMENTO),
+                   dst=self.reduzido, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.reduzido, cv2.COLOR_BGR2GRAY, dst=self.cinza)
+        cv2.GaussianBlur(self.cinza, (5, 5), 0, dst=self.cinza)
+        agora = time.time()
+
+        if self.referencia is None:
+            self.area_alterada = 1.0
+        else:
+            cv2.absdiff(self.cinza, self.referencia, dst=self.diferenca)
+            self.area_alterada = np.count_nonzero(self.diferenca > LIMIAR_PIXEL_MOVIMENTO) / self.diferenca.size
 
-        try:
-            head_response = requests.head(url_publica, timeout=10)
-            if head_response.status_code != 200:
-                print(f"❌ Arquivo não acessível (HTTP {head_response.status_code})")
-                return None
-        except requests.RequestException as e:
-            print(f"❌ Falha ao verificar acessibilidade: {e}")
-            return None
+        if self.area_alterada < self.limiar_area and agora - self.ultima_avaliacao < self.intervalo_maximo:
+            self.bloqueados += 1
+            return False
 
-        return url_publica
+        if self.referencia is None:
+            self.referencia = self.cinza.copy()
+        else:
+            np.copyto(self.referencia, self.cinza)
+        self.ultima_avaliacao = agora
+        self.avaliados += 1
+        return True
 
-    except Exception as e:
-        print(f"❌ Erro ao enviar vídeo para o Supabase: {e}")
-        return None
+    def contadores(self):
+        return {
+            "avaliados": self.avaliados,
+            "bloqueados": self.bloqueados,
+            "area_alterada": round(float(self.area_alterada), 4),
+        }
 
 
-# Função para processar as detecções de segurança
-def processar_deteccoes():
-    global grava, transmite, latest_frame
+# Últimas detecções publicadas pelo detector e consumidas pelo compositor
+class EstadoDeteccao:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rastreador = RastreadorPessoas()
+        self.agendador = AgendadorDeteccao()
+        self.face_img = None
+
+
+# Uma fonte de vídeo do motor de detecção: índice de câmera local ou URL (ex.: IP Webcam)
+class FonteCamera:
+    def __init__(self, nome, origem):
+        self.nome = nome
+        self.origem = origem
+        self.cap = None
+        self.buffer = BufferCircularFrames()
+        self.buffer_exibicao = BufferCircularFrames(capacidade=2)
+        self.estado = EstadoDeteccao()
+        self.filtro_movimento = FiltroMovimento()
+        # Área de trabalho do detector, reaproveitada a cada tick
+        self.frame_detector = np.empty((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8)
+        self.frame_rgb = np.empty((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8)
+        self.ultima_sequencia_detector = 0
+        self.ultima_avaliacao_detector = 0.0
+        self.avisos = set()      # eventos sinalizados a cada frame capturado
+        self.pre_evento = None   # BufferPreEvento, quando a captura é permanente
+        self.latencia_inicio_ms = None  # alerta -> início da última gravação
+        self.viva = True                # False enquanto a captura tenta reabrir a câmera
+        self.dono_exibicao = None       # evento 'parar' da sessão que publica a exibição
+        self.lock_exibicao = threading.Lock()
+
+    def abrir(self):
+        if isinstance(self.origem, int):
+            self.cap = cv2.VideoCapture(self.origem, cv2.CAP_DSHOW)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, LARGURA_FRAME)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, ALTURA_FRAME)
+        else:
+            self.cap = cv2.VideoCapture(self.origem)
 
-    # Obtém câmeras disponíveis
-    cameras_disponiveis = list_cameras()
-    
-    if not cameras_disponiveis:
-        print("❌ Nenhuma câmera disponível!")
-        return
+        if self.cap.isOpened():
+            print(f"✅ Câmera '{self.nome}' aberta com sucesso!")
+            registro_cameras.marcar_em_uso(self.origem)
+            return True
 
-    indice_camera = cameras_disponiveis[0] 
+        print(f"❌ Falha ao abrir a câmera '{self.nome}'")
+        self.cap.release()
+        self.cap = None
+        return False
 
-    # Inicializa captura de vídeo
-    cap = cv2.VideoCapture(indice_camera, cv2.CAP_DSHOW)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    def liberar(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+            registro_cameras.marcar_livre(self.origem)
+
+    # Uma única sessão publica os frames anotados da câmera: a primeira que pedir, e de
+    # novo qualquer uma que ainda grave quando a dona encerrar (o 'parar' dela foi acionado)
+    def assumir_exibicao(self, parar):
+        with self.lock_exibicao:
+            if self.dono_exibicao is None or self.dono_exibicao.is_set():
+                self.dono_exibicao = parar
+            return self.dono_exibicao is parar
+
+
+# Modos do motor de detecção
+MODO_OCIOSO = "ocioso"            # câmeras abertas, YOLO parado
+MODO_MONITORANDO = "monitorando"  # YOLO em baixa taxa, mantém rastreador e modelos quentes
+MODO_GRAVANDO = "gravando"        # taxa cheia durante um alerta
+INTERVALO_MONITORAMENTO = 1.0     # segundos entre avaliações por câmera no modo monitorando
+
+
+# Motor de detecção multi-câmera: uma thread de captura por fonte e uma única
+# thread de inferência que empilha os frames mais recentes numa chamada em lote do YOLO.
+# Fontes que já chegam abertas (captura permanente) são reaproveitadas sem reabrir a câmera.
+class MotorDeteccao:
+    def __init__(self, fontes, modo=MODO_GRAVANDO):
+        self.fontes = fontes
+        self.proprias = []  # fontes abertas por este motor (liberadas no parar)
+        self.modo = modo
+        self.parar_evento = threading.Event()
+        self.novo_frame = threading.Event()
+        self.pronto = threading.Event()  # modelos carregados e aquecidos
+        self.tempo_aquecimento_ms = None
+        self.threads = []
+
+    def iniciar(self):
+        fontes = []
+        for fonte in self.fontes:
+            if fonte.cap is not None and not fonte.buffer.fechado:
+                fontes.append(fonte)
+            elif fonte.abrir():
+                fontes.append(fonte)
+                self.proprias.append(fonte)
+        self.fontes = fontes
+        if not self.fontes:
+            print("❌ Não foi possível conectar a nenhuma câmera!")
+            return False
 
-    if cap.isOpened():
-        print(f"✅ Câmera local {indice_camera} aberta com sucesso!")
-    else:
-        print(f"❌ Falha ao abrir a câmera {indice_camera}")
-        cap.release()
-        return
+        for fonte in self.fontes:
+            fonte.avisos.add(self.novo_frame)
+        for fonte in self.proprias:
+            self.threads.append(threading.Thread(target=capturar_frames, args=(fonte, self.parar_evento), daemon=True))
+        self.threads.append(threading.Thread(target=detectar_pessoas, args=(self,), daemon=True))
+        for t in self.threads:
+            t.start()
+        return True
 
-    # Fallback para IP Webcam se nenhuma câmera local funcionar
-    if cap is None or not cap.isOpened():
-        print("❌ Nenhuma câmera local disponível! Tentando conexão com IP Webcam...")
-        cap = cv2.VideoCapture(IP_WEBCAM_URL)
+    # O motor continua ativo enquanto ao menos uma câmera estiver entregando frames
+    def ativo(self):
+        return not self.parar_evento.is_set() and any(not f.buffer.fechado for f in self.fontes)
+
+    def parar(self):
+        self.parar_evento.set()
+        self.novo_frame.set()
+        for fonte in self.proprias:
+            fonte.buffer.fechar()
+            fonte.buffer_exibicao.fechar()
+        for t in self.threads:
+            t.join(timeout=5)
+        for fonte in self.proprias:
+            fonte.liberar()
+        for fonte in self.fontes:
+            fonte.avisos.discard(self.novo_frame)
+            c = fonte.filtro_movimento.contadores()
+            print(f"📊 '{fonte.nome}': {c['avaliados']} frames avaliados pelo YOLO, {c['bloqueados']} bloqueados pelo filtro de movimento")
+
+    def estatisticas(self):
+        estatisticas = {}
+        for fonte in self.fontes:
+            estatisticas[fonte.nome] = fonte.filtro_movimento.contadores()
+            estatisticas[fonte.nome]["passo_deteccao"] = fonte.estado.agendador.passo
+            estatisticas[fonte.nome]["latencia_inicio_ms"] = fonte.latencia_inicio_ms
+        return estatisticas
+
+
+# Registro de câmeras
+INTERVALO_ATUALIZACAO_CAMERAS = 300  # segundos entre varreduras completas
+INTERVALO_HOTPLUG = 2.0              # segundos entre verificações de dispositivos conectados
+TIMEOUT_PRIMEIRA_VARREDURA = 30      # espera máxima pela primeira varredura no caminho do alerta
+
+
+# Abre o índice, lê um frame e guarda resolução e fps informados pelo driver
+def sondar_camera(indice):
+    cap = cv2.VideoCapture(indice)  # sem cv2.CAP_DSHOW
+    try:
         if not cap.isOpened():
-            print("❌ Não foi possível conectar a nenhuma câmera!")
-            return
+            return None
+        ret, frame = cap.read()
+        if not ret or frame is None or frame.size == 0:
+            return None
+        return {
+            "largura": frame.shape[1],
+            "altura": frame.shape[0],
+            "fps": cap.get(cv2.CAP_PROP_FPS) or None,
+        }
+    finally:
+        cap.release()
 
-    # Configura gravação local
-    hora_inicio = datetime.now()
-    nome_arquivo = f"gravacao_{hora_inicio.strftime('%Y%m%d_%H%M%S')}.mkv"
-    caminho_video = os.path.join(BASE_DIR, "gravacoes", nome_arquivo)
-    os.makedirs(os.path.dirname(caminho_video), exist_ok=True)
-    
-    codec = cv2.VideoWriter_fourcc(*'XVID')
-    gravador = cv2.VideoWriter(caminho_video, codec, fps, (1280, 720))
-
-    # Cores e configurações de exibição
-    COR_PESSOA = (61, 0, 134)
-    COR_TEXTO = (61, 0, 134)
-
-    # Inicializa detecção de faces
-    with mp_face.FaceDetection(model_selection=0, min_detection_confidence=0.5) as face_detection:
-        frame_counter = 0
-        detections = []
-        face_img = None
-
-        while grava:
-            start_time = time.time()
-            ret, frame = cap.read()
-            if not ret:
-                print("❌ Falha ao capturar frame!")
-                break
 
-            # Preprocessamento do frame
-            frame = cv2.resize(frame, (1280, 720))
-            display = frame.copy()
-
-            # Detecta pessoas a cada 4 frames (para performance)
-            if frame_counter % 2 == 0:
-                results = yolo_model(frame, imgsz=640, conf=0.6)[0]
-                detections = []
-
-                for det in results.boxes:
-                    cls = int(det.cls.item())
-                    if cls == 0:  # Classe 'pessoa' no YOLO
-                        x1, y1, x2, y2 = map(int, det.xyxy[0])
-                        detections.append((x1, y1, x2, y2))
-                        cv2.rectangle(display, (x1, y1), (x2, y2), COR_PESSOA, 2)
-                        cv2.putText(display, "PESSOA", (x1, y1 - 10),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
-
-                        # Detecção de rostos na área da pessoa
-                        corpo = frame[y1:y2, x1:x2]
-                        if corpo.size > 0:
-                            rgb = cv2.cvtColor(corpo, cv2.COLOR_BGR2RGB)
-                            faces = face_detection.process(rgb)
-
-                            if faces.detections:
-                                for f in faces.detections:
-                                    bbox = f.location_data.relative_bounding_box
-                                    ih, iw = corpo.shape[:2]
-                                    fx, fy, fw, fh = int(bbox.xmin * iw), int(bbox.ymin * ih), int(bbox.width * iw), int(bbox.height * ih)
-                                    abs_x, abs_y = x1 + fx, y1 + fy
-
-                                    try:
-                                        face_crop = frame[max(0, abs_y-30):min(720, abs_y+fh+30),
-                                                        max(0, abs_x-30):min(1280, abs_x+fw+30)]
-                                        face_img = cv2.resize(face_crop, (200, 200))
-                                        display[20:220, 1060:1260] = face_img
-                                        cv2.rectangle(display, (1059, 19), (1261, 221), COR_PESSOA, 2)
-                                        cv2.putText(display, "Rosto", (1070, 30),
-                                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
-                                    except Exception as e:
-                                        print(f"Erro no processamento do rosto: {e}")
-
-            # Redesenha detecções do frame anterior
-            for (x1, y1, x2, y2) in detections:
-                cv2.rectangle(display, (x1, y1), (x2, y2), COR_PESSOA, 2)
-                cv2.putText(display, "PESSOA", (x1, y1 - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
-
-            # Mostra rosto detectado se existir
-            if face_img is not None:
-                display[20:220, 1060:1260] = face_img
-                cv2.rectangle(display, (1059, 19), (1261, 221), COR_PESSOA, 2)
-                cv2.putText(display, "Rosto", (1070, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
-
-            frame_counter += 1
-
-            gravador.write(display)
-
-            fps_calc = 1.0 / (time.time() - start_time)
-
-            # Overlay de status
-            status_text = "Gravando..."
-            if transmite:
-                status_text = "Transmitindo: Seguranca 24 horas"
-
-            overlay = display.copy()
-            cv2.rectangle(overlay, (0, 0), (1280, 40), (0, 0, 0), -1)
-            alpha = 0.4
-            cv2.addWeighted(overlay, alpha, display, 1 - alpha, 0, display)
-            cv2.putText(display, status_text, (10, 30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
-
-            cv2.putText(display, f"FPS: {fps_calc:.1f}", (10, 70),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-
-            #cv2.imshow('Deteccao de Seguranca - OBS', display)
-            #if cv2.waitKey(1) == 27:
-            #    grava = False
-
-            time.sleep(max(0, 0.033 - (time.time() - start_time)))
-
-            # Atualiza o frame mais recente para o servidor Flask
-            with frame_lock:
-                _, buffer = cv2.imencode('.jpg', display)
-                latest_frame = buffer.tobytes()
+# Assinatura barata dos dispositivos de vídeo conectados (Linux); onde não existe
+# /dev/video* fica vazia e só a varredura periódica detecta câmeras novas
+def assinatura_dispositivos():
+    return tuple(sorted(glob.glob("/dev/video*")))
+
+
+# Registro de câmeras: descobre os dispositivos numa thread de fundo, guarda as
+# capacidades em memória e revarre por timer ou quando a lista de dispositivos muda.
+# Índices em uso pelo próprio sistema não são reabertos, continuam no cache.
+class RegistroCameras:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cameras = {}        # indice -> {"largura", "altura", "fps"}
+        self.ip_webcam = False
+        self.em_uso = set()
+        self.pronto = threading.Event()
+        self.pedido = threading.Event()
+        self.parar_evento = threading.Event()
+        self.ultima_varredura = None
+        self.duracao_varredura_ms = None
+        self.thread = None
+
+    def iniciar(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._executar, daemon=True, name="registro-cameras")
+            self.thread.start()
+
+    def marcar_em_uso(self, origem):
+        with self.lock:
+            self.em_uso.add(origem)
+
+    def marcar_livre(self, origem):
+        with self.lock:
+            self.em_uso.discard(origem)
+
+    def atualizar(self):
+        self.pedido.set()
+
+    def _varrer(self):
+        inicio = time.time()
+        with self.lock:
+            em_uso = set(self.em_uso)
+            anteriores = dict(self.cameras)
+
+        cameras = {}
+        indice = 0
+        while True:
+            if indice in em_uso:
+                cameras[indice] = anteriores.get(indice, {})
+            else:
+                capacidades = sondar_camera(indice)
+                if capacidades is None:
+                    break
+                cameras[indice] = capacidades
+            indice += 1
+        ip_webcam = bool(IP_WEBCAM_URL) and testar_conexao_ip_webcam()
+
+        with self.lock:
+            self.cameras = cameras
+            self.ip_webcam = ip_webcam
+            self.ultima_varredura = time.time()
+            self.duracao_varredura_ms = (self.ultima_varredura - inicio) * 1000
+        if cameras.keys() != anteriores.keys() or not self.pronto.is_set():
+            print(f"📷 Câmeras disponíveis: {sorted(cameras)} (varredura em {self.duracao_varredura_ms:.0f} ms)")
+        self.pronto.set()
+
+    def _executar(self):
+        assinatura = assinatura_dispositivos()
+        while not self.parar_evento.is_set():
+            try:
+                self._varrer()
+            except Exception as e:
+                print(f"⚠️ Erro na varredura de câmeras: {e}")
+                self.pronto.set()
+
+            limite = time.time() + INTERVALO_ATUALIZACAO_CAMERAS
+            while time.time() < limite and not self.parar_evento.is_set():
+                if self.pedido.wait(timeout=INTERVALO_HOTPLUG):
+                    self.pedido.clear()
+                    break
+                atual = assinatura_dispositivos()
+                if atual != assinatura:
+                    assinatura = atual
+                    print("🔌 Dispositivos de vídeo alterados, atualizando câmeras...")
+                    break
+
+    # Consulta em memória; só bloqueia se a primeira varredura ainda não terminou
+    def listar(self, timeout=TIMEOUT_PRIMEIRA_VARREDURA):
+        self.iniciar()
+        if not self.pronto.wait(timeout=timeout):
+            print("⚠️ Varredura de câmeras ainda em andamento")
+        with self.lock:
+            return dict(self.cameras), self.ip_webcam
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "cameras": {str(indice): capacidades for indice, capacidades in self.cameras.items()},
+                "ip_webcam": self.ip_webcam,
+                "em_uso": [str(origem) for origem in self.em_uso],
+                "ultima_varredura": datetime.fromtimestamp(self.ultima_varredura).isoformat() if self.ultima_varredura else None,
+                "duracao_varredura_ms": self.duracao_varredura_ms,
+            }
 
+    def parar(self):
+        self.parar_evento.set()
+        self.pedido.set()
 
-    # Libera recursos
-    cap.release()
-    gravador.release()
-    #cv2.destroyAllWindows()
 
-    # Se o arquivo de vídeo existir, envia para o Supabase e salva informações
-    if os.path.exists(caminho_video):
-        url_video = enviar_video_supabase(caminho_video)  
-        hora_fim = datetime.now()
-        duracao = (hora_fim - hora_inicio).total_seconds()
-        # Passar 'usuario_id' na chamada para 'salvar_informacoes_filmagem'
-        salvar_informacoes_filmagem(hora_inicio, hora_fim, duracao, url_video, caminho_video)
+registro_cameras = RegistroCameras()
 
-        print(f"✅ Gravação finalizada e enviada: {nome_arquivo}")
 
+# Monta a lista de fontes: câmeras locais encontradas + IP Webcam, se estiver acessível
+def descobrir_fontes_camera():
+    cameras, ip_webcam = registro_cameras.listar()
+    fontes = [FonteCamera(f"cam{indice}", indice) for indice in sorted(cameras)]
+    if IP_WEBCAM_URL and ip_webcam:
+        fontes.append(FonteCamera("ipwebcam", IP_WEBCAM_URL))
+    return fontes
 
-@app.route('/video_feed')
-def video_feed():
-    def generate():
-        while True:
-            with frame_lock:
-                if latest_frame:
-                    yield (b'--frame\r\n'
-                            b'Content-Type: image/jpeg\r\n\r\n' + latest_frame + b'\r\n')
-            time.sleep(1/fps)
-    
-    return Response(generate(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
-# Adicione esta função para iniciar o servidor Flask
-def iniciar_servidor_flask():
-    app.run(host='0.0.0.0', port=5000, threaded=True)
+# Thread de captura: lê a câmera continuamente e publica no buffer circular,
+# assim uma inferência lenta nunca deixa frames velhos acumulando no buffer da câmera
+def capturar_frames(fonte, parar):
+    frame = None
+    while not parar.is_set():
+        ret, frame = fonte.cap.read(frame)  # reaproveita o mesmo array a cada leitura
+        if not ret:
+            print(f"❌ Falha ao capturar frame da câmera '{fonte.nome}'!")
+            if not reabrir_camera(fonte, parar):
+                break
+            frame = None
+            continue
+        fonte.buffer.publicar(frame)
+        for aviso in list(fonte.avisos):
+            aviso.set()
+    fonte.buffer.fechar()
+
+
+# Reabre a câmera depois de uma falha de leitura, com espera crescente entre as tentativas.
+# Enquanto isso a fonte fica marcada como fora do ar e não é reservada para gravações.
+# Retorna False se a captura foi parada antes de a câmera voltar.
+ESPERA_MAXIMA_REABERTURA = 30
+
+
+def reabrir_camera(fonte, parar):
+    fonte.viva = False
+    fonte.liberar()
+    espera = 1
+    while not parar.wait(espera):
+        if fonte.abrir():
+            fonte.viva = True
+            print(f"🔄 Câmera '{fonte.nome}' reconectada")
+            return True
+        espera = min(espera * 2, ESPERA_MAXIMA_REABERTURA)
+    return False
 
-# Salva as informações da filmagem no banco de dados
-def salvar_informacoes_filmagem(inicio, fim, duracao, url_video, caminho_video_local):
-    global usuario_id
-    if url_video is None:
-        print("❌ Erro: URL do vídeo é None, não será salvo no banco de dados")
-        return
 
-    try:
-        if not usuario_id:
-            print("❌ Erro: ID_Usuarios não fornecido!")
-            return
+# Pré-evento: mantém os últimos segundos de cada câmera em JPEG na memória, para a
+# gravação já começar com o que aconteceu antes do "acesso negado"
+PRE_EVENTO_SEGUNDOS = 10                   # 0 desativa o pré-evento
+PRE_EVENTO_FPS = 10
+QUALIDADE_JPEG_PRE_EVENTO = 70
+MAX_MEMORIA_PRE_EVENTO = 64 * 1024 * 1024  # bytes por câmera
+
+
+# Janela deslizante de frames comprimidos, limitada por tempo e por memória
+class BufferPreEvento:
+    def __init__(self, segundos=PRE_EVENTO_SEGUNDOS, limite_bytes=MAX_MEMORIA_PRE_EVENTO):
+        self.segundos = segundos
+        self.limite_bytes = limite_bytes
+        self.lock = threading.Lock()
+        self.frames = deque()  # (instante, sequência, jpeg)
+        self.bytes_total = 0
+        self.descartados_memoria = 0
+
+    def adicionar(self, instante, sequencia, jpeg):
+        with self.lock:
+            self.frames.append((instante, sequencia, jpeg))
+            self.bytes_total += len(jpeg)
+            while self.frames:
+                if instante - self.frames[0][0] <= self.segundos:
+                    if self.bytes_total <= self.limite_bytes:
+                        break
+                    self.descartados_memoria += 1
+                _, _, antigo = self.frames.popleft()
+                self.bytes_total -= len(antigo)
+
+    # Entrega e esvazia a janela atual (usado no início de uma gravação)
+    def drenar(self):
+        with self.lock:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.bytes_total = 0
+            return frames
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "frames": len(self.frames),
+                "bytes": self.bytes_total,
+                "segundos": round(self.frames[-1][0] - self.frames[0][0], 1) if self.frames else 0.0,
+                "descartados_por_memoria": self.descartados_memoria,
+            }
 
-        tamanho_mb = round(os.path.getsize(caminho_video_local) / (1024 * 1024), 2)
 
-        data = {
-            'ID_Usuarios': usuario_id,
-            'inicio': inicio.isoformat(),
-            'fim': fim.isoformat(),
-            'duracao': duracao,
-            'url_video': url_video,
-            'data': inicio.date().isoformat(),
-            'hora_inicio': inicio.time().strftime('%H:%M:%S'),
-            'hora_fim': fim.time().strftime('%H:%M:%S'),
-            'evento': "acesso negado",
-            'dispositivo': "ESP32_CAM_01",
-            'enviado_com_sucesso': True,
-            'tamanho_arquivo_mb': tamanho_mb
-        }
+# Thread de pré-evento: comprime o frame mais recente a PRE_EVENTO_FPS e guarda na janela
+def bufferizar_pre_evento(fonte, parar):
+    frame = np.empty((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8)
+    parametros = [cv2.IMWRITE_JPEG_QUALITY, QUALIDADE_JPEG_PRE_EVENTO]
+    intervalo = 1.0 / PRE_EVENTO_FPS
+    ultima_sequencia = 0
+    proximo = 0.0
 
-        # Inserindo no banco de dados e tratando a resposta
-        res = supabase.table('Tb_Filmagens').insert([data]).execute()
+    while not parar.is_set():
+        sequencia = fonte.buffer.ler(frame, ultima_sequencia)
+        if not sequencia:
+            if fonte.buffer.fechado:
+                break
+            continue
+        ultima_sequencia = sequencia
+
+        agora = time.time()
+        if agora < proximo:
+            continue
+        proximo = max(proximo + intervalo, agora)
+
+        ok, jpeg = cv2.imencode('.jpg', frame, parametros)
+        if ok:
+            fonte.pre_evento.adicionar(agora, sequencia, jpeg.tobytes())
+
+
+# Captura permanente: as câmeras ficam abertas desde a inicialização alimentando o
+# pré-evento, e o serviço de detecção as usa sem precisar reabrir a cada alerta
+class CapturaPermanente:
+    def __init__(self):
+        self.fontes = []
+        self.parar_evento = threading.Event()
+        self.threads = []
+
+    def iniciar(self):
+        self.fontes = [f for f in descobrir_fontes_camera() if f.abrir()]
+        for fonte in self.fontes:
+            self.threads.append(threading.Thread(target=capturar_frames, args=(fonte, self.parar_evento), daemon=True))
+            if PRE_EVENTO_SEGUNDOS > 0:
+                fonte.pre_evento = BufferPreEvento()
+                self.threads.append(threading.Thread(target=bufferizar_pre_evento, args=(fonte, self.parar_evento), daemon=True))
+        for t in self.threads:
+            t.start()
+        return bool(self.fontes)
+
+    def estatisticas(self):
+        return {fonte.nome: fonte.pre_evento.estatisticas() for fonte in self.fontes if fonte.pre_evento}
+
+    def parar(self):
+        self.parar_evento.set()
+        for fonte in self.fontes:
+            fonte.buffer.fechar()
+        for t in self.threads:
+            t.join(timeout=5)
+        for fonte in self.fontes:
+            fonte.liberar()
+
+
+
+# Thread de detecção: a cada tick junta o frame mais recente de cada câmera que tenha
+# frame novo e roda um único forward do YOLO em lote; rostos e resultados voltam por câmera
+def detectar_pessoas(motor):
+    # Passada única no frame inteiro: usa o modelo de longo alcance (até ~5 m).
+    # O grafo do MediaPipe é montado uma vez e vale por toda a vida do motor.
+    with mp_face.FaceDetection(model_selection=1, min_detection_confidence=0.5) as face_detection:
+        aquecer_modelos(motor, face_detection)
+
+        while not motor.parar_evento.is_set():
+            if not motor.novo_frame.wait(timeout=1.0):
+                continue
+            motor.novo_frame.clear()
+            if motor.modo == MODO_OCIOSO:
+                continue
+
+            # Só entram no lote as câmeras cujo passo de detecção já venceu
+            agora = time.time()
+            fontes_tick = []
+            for fonte in motor.fontes:
+                if fonte.buffer.sequencia < fonte.ultima_sequencia_detector + fonte.estado.agendador.passo:
+                    continue
+                if motor.modo == MODO_MONITORANDO and agora - fonte.ultima_avaliacao_detector < INTERVALO_MONITORAMENTO:
+                    continue
+                sequencia = fonte.buffer.ler(fonte.frame_detector, fonte.ultima_sequencia_detector, timeout=0)
+                if sequencia:
+                    fonte.ultima_sequencia_detector = sequencia
+                    fonte.ultima_avaliacao_detector = agora
+                    # Cena sem mudança: nem chega ao YOLO
+                    if fonte.filtro_movimento.avaliar(fonte.frame_detector):
+                        fontes_tick.append(fonte)
+                    else:
+                        fonte.estado.rastreador.congelar(sequencia)
+
+            if not fontes_tick:
+                continue
+
+            lote = yolo_model([f.frame_detector for f in fontes_tick], imgsz=640, conf=0.6)
+            for fonte, results in zip(fontes_tick, lote):
+                processar_resultado_camera(fonte, results, face_detection)
+
+
+# Primeira inferência num frame vazio: aloca os buffers do YOLO e do MediaPipe antes
+# do primeiro alerta, para o primeiro frame real não pagar esse custo
+def aquecer_modelos(motor, face_detection):
+    inicio = time.time()
+    try:
+        vazios = [np.zeros((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8) for _ in motor.fontes]
+        yolo_model(vazios, imgsz=640, conf=0.6, verbose=False)
+        face_detection.process(vazios[0])
+        motor.tempo_aquecimento_ms = (time.time() - inicio) * 1000
+        print(f"🔥 Modelos aquecidos em {motor.tempo_aquecimento_ms:.0f} ms")
+    except Exception as e:
+        print(f"⚠️ Falha ao aquecer os modelos: {e}")
+    motor.pronto.set()
+
+
+# Detecta os rostos numa única passada sobre o frame inteiro e associa cada rosto à
+# pessoa que o contém (centro do rosto dentro da caixa; em caso de sobreposição, a menor).
+# Retorna (índice da pessoa, (x, y, w, h)) em coordenadas absolutas do frame.
+def detectar_rostos(frame, frame_rgb, detections, face_detection):
+    if not detections:
+        return []
+
+    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame_rgb)
+    faces = face_detection.process(frame_rgb)
+    if not faces.detections:
+        return []
+
+    ih, iw = frame.shape[:2]
+    rostos = []
+    for f in faces.detections:
+        bbox = f.location_data.relative_bounding_box
+        fx, fy, fw, fh = int(bbox.xmin * iw), int(bbox.ymin * ih), int(bbox.width * iw), int(bbox.height * ih)
+        cx, cy = fx + fw // 2, fy + fh // 2
+
+        dono = None
+        menor_area = None
+        for i, (x1, y1, x2, y2) in enumerate(detections):
+            if x1 <= cx < x2 and y1 <= cy < y2:
+                area = (x2 - x1) * (y2 - y1)
+                if menor_area is None or area < menor_area:
+                    dono, menor_area = i, area
+
+        if dono is not None:
+            rostos.append((dono, (fx, fy, fw, fh)))
+    return rostos
+
+
+# Filtra as pessoas de um resultado do YOLO, procura rostos e publica no estado da câmera
+def processar_resultado_camera(fonte, results, face_detection):
+    frame = fonte.frame_detector
+    detections = []
+    face_img = None
+
+    for det in results.boxes:
+        cls = int(det.cls.item())
+        if cls == 0:  # Classe 'pessoa' no YOLO
+            x1, y1, x2, y2 = map(int, det.xyxy[0])
+            detections.append((x1, y1, x2, y2))
+
+    estado = fonte.estado
+    ids, incerteza = estado.rastreador.atualizar(detections, fonte.ultima_sequencia_detector)
+    estado.agendador.registrar(incerteza, estado.rastreador.movimento())
+
+    # Detecção de rostos nas áreas das pessoas; a miniatura é sempre a da trilha mais antiga
+    rostos = detectar_rostos(frame, fonte.frame_rgb, detections, face_detection)
+    if rostos:
+        _, (abs_x, abs_y, fw, fh) = min(rostos, key=lambda r: ids[r[0]])
+        try:
+            face_crop = frame[max(0, abs_y-30):min(720, abs_y+fh+30),
+                            max(0, abs_x-30):min(1280, abs_x+fw+30)]
+            face_img = cv2.resize(face_crop, (200, 200))
+        except Exception as e:
+            print(f"Erro no processamento do rosto: {e}")
+
+    if face_img is not None:
+        with estado.lock:
+            estado.face_img = face_img
+
+
+# Variantes de JPEG (qualidade, largura) que os clientes do /video_feed podem negociar
+QUALIDADE_JPEG_PADRAO = 95
+VARIANTE_PADRAO = (QUALIDADE_JPEG_PADRAO, LARGURA_FRAME)
+
+
+# Hub de difusão dos frames de uma câmera: cada frame é codificado uma única vez por
+# variante e publicado com número de sequência; os ouvintes são avisados a cada frame
+# novo, então os clientes nunca recebem duplicados nem seguram o codificador
+class HubFrames:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sequencia = 0
+        self.jpegs = {}     # variante -> bytes do frame atual
+        self.clientes = {}  # variante -> número de clientes conectados
+        self.ouvintes = []  # callbacks avisados a cada frame publicado
+
+    def registrar(self, variante):
+        with self.lock:
+            self.clientes[variante] = self.clientes.get(variante, 0) + 1
+
+    def remover(self, variante):
+        with self.lock:
+            self.clientes[variante] -= 1
+            if not self.clientes[variante]:
+                del self.clientes[variante]
+
+    def variantes(self):
+        with self.lock:
+            return set(self.clientes)
+
+    def assinar(self, callback):
+        with self.lock:
+            self.ouvintes.append(callback)
+
+    def atual(self):
+        with self.lock:
+            return self.jpegs
+
+    def publicar(self, jpegs):
+        with self.lock:
+            self.jpegs = jpegs
+            self.sequencia += 1
+            ouvintes = list(self.ouvintes)
+        for callback in ouvintes:
+            callback(self)
+
+
+def obter_hub(nome="principal"):
+    with hubs_lock:
+        if nome not in hubs_frames:
+            hubs_frames[nome] = HubFrames()
+        return hubs_frames[nome]
+
+
+# Thread de streaming: codifica o frame anotado mais recente da câmera, no seu próprio ritmo,
+# uma vez por variante pedida pelos clientes conectados, fora de qualquer lock dos clientes.
+# A câmera principal também alimenta a câmera virtual, quando ativa (sem codificar).
+def transmitir_frames(fonte, parar, principal=False):
+    hubs = [obter_hub(fonte.nome)]
+    if principal:
+        hubs.append(obter_hub())
+
+    display = np.empty((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8)
+    reduzidos = {}  # largura -> buffer reaproveitado para as variantes menores
+    ultima_sequencia = 0
+
+    while not parar.is_set():
+        sequencia = fonte.buffer_exibicao.ler(display, ultima_sequencia)
+        if not sequencia:
+            if fonte.buffer_exibicao.fechado:
+                break
+            continue
+        ultima_sequencia = sequencia
+
+        if principal and saida_camera_virtual is not None:
+            saida_camera_virtual.enviar(display)
+
+        variantes = set().union(*(hub.variantes() for hub in hubs))
+        if not variantes:
+            continue  # ninguém assistindo: não codifica
+
+        jpegs = {}
+        for qualidade, largura in variantes:
+            imagem = display
+            if largura != LARGURA_FRAME:
+                altura = largura * ALTURA_FRAME // LARGURA_FRAME
+                if largura not in reduzidos:
+                    reduzidos[largura] = np.empty((altura, largura, 3), dtype=np.uint8)
+                imagem = cv2.resize(display, (largura, altura), dst=reduzidos[largura], interpolation=cv2.INTER_AREA)
+            ok, buffer = cv2.imencode('.jpg', imagem, [cv2.IMWRITE_JPEG_QUALITY, qualidade])
+            if ok:
+                jpegs[(qualidade, largura)] = buffer.tobytes()
+
+        for hub in hubs:
+            hub.publicar(jpegs)
+
+
+# Saída para o OBS: "mjpeg" (fonte de navegador lendo /video_feed) ou "camera_virtual"
+# (frames BGR entregues direto ao driver, sem JPEG nem Chromium no caminho)
+SAIDA_OBS = os.getenv("SAIDA_OBS", "mjpeg")
+DISPOSITIVO_CAMERA_VIRTUAL = os.getenv("DISPOSITIVO_CAMERA_VIRTUAL") or None  # None = padrão do pyvirtualcam
+
+
+# Câmera virtual de longa duração alimentada pela câmera principal. Aberta uma vez na
+# inicialização (o OBS precisa do dispositivo presente para capturá-lo) e compartilhada
+# pelas sessões; o frame é copiado para a memória compartilhada do driver sem conversão.
+class SaidaCameraVirtual:
+    def __init__(self, largura=LARGURA_FRAME, altura=ALTURA_FRAME, fps_saida=30):
+        self.largura = largura
+        self.altura = altura
+        self.fps_saida = fps_saida
+        self.lock = threading.Lock()
+        self.camera = None
+        self.dispositivo = None
+        self.frames = 0
+        self.falhas = 0
+
+    def abrir(self):
+        try:
+            import pyvirtualcam
+            self.camera = pyvirtualcam.Camera(
+                width=self.largura, height=self.altura, fps=self.fps_saida,
+                fmt=pyvirtualcam.PixelFormat.BGR, device=DISPOSITIVO_CAMERA_VIRTUAL,
+            )
+            self.dispositivo = self.camera.device
+            self.camera.send(np.zeros((self.altura, self.largura, 3), dtype=np.uint8))
+            print(f"✅ Câmera virtual ativa: {self.dispositivo}")
+            return True
+        except Exception as e:
+            print(f"⚠️ Câmera virtual indisponível, o OBS usará o MJPEG: {e}")
+            return False
 
-        if res.data:
-            print("✅ Filmagem registrada no Supabase.")
-        else:
-            print("❌ Erro ao salvar filmagem:", res.error)
+    def enviar(self, frame):
+        with self.lock:
+            try:
+                self.camera.send(frame)
+                self.frames += 1
+            except Exception as e:
+                self.falhas += 1
+                if self.falhas == 1:
+                    print(f"⚠️ Erro ao enviar frame para a câmera virtual: {e}")
 
-    except Exception as e:
-        print("❌ Erro ao salvar filmagem:", str(e))
+    def estatisticas(self):
+        return {"dispositivo": self.dispositivo, "frames": self.frames, "falhas": self.falhas}
 
+    def fechar(self):
+        with self.lock:
+            if self.camera is not None:
+                self.camera.close()
+                self.camera = None
 
-def list_cameras():
-    index = 0
-    arr = []
-    while True:
-        cap = cv2.VideoCapture(index)  # sem cv2.CAP_DSHOW
-        if not cap.isOpened():
-            cap.release()
-            break
 
-        ret, frame = cap.read()
-        if ret and frame is not None and frame.size > 0:
-            arr.append(index)
+saida_camera_virtual = None
+
+
+def iniciar_camera_virtual():
+    global saida_camera_virtual
+    saida = SaidaCameraVirtual()
+    if saida.abrir():
+        saida_camera_virtual = saida
+    return saida_camera_virtual
+
+
+# Desenha as caixas de pessoas e a miniatura do rosto sobre o frame de exibição
+def desenhar_deteccoes(display, caixas, face_img):
+    for id_trilha, (x1, y1, x2, y2) in caixas:
+        cv2.rectangle(display, (x1, y1), (x2, y2), COR_PESSOA, 2)
+        cv2.putText(display, f"PESSOA {id_trilha}", (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
+
+    if face_img is not None:
+        display[20:220, 1060:1260] = face_img
+        cv2.rectangle(display, (1059, 19), (1261, 221), COR_PESSOA, 2)
+        cv2.putText(display, "Rosto", (1070, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, COR_TEXTO, 1)
+
+
+
+# Faixa de status do streaming: escurece só as linhas da faixa, no próprio frame (sem cópia
+# do frame inteiro nem addWeighted em 1280x720), e escreve o texto por cima
+ALTURA_FAIXA_STATUS = 41  # linhas 0 a 40
+OPACIDADE_FAIXA_STATUS = 0.4
+
+
+def desenhar_status(display, status_text, fps_calc):
+    faixa = display[:ALTURA_FAIXA_STATUS]
+    cv2.addWeighted(faixa, 1 - OPACIDADE_FAIXA_STATUS, faixa, 0, 0, dst=faixa)
+    cv2.putText(display, status_text, (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+    cv2.putText(display, f"FPS: {fps_calc:.1f}", (10, 70),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+
+# Gravação em H.264 via ffmpeg (MP4 fragmentado, pronto para upload ao terminar).
+# CODEC_GRAVACAO pode apontar para um encoder de hardware, ex.: "h264_nvenc" ou "h264_qsv".
+CODEC_GRAVACAO = "libx264"
+PRESET_GRAVACAO = "veryfast"
+CRF_GRAVACAO = 23
+
+
+GRAVACAO_SEGMENTADA = True  # HLS com segmentos de DURACAO_SEGMENTO enviados durante a gravação
+
+
+# Gravador que envia os frames BGR crus para um processo ffmpeg de longa duração.
+# Com caminho terminando em .m3u8 grava em segmentos HLS (fMP4) na mesma pasta.
+# Mesma interface do cv2.VideoWriter (write/release/isOpened).
+class GravadorFFmpeg:
+    def __init__(self, caminho_video, fps_video, tamanho, codec=CODEC_GRAVACAO,
+                 preset=PRESET_GRAVACAO, crf=CRF_GRAVACAO):
+        largura, altura = tamanho
+        comando = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{largura}x{altura}', '-r', str(fps_video),
+            '-i', '-',
+            '-c:v', codec, '-preset', preset, '-crf', str(crf), '-pix_fmt', 'yuv420p',
+        ]
+        if caminho_video.endswith(".m3u8"):
+            pasta = os.path.dirname(caminho_video)
+            comando += [
+                '-force_key_frames', f'expr:gte(t,n_forced*{DURACAO_SEGMENTO})',
+                '-f', 'hls', '-hls_time', str(DURACAO_SEGMENTO), '-hls_playlist_type', 'event',
+                '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                '-hls_flags', 'independent_segments+temp_file',
+                '-hls_segment_filename', os.path.join(pasta, 'seg_%05d.m4s'),
+                caminho_video
+            ]
         else:
-            cap.release()
-            break
+            comando += [
+                '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                '-f', 'mp4', caminho_video
+            ]
+        self.caminho_video = caminho_video
+        try:
+            self.processo = subprocess.Popen(comando, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            print(f"❌ Falha ao iniciar o ffmpeg: {e}")
+            self.processo = None
 
-        cap.release()
-        index += 1
-    return arr
+    def isOpened(self):
+        return self.processo is not None and self.processo.poll() is None
+
+    def write(self, frame):
+        if not self.isOpened():
+            return
+        try:
+            self.processo.stdin.write(memoryview(frame))
+        except (BrokenPipeError, OSError) as e:
+            print(f"❌ ffmpeg encerrou durante a gravação: {e}")
+            self.release()
+
+    def release(self):
+        if self.processo is None:
+            return
+        processo, self.processo = self.processo, None
+        try:
+            processo.stdin.close()
+        except OSError:
+            pass
+        _, erros = processo.communicate()
+        if processo.returncode != 0:
+            print(f"❌ Erro no ffmpeg ({processo.returncode}): {erros.decode(errors='replace').strip()}")
 
-print("Câmeras disponíveis:", list_cameras())
 
+# Extensão da gravação: MP4 via ffmpeg quando disponível, senão MKV/XVID pelo OpenCV
+def extensao_gravacao():
+    return ".mp4" if shutil.which("ffmpeg") else ".mkv"
 
 
-# Função de autenticação para o YouTube
-def authenticate_youtube():
-    creds = None
+def criar_gravador(caminho_video):
+    if caminho_video.endswith((".mp4", ".m3u8")):
+        return GravadorFFmpeg(caminho_video, fps, (LARGURA_FRAME, ALTURA_FRAME))
+    codec = cv2.VideoWriter_fourcc(*'XVID')
+    return cv2.VideoWriter(caminho_video, codec, fps, (LARGURA_FRAME, ALTURA_FRAME))
+
+
+# Manifesto gravado ao lado do vídeo quando o gravador fecha: o upload confia nele em vez
+# de reabrir o arquivo com o VideoCapture para contar frames
+def caminho_manifesto(caminho_video):
+    return caminho_video + ".manifesto.json"
+
+
+def escrever_manifesto(caminho_video, frames):
+    manifesto = {
+        "frames": frames,
+        "fps": fps,
+        "duracao": round(frames / fps, 3) if fps else None,
+        "codec": CODEC_GRAVACAO if caminho_video.endswith((".mp4", ".m3u8")) else "XVID",
+        "tamanho": os.path.getsize(caminho_video) if os.path.exists(caminho_video) else None,
+    }
+    try:
+        with open(caminho_manifesto(caminho_video), "w", encoding="utf-8") as f:
+            json.dump(manifesto, f)
+    except OSError as e:
+        print(f"⚠️ Erro ao salvar o manifesto de {os.path.basename(caminho_video)}: {e}")
+    return manifesto
+
+
+# Manifesto do vídeo, ou None se não existir ou não corresponder mais ao arquivo
+def ler_manifesto(caminho_video):
+    try:
+        with open(caminho_manifesto(caminho_video), "r", encoding="utf-8") as f:
+            manifesto = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifesto.get("tamanho") != os.path.getsize(caminho_video):
+        return None
+    return manifesto
+
+
+# Thread de gravação de uma câmera: consome os frames em ordem, na taxa da câmera,
+# aplica as últimas detecções e alimenta o gravador e, se for a dona da exibição da
+# câmera, o streaming
+def gravar_camera(fonte, caminho_video, parar, instante_alerta=None, principal=False):
+    gravador = criar_gravador(caminho_video)
+    exibindo = fonte.assumir_exibicao(parar)
+    transmissor = None
+
+    display = np.empty((ALTURA_FRAME, LARGURA_FRAME, 3), dtype=np.uint8)
+    ultima_sequencia = 0
+    frames_descartados = 0
+    frames_gravados = 0
+
+    if instante_alerta is not None:
+        fonte.latencia_inicio_ms = (time.time() - instante_alerta) * 1000
+        print(f"⏱️ '{fonte.nome}': gravação iniciada {fonte.latencia_inicio_ms:.0f} ms após o alerta")
+
+    # Começa pelos segundos anteriores ao alerta, repetindo cada frame para manter o fps do arquivo.
+    # A janela continua sendo alimentada durante a descarga, então drena até alcançar o presente
+    # e só então passa para o buffer ao vivo, sem buraco entre os dois.
+    # (numa câmera compartilhada a janela já foi drenada pela sessão dona da exibição)
+    if fonte.pre_evento is not None and exibindo:
+        repeticoes = max(1, round(fps / PRE_EVENTO_FPS))
+        segundos_pre = 0.0
+        frames_pre = fonte.pre_evento.drenar()
+        while frames_pre and not parar.is_set():
+            for _, sequencia, jpeg in frames_pre:
+                frame_pre = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                ultima_sequencia = sequencia
+                if frame_pre is None:  # JPEG corrompido na janela: pula o frame
+                    continue
+                for _ in range(repeticoes):
+                    gravador.write(frame_pre)
+                frames_gravados += repeticoes
+            segundos_pre += len(frames_pre) / PRE_EVENTO_FPS
+            frames_pre = fonte.pre_evento.drenar()
+        if segundos_pre:
+            print(f"⏪ '{fonte.nome}': {segundos_pre:.1f} s de pré-evento incluídos na gravação")
+
+    ultimo_frame = time.time()
+
+    while not parar.is_set():
+        sequencia = fonte.buffer.ler(display, ultima_sequencia, em_ordem=True)
+        if not sequencia:
+            if fonte.buffer.fechado:
+                break
+            continue
+        if ultima_sequencia:
+            frames_descartados += sequencia - ultima_sequencia - 1
+        ultima_sequencia = sequencia
+
+        # Caixas propagadas pelo rastreador até o frame atual
+        caixas = fonte.estado.rastreador.prever(sequencia)
+        with fonte.estado.lock:
+            face_img = fonte.estado.face_img
+
+        desenhar_deteccoes(display, caixas, face_img)
+        gravador.write(display)
+        frames_gravados += 1
+        if not exibindo:
+            exibindo = fonte.assumir_exibicao(parar)
+            if not exibindo:
+                continue
+            print(f"📺 '{fonte.nome}': exibição assumida pela sessão que continua gravando")
+        if transmissor is None:
+            transmissor = threading.Thread(target=transmitir_frames, args=(fonte, parar, principal), daemon=True)
+            transmissor.start()
+
+        agora = time.time()
+        fps_calc = 1.0 / max(agora - ultimo_frame, 1e-6)
+        ultimo_frame = agora
+
+        # Variante do streaming: o gravador já recebeu o frame, então a faixa de status é
+        # composta no mesmo buffer
+        status_text = "Gravando..."
+        if alguma_sessao_transmitindo():
+            status_text = "Transmitindo: Seguranca 24 horas"
+        desenhar_status(display, status_text, fps_calc)
+
+        # Atualiza o frame mais recente para o servidor de streaming
+        fonte.buffer_exibicao.publicar(display)
+
+    if transmissor is not None:
+        transmissor.join(timeout=5)
+    gravador.release()
+    escrever_manifesto(caminho_video, frames_gravados)
+
+    if frames_descartados:
+        print(f"⚠️ Gravador de '{fonte.nome}' descartou {frames_descartados} frames (buffer de captura cheio)")
+
+
+# Upload contínuo das gravações segmentadas (HLS com segmentos fMP4)
+DURACAO_SEGMENTO = 10          # segundos por segmento
+MAX_TENTATIVAS_UPLOAD = 3
+executor_uploads = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload")
+
+TIPOS_CONTEUDO = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+
+# Envia um arquivo para o bucket 'filmagens', com algumas tentativas
+def enviar_arquivo_storage(caminho_local, caminho_remoto, cache_control="3600"):
+    tipo = TIPOS_CONTEUDO.get(os.path.splitext(caminho_local)[1], "application/octet-stream")
+    for tentativa in range(1, MAX_TENTATIVAS_UPLOAD + 1):
+        try:
+            with open(caminho_local, "rb") as f:
+                supabase.storage.from_("filmagens").upload(
+                    path=caminho_remoto,
+                    file=f.read(),
+                    file_options={"content-type": tipo, "cache-control": cache_control, "x-upsert": "true"}
+                )
+            return True
+        except Exception as e:
+            print(f"⚠️ Falha no upload de {os.path.basename(caminho_local)} (tentativa {tentativa}/{MAX_TENTATIVAS_UPLOAD}): {e}")
+            time.sleep(tentativa)
+    return False
+
+
+# Acompanha a playlist que o ffmpeg atualiza a cada segmento fechado: segmentos novos vão
+# para o pool de uploads e a playlist só é publicada depois que todos os seus segmentos subiram
+class EnvioSegmentos:
+    def __init__(self, pasta_local, intervalo=1.0):
+        self.pasta_local = pasta_local
+        self.caminho_playlist = os.path.join(pasta_local, "index.m3u8")
+        self.prefixo_remoto = f"gravacoes/{usuario_id}/{os.path.basename(pasta_local)}"
+        self.intervalo = intervalo
+        self.enviados = {}  # arquivo -> future do upload
+        self.playlist_publicada = None
+        self.falhas = 0
+        self.parar_evento = threading.Event()
+        self.thread = threading.Thread(target=self._acompanhar, daemon=True)
+
+    def iniciar(self):
+        self.thread.start()
+
+    def _acompanhar(self):
+        while not self.parar_evento.wait(self.intervalo):
+            self._sincronizar()
+
+    @staticmethod
+    def _arquivos(playlist):
+        arquivos = []
+        for linha in playlist.splitlines():
+            if linha.startswith("#EXT-X-MAP:"):
+                arquivos.append(linha.split('URI="', 1)[1].split('"', 1)[0])
+            elif linha and not linha.startswith("#"):
+                arquivos.append(linha)
+        return arquivos
+
+    # Lê a playlist atual, envia segmentos novos e publica a playlist quando estiverem no bucket
+    def _sincronizar(self):
+        try:
+            with open(self.caminho_playlist, encoding="utf-8") as f:
+                playlist = f.read()
+        except FileNotFoundError:
+            return True
+        if playlist == self.playlist_publicada:
+            return True
+
+        arquivos = self._arquivos(playlist)
+        for arquivo in arquivos:
+            if arquivo not in self.enviados:
+                self.enviados[arquivo] = executor_uploads.submit(
+                    enviar_arquivo_storage,
+                    os.path.join(self.pasta_local, arquivo),
+                    f"{self.prefixo_remoto}/{arquivo}")
+
+        pendentes = [self.enviados[a] for a in arquivos]
+        wait(pendentes)
+        if not all(f.result() for f in pendentes):
+            # Reenvia na próxima rodada os segmentos que falharam
+            for arquivo in arquivos:
+                if not self.enviados[arquivo].result():
+                    del self.enviados[arquivo]
+                    self.falhas += 1
+            return False
+
+        caminho_remoto = f"{self.prefixo_remoto}/index.m3u8"
+        with open(os.path.join(self.pasta_local, ".playlist_envio.m3u8"), "w", encoding="utf-8") as f:
+            f.write(playlist)
+        if not enviar_arquivo_storage(f.name, caminho_remoto, cache_control="0"):
+            return False
+        self.playlist_publicada = playlist
+        return True
+
+    # Depois que o ffmpeg fechou a playlist: envia o que faltou e retorna a URL pública
+    def finalizar(self):
+        self.parar_evento.set()
+        self.thread.join()
+        if not os.path.exists(self.caminho_playlist):
+            print("❌ O ffmpeg não gerou a playlist; os segmentos gravados vão para a fila de uploads")
+            return None
+        if not self._sincronizar():
+            print("⚠️ Nem todos os segmentos foram enviados; o restante vai para a fila de uploads")
+            return None
+        print(f"📤 {len(self.enviados)} arquivos da gravação segmentada enviados ({self.falhas} reenvios)")
+        url_publica = supabase.storage.from_("filmagens").get_public_url(f"{self.prefixo_remoto}/index.m3u8")
+        return url_publica + f"?t={int(time.time())}"
+
+    # Segmentos que não subiram e a playlist final vão para a fila persistente; a playlist
+    # só é enviada (e a filmagem registrada) depois de todos os segmentos.
+    # Sem playlist legível (ffmpeg caiu antes de escrevê-la) sobem os segmentos que estiverem
+    # no disco, e a filmagem não é registrada.
+    def enfileirar_pendentes(self, registro):
+        try:
+            with open(self.caminho_playlist, encoding="utf-8") as f:
+                arquivos = self._arquivos(f.read())
+            playlist_legivel = True
+        except OSError as e:
+            print(f"❌ Playlist de {os.path.basename(self.pasta_local)} ilegível: {e}")
+            arquivos = sorted(a for a in os.listdir(self.pasta_local) if os.path.splitext(a)[1] in (".m4s", ".mp4"))
+            playlist_legivel = False
+        ids = []
+        for arquivo in arquivos:
+            envio = self.enviados.get(arquivo)
+            if envio is not None and envio.done() and envio.result():
+                continue
+            caminho_local = os.path.join(self.pasta_local, arquivo)
+            tipo = TIPOS_CONTEUDO.get(os.path.splitext(arquivo)[1], "application/octet-stream")
+            ids.append(fila_uploads.enfileirar(caminho_local, f"{self.prefixo_remoto}/{arquivo}", tipo))
+        if not playlist_legivel:
+            print(f"📥 {len(ids)} segmentos de {os.path.basename(self.pasta_local)} na fila de uploads, sem playlist")
+            return
+        fila_uploads.enfileirar(self.caminho_playlist, f"{self.prefixo_remoto}/index.m3u8", TIPOS_CONTEUDO[".m3u8"],
+                                {**registro, "caminho": self.pasta_local}, depende_de=ids, cache_control="0")
+        print(f"📥 {len(ids)} segmentos e a playlist de {os.path.basename(self.pasta_local)} na fila de uploads")
+
+
+# Upload retomável das gravações inteiras pelo protocolo TUS do Supabase Storage.
+# A fila fica em disco: cada chunk confirmado atualiza o offset salvo, então uma queda
+# de rede ou um reinício do processo continua do último chunk aceito pelo servidor.
+URL_UPLOAD_RETOMAVEL = os.getenv("URL_UPLOAD_RETOMAVEL") or f"{supabase_url}/storage/v1/upload/resumable"
+ARQUIVO_FILA_UPLOADS = os.path.join(BASE_DIR, "fila_uploads.json")
+TAMANHO_CHUNK_UPLOAD = 6 * 1024 * 1024  # o Supabase exige chunks de 6 MB (exceto o último)
+TRABALHADORES_UPLOAD = 3                # uploads simultâneos, cada um com conexão própria do pool
+TIMEOUT_CHUNK_UPLOAD = 60
+ESPERA_MAXIMA_UPLOAD = 300              # teto do backoff entre tentativas (segundos)
+
+
+def codificar_metadados_tus(metadados):
+    return ",".join(f"{chave} {base64.b64encode(str(valor).encode()).decode()}" for chave, valor in metadados.items())
+
+
+class FilaUploads:
+    def __init__(self, url=URL_UPLOAD_RETOMAVEL, arquivo=ARQUIVO_FILA_UPLOADS, trabalhadores=TRABALHADORES_UPLOAD,
+                 tamanho_chunk=TAMANHO_CHUNK_UPLOAD, ao_concluir=None, bucket="filmagens"):
+        self.url = url
+        self.arquivo = arquivo
+        self.trabalhadores = trabalhadores
+        self.tamanho_chunk = tamanho_chunk
+        self.ao_concluir = ao_concluir  # (item) -> bool; False mantém o item na fila
+        self.bucket = bucket
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=trabalhadores, pool_maxsize=trabalhadores)
+        self.sessao.mount("http://", adaptador)
+        self.sessao.mount("https://", adaptador)
+        self.condicao = threading.Condition()
+        self.itens = {}          # id -> item persistido
+        self.em_andamento = set()
+        self.parar_evento = threading.Event()
+        self.threads = []
+        self.concluidos = 0
+        self.tentativas_falhas = 0
+        self.bytes_enviados = 0
+        self.vazoes_mb_s = deque(maxlen=20)
+        self._carregar()
+
+    def _carregar(self):
+        try:
+            with open(self.arquivo, "r", encoding="utf-8") as f:
+                self.itens = {item["id"]: item for item in json.load(f)}
+            if self.itens:
+                print(f"📥 {len(self.itens)} uploads pendentes retomados da fila")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Fila de uploads ignorada: {e}")
 
-    # Verificar se já existe um token salvo
-    if os.path.exists(TOKEN_PICKLE):
-        with open(TOKEN_PICKLE, 'rb') as token:
-            creds = pickle.load(token)
+    # Chamado com a condição adquirida
+    def _salvar(self):
+        temporario = self.arquivo + ".tmp"
+        try:
+            with open(temporario, "w", encoding="utf-8") as f:
+                json.dump(list(self.itens.values()), f)
+            os.replace(temporario, self.arquivo)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar a fila de uploads: {e}")
+
+    # depende_de: ids que precisam terminar antes (ex.: segmentos antes da playlist)
+    def enfileirar(self, caminho_local, caminho_remoto, tipo, registro=None,
+                   depende_de=(), cache_control="3600"):
+        item = {
+            "id": f"{time.time_ns()}-{os.path.basename(caminho_local)}",
+            "caminho_local": caminho_local,
+            "caminho_remoto": caminho_remoto,
+            "tipo": tipo,
+            "tamanho": os.path.getsize(caminho_local),
+            "url_upload": None,
+            "offset": 0,
+            "tentativas": 0,
+            "proxima_tentativa": 0,
+            "registro": registro,
+            "depende_de": list(depende_de),
+            "cache_control": cache_control,
+        }
+        with self.condicao:
+            self.itens[item["id"]] = item
+            self._salvar()
+            self.condicao.notify()
+        return item["id"]
+
+    def iniciar(self):
+        if self.threads:
+            return
+        for i in range(self.trabalhadores):
+            thread = threading.Thread(target=self._executar, daemon=True, name=f"upload-retomavel-{i}")
+            thread.start()
+            self.threads.append(thread)
+
+    def parar(self, timeout=5):
+        self.parar_evento.set()
+        with self.condicao:
+            self.condicao.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+
+    # Próximo item livre cuja espera já passou, ou None (com o tempo até o próximo ficar pronto)
+    def _proximo(self):
+        agora = time.time()
+        espera = None
+        for item in self.itens.values():
+            if item["id"] in self.em_andamento:
+                continue
+            if any(dependencia in self.itens for dependencia in item.get("depende_de", ())):
+                continue
+            if item["proxima_tentativa"] <= agora:
+                return item, None
+            restante = item["proxima_tentativa"] - agora
+            espera = restante if espera is None else min(espera, restante)
+        return None, espera
+
+    def _executar(self):
+        while not self.parar_evento.is_set():
+            with self.condicao:
+                item, espera = self._proximo()
+                if item is None:
+                    self.condicao.wait(timeout=espera)
+                    continue
+                self.em_andamento.add(item["id"])
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            # Tentar atualizar o token
             try:
-                creds.refresh(Request())
-                print("🔄 Token atualizado com sucesso!")
+                concluido = self._enviar(item)
             except Exception as e:
-                print(f"❌ Erro ao atualizar token: {e}")
-                creds = None
+                print(f"⚠️ Falha no upload de {os.path.basename(item['caminho_local'])}: {e}")
+                concluido = False
+
+            with self.condicao:
+                self.em_andamento.discard(item["id"])
+                if item["id"] not in self.itens:
+                    continue
+                if concluido:
+                    del self.itens[item["id"]]
+                    self.concluidos += 1
+                elif not self.parar_evento.is_set():
+                    item["tentativas"] += 1
+                    item["proxima_tentativa"] = time.time() + min(2 ** item["tentativas"], ESPERA_MAXIMA_UPLOAD)
+                    self.tentativas_falhas += 1
+                self._salvar()
+
+    def _cabecalhos(self, **extras):
+        return {
+            "authorization": f"Bearer {supabase_key}",
+            "apikey": supabase_key or "",
+            "x-upsert": "true",
+            "Tus-Resumable": "1.0.0",
+            **extras,
+        }
+
+    # Cria o upload no servidor (ou consulta o offset de um já criado) e envia os chunks restantes
+    def _enviar(self, item):
+        if not os.path.exists(item["caminho_local"]):
+            print(f"❌ Upload descartado, arquivo não existe mais: {item['caminho_local']}")
+            return True
+
+        if item["url_upload"] is not None:
+            resposta = self.sessao.head(item["url_upload"], headers=self._cabecalhos(), timeout=TIMEOUT_CHUNK_UPLOAD)
+            if resposta.status_code in (404, 410):
+                item["url_upload"] = None  # upload expirou no servidor: recomeça do zero
+            else:
+                resposta.raise_for_status()
+                item["offset"] = int(resposta.headers["Upload-Offset"])
+
+        if item["url_upload"] is None:
+            resposta = self.sessao.post(self.url, timeout=TIMEOUT_CHUNK_UPLOAD, headers=self._cabecalhos(**{
+                "Upload-Length": str(item["tamanho"]),
+                "Upload-Metadata": codificar_metadados_tus({
+                    "bucketName": self.bucket,
+                    "objectName": item["caminho_remoto"],
+                    "contentType": item["tipo"],
+                    "cacheControl": item.get("cache_control", "3600"),
+                }),
+            }))
+            resposta.raise_for_status()
+            item["url_upload"] = urljoin(self.url, resposta.headers["Location"])
+            item["offset"] = 0
+            with self.condicao:
+                self._salvar()
+
+        inicio = time.time()
+        offset_inicial = item["offset"]
+        with open(item["caminho_local"], "rb") as f:
+            while item["offset"] < item["tamanho"]:
+                if self.parar_evento.is_set():
+                    return False
+                f.seek(item["offset"])
+                chunk = f.read(self.tamanho_chunk)
+                resposta = self.sessao.patch(item["url_upload"], data=chunk, timeout=TIMEOUT_CHUNK_UPLOAD,
+                                             headers=self._cabecalhos(**{
+                                                 "Upload-Offset": str(item["offset"]),
+                                                 "Content-Type": "application/offset+octet-stream",
+                                             }))
+                if resposta.status_code == 409:
+                    # Offset divergente: o próximo HEAD descobre onde o servidor parou
+                    return False
+                resposta.raise_for_status()
+                with self.condicao:
+                    item["offset"] = int(resposta.headers["Upload-Offset"])
+                    self.bytes_enviados += len(chunk)
+                    self._salvar()
+
+        # A resposta do último PATCH é a confirmação do storage de que o arquivo inteiro chegou
+        if item["offset"] != item["tamanho"]:
+            print(f"❌ Storage confirmou {item['offset']} de {item['tamanho']} bytes de {item['caminho_remoto']}, reenviando")
+            item["url_upload"] = None
+            return False
+
+        duracao = time.time() - inicio
+        if item["offset"] > offset_inicial and duracao > 0:
+            self.vazoes_mb_s.append((item["offset"] - offset_inicial) / (1024 * 1024) / duracao)
+        print(f"📤 Upload concluído: {item['caminho_remoto']} ({item['tamanho'] / (1024 * 1024):.2f} MB)")
+        return self.ao_concluir is None or self.ao_concluir(item)
+
+    def estatisticas(self):
+        with self.condicao:
+            return {
+                "na_fila": len(self.itens),
+                "em_andamento": len(self.em_andamento),
+                "bytes_pendentes": sum(i["tamanho"] - i["offset"] for i in self.itens.values()),
+                "concluidos": self.concluidos,
+                "tentativas_falhas": self.tentativas_falhas,
+                "mb_enviados": round(self.bytes_enviados / (1024 * 1024), 2),
+                "vazao_mb_s_media": round(sum(self.vazoes_mb_s) / len(self.vazoes_mb_s), 2) if self.vazoes_mb_s else None,
+            }
+
+
+# Upload terminado: o servidor já confirmou todos os bytes (Upload-Offset final igual ao
+# tamanho do arquivo), então a filmagem é registrada sem consultar a URL pública
+def registrar_upload_concluido(item):
+    url_publica = supabase.storage.from_("filmagens").get_public_url(item["caminho_remoto"])
+    url_publica += f"?t={int(time.time())}"
+
+    registro = item["registro"]
+    if registro is not None:
+        salvar_informacoes_filmagem(datetime.fromisoformat(registro["inicio"]), datetime.fromisoformat(registro["fim"]),
+                                    registro["duracao"], url_publica, registro.get("caminho", item["caminho_local"]),
+                                    registro.get("dispositivo", DISPOSITIVO_PADRAO), registro.get("evento", "acesso negado"))
+    return True
+
+
+def criar_fila_uploads():
+    return FilaUploads(ao_concluir=registrar_upload_concluido)
+
+
+# Criada no primeiro uso: o arquivo da fila só é lido quando o main() a inicia
+fila_uploads = CarregamentoSobDemanda("fila_uploads", criar_fila_uploads)
+
+
+# Sessões por dispositivo (uma por controlador de porta ESP32)
+DISPOSITIVO_PADRAO = "padrao"  # tópicos legados "alert" e "status/alert"
+# Câmeras de cada dispositivo, ex.: {"porta1": ["cam0"], "porta2": ["cam1", "ipwebcam"]};
+# dispositivos fora do mapa gravam todas as câmeras que estiverem livres
+CAMERAS_POR_DISPOSITIVO = json.loads(os.getenv("CAMERAS_POR_DISPOSITIVO", "{}"))
+
+
+# Estado independente de um dispositivo: gravação, transmissão e contadores
+class SessaoDispositivo:
+    def __init__(self, dispositivo):
+        self.dispositivo = dispositivo
+        self.grava = False
+        self.transmite = False
+        self.instante_alerta = None
+        self.evento = "acesso negado"  # mensagem MQTT do último alerta
+        self.alertas = 0
+        self.cancelamentos = 0
+        self.gravacoes = 0
+        self.latencias_gravacao_ms = deque(maxlen=100)      # alerta -> sessão de gravação no ar
+        self.latencias_transmissao_ms = deque(maxlen=100)   # alerta -> transmissão no ar
+
+    def estatisticas(self):
+        def media(valores):
+            return round(sum(valores) / len(valores)) if valores else None
+        return {
+            "gravando": self.grava,
+            "transmitindo": self.transmite,
+            "alertas": self.alertas,
+            "cancelamentos": self.cancelamentos,
+            "gravacoes": self.gravacoes,
+            "latencia_gravacao_ms_media": media(self.latencias_gravacao_ms),
+            "latencia_transmissao_ms_media": media(self.latencias_transmissao_ms),
+        }
+
+
+sessoes = {}
+sessoes_lock = threading.Lock()
+
+
+def obter_sessao(dispositivo):
+    with sessoes_lock:
+        if dispositivo not in sessoes:
+            sessoes[dispositivo] = SessaoDispositivo(dispositivo)
+        return sessoes[dispositivo]
+
+
+# Outras sessões (além da informada) ainda gravando/transmitindo
+def outras_sessoes(sessao, atributo):
+    with sessoes_lock:
+        return [s for s in sessoes.values() if s is not sessao and getattr(s, atributo)]
+
+
+# O OBS tem uma única transmissão, compartilhada pelas sessões
+def alguma_sessao_transmitindo():
+    return bool(outras_sessoes(None, "transmite"))
+
+
+# Grava uma sessão de alerta com um motor já em execução: um arquivo e um feed por câmera,
+# enquanto a sessão do dispositivo estiver gravando. O envio ao Supabase roda em segundo plano.
+def gravar_sessao(motor, sessao, fontes=None):
+    parar = threading.Event()
+    fontes = fontes or motor.fontes
+
+    # Configura gravação local, um arquivo por câmera
+    hora_inicio = datetime.now()
+    evento = sessao.evento
+    os.makedirs(os.path.join(BASE_DIR, "gravacoes"), exist_ok=True)
+    extensao = extensao_gravacao()
+    segmentada = GRAVACAO_SEGMENTADA and extensao == ".mp4"
+    gravacoes = []
+    envios = {}
+    threads = []
+    for fonte in fontes:
+        nome_base = f"gravacao_{hora_inicio.strftime('%Y%m%d_%H%M%S')}_{fonte.nome}"
+        if sessao.dispositivo != DISPOSITIVO_PADRAO:
+            nome_base = f"gravacao_{hora_inicio.strftime('%Y%m%d_%H%M%S')}_{sessao.dispositivo}_{fonte.nome}"
+        if segmentada:
+            # Uma pasta por gravação com a playlist e os segmentos, enviados enquanto grava
+            pasta = os.path.join(BASE_DIR, "gravacoes", nome_base)
+            os.makedirs(pasta, exist_ok=True)
+            caminho_video = os.path.join(pasta, "index.m3u8")
+            envios[caminho_video] = EnvioSegmentos(pasta)
+            envios[caminho_video].iniciar()
         else:
-            # Caso não tenha token ou esteja expirado e não consiga atualizar
-            print("🔑 Iniciando o fluxo de autenticação do YouTube...")
+            caminho_video = os.path.join(BASE_DIR, "gravacoes", nome_base + extensao)
+        gravacoes.append(caminho_video)
+        threads.append(threading.Thread(target=gravar_camera, args=(fonte, caminho_video, parar, sessao.instante_alerta,
+                                                                    fonte is motor.fontes[0]), daemon=True))
+    for t in threads:
+        t.start()
+    sessao.latencias_gravacao_ms.append((time.time() - sessao.instante_alerta) * 1000)
+    sessao.gravacoes += 1
+
+    while sessao.grava and motor.ativo():
+        time.sleep(0.1)
+
+    parar.set()
+    for t in threads:
+        t.join(timeout=5)
+
+    hora_fim = datetime.now()
+    threading.Thread(target=finalizar_gravacoes, args=(gravacoes, envios, hora_inicio, hora_fim, sessao.dispositivo, evento),
+                     daemon=True).start()
+
+
+# Se os arquivos de vídeo existirem, envia para o Supabase e salva informações
+def finalizar_gravacoes(gravacoes, envios, hora_inicio, hora_fim, dispositivo, evento):
+    duracao = (hora_fim - hora_inicio).total_seconds()
+    for caminho_video in gravacoes:
+        if caminho_video in envios:
+            # Os segmentos já subiram durante a gravação: só falta o restante e a playlist final
+            url_video = envios[caminho_video].finalizar()
+            if url_video is None:
+                envios[caminho_video].enfileirar_pendentes({
+                    "inicio": hora_inicio.isoformat(), "fim": hora_fim.isoformat(), "duracao": duracao,
+                    "dispositivo": dispositivo, "evento": evento,
+                })
+                continue
+            salvar_informacoes_filmagem(hora_inicio, hora_fim, duracao, url_video, os.path.dirname(caminho_video),
+                                        dispositivo, evento)
+            print(f"✅ Gravação finalizada e enviada: {os.path.basename(os.path.dirname(caminho_video))}")
+        elif os.path.exists(caminho_video):
+            # O registro no banco é feito pela fila de uploads quando o arquivo terminar de subir
+            if enviar_video_supabase(caminho_video, hora_inicio, hora_fim, duracao, dispositivo, evento) is not None:
+                print(f"✅ Gravação finalizada: {os.path.basename(caminho_video)}")
+
+
+# Função para processar as detecções de segurança (caminho de reserva, usado quando o
+# serviço de detecção não subiu): descobre e abre as câmeras e carrega o motor a cada alerta
+def processar_deteccoes(sessao):
+    global motor_ativo
+
+    nomes = CAMERAS_POR_DISPOSITIVO.get(sessao.dispositivo)
+    fontes = [f for f in descobrir_fontes_camera() if nomes is None or f.nome in nomes]
+    if not fontes:
+        print("❌ Nenhuma câmera disponível!")
+        return
+
+    motor = MotorDeteccao(fontes)
+    if not motor.iniciar():
+        return
+    motor_ativo = motor
+
+    gravar_sessao(motor, sessao)
+
+    # Libera recursos
+    motor.parar()
+    motor_ativo = None
+
+
+# Serviço de detecção de longa duração: câmeras abertas, modelos aquecidos e o grafo do
+# MediaPipe montado na inicialização. Cada dispositivo em alerta reserva suas câmeras e
+# grava numa thread própria; todos compartilham o mesmo motor (e o mesmo lote do YOLO).
+# Câmeras mapeadas em CAMERAS_POR_DISPOSITIVO são exclusivas do dispositivo; dispositivos
+# sem mapa compartilham entre si as câmeras que nenhum dispositivo mapeado reservou (cada
+# um grava o mesmo buffer em outro arquivo, e só um publica na exibição). O motor fica em
+# modo gravando enquanto houver alguma câmera reservada.
+class ServicoDeteccao:
+    def __init__(self):
+        self.captura = CapturaPermanente()
+        self.motor = None
+        self.lock = threading.Lock()
+        self.reservas = {}  # nome da fonte -> dispositivos que estão gravando nela
+
+    def iniciar(self):
+        global motor_ativo
+        if not self.captura.iniciar():
+            return False
+
+        self.motor = MotorDeteccao(self.captura.fontes, modo=MODO_MONITORANDO)
+        if not self.motor.iniciar():
+            return False
+        self.motor.pronto.wait(timeout=60)
+        motor_ativo = self.motor
+        return True
+
+    @property
+    def modo(self):
+        return self.motor.modo
+
+    # Chamado com o lock adquirido: a câmera pode ser reservada pelo dispositivo?
+    def _disponivel(self, fonte, nomes):
+        reservada_por = self.reservas.get(fonte.nome, [])
+        if nomes is not None:
+            return fonte.nome in nomes and not reservada_por
+        return not any(d in CAMERAS_POR_DISPOSITIVO for d in reservada_por)
+
+    # Reserva as câmeras livres e conectadas do dispositivo
+    def _reservar(self, dispositivo):
+        nomes = CAMERAS_POR_DISPOSITIVO.get(dispositivo)
+        with self.lock:
+            fontes = [f for f in self.motor.fontes if f.viva and self._disponivel(f, nomes)]
+            for fonte in fontes:
+                self.reservas.setdefault(fonte.nome, []).append(dispositivo)
+            if fontes:
+                self.motor.modo = MODO_GRAVANDO
+        return fontes
+
+    def _liberar(self, fontes, dispositivo):
+        with self.lock:
+            for fonte in fontes:
+                dispositivos = self.reservas.get(fonte.nome, [])
+                if dispositivo in dispositivos:
+                    dispositivos.remove(dispositivo)
+                if not dispositivos:
+                    self.reservas.pop(fonte.nome, None)
+            if not self.reservas:
+                self.motor.modo = MODO_MONITORANDO
+
+    def gravar(self, sessao):
+        fontes = self._reservar(sessao.dispositivo)
+        if not fontes:
+            print(f"⚠️ Nenhuma câmera livre e conectada para o dispositivo '{sessao.dispositivo}'")
+            return False
+        threading.Thread(target=self._gravar, args=(sessao, fontes), daemon=True).start()
+        return True
+
+    def _gravar(self, sessao, fontes):
+        try:
+            gravar_sessao(self.motor, sessao, fontes)
+        except Exception as e:
+            print(f"❌ Erro na sessão de gravação de '{sessao.dispositivo}': {e}")
+        finally:
+            self._liberar(fontes, sessao.dispositivo)
+        if not self.motor.ativo():
+            print("❌ Nenhuma câmera entregando frames; serviço de detecção volta a monitorar")
+
+    def estatisticas(self):
+        with self.lock:
+            reservas = {nome: list(dispositivos) for nome, dispositivos in self.reservas.items()}
+        return {
+            "modo": self.motor.modo,
+            "tempo_aquecimento_ms": self.motor.tempo_aquecimento_ms,
+            "reservas": reservas,
+            "pre_evento": self.captura.estatisticas(),
+        }
+
+    def parar(self):
+        self.motor.parar()
+        self.captura.parar()
+
+
+servico_deteccao = None
+
+
+# Servidor MJPEG assíncrono (porta usada pelo OBS e pelo app); o Flask fica com o resto
+PORTA_STREAMING = 5000
+PORTA_FLASK = 5001
+MAX_ESPECTADORES = 30
+TAMANHO_FILA_CLIENTE = 2             # frames pendentes por cliente antes de descartar o mais velho
+LIMITE_BUFFER_SOCKET = 256 * 1024    # bytes no buffer de escrita antes do drain() esperar
+
+
+# Lê a variante pedida pelo cliente na query string (?q=qualidade&w=largura)
+def variante_da_query(query):
+    params = parse_qs(query)
+    try:
+        qualidade = int(params.get('q', [QUALIDADE_JPEG_PADRAO])[0])
+        largura = int(params.get('w', [LARGURA_FRAME])[0])
+    except ValueError:
+        return VARIANTE_PADRAO
+    return (min(max(qualidade, 10), 95), min(max(largura, 160), LARGURA_FRAME))
+
+
+class ClienteStreaming:
+    def __init__(self, hub, variante):
+        self.hub = hub
+        self.variante = variante
+        self.fila = asyncio.Queue(maxsize=TAMANHO_FILA_CLIENTE)
+
+
+# Serve /video_feed e /video_feed/<camera> em asyncio: um único loop atende todos os
+# espectadores, cada um com uma fila pequena que descarta frames velhos quando o socket
+# está lento, sem atrasar os outros clientes nem a thread de streaming
+class ServidorStreaming:
+    def __init__(self, host='0.0.0.0', porta=PORTA_STREAMING, max_espectadores=MAX_ESPECTADORES):
+        self.host = host
+        self.porta = porta
+        self.max_espectadores = max_espectadores
+        self.loop = None
+        self.clientes = set()
+        self.hubs_assinados = set()
+        self.bytes_enviados = 0
+        self.frames_enviados = 0
+        self.frames_descartados = 0
+        self.conexoes_recusadas = 0
+
+    # Roda o loop asyncio na thread atual (chamar numa thread dedicada)
+    def iniciar(self):
+        asyncio.run(self._servir())
+
+    async def _servir(self):
+        self.loop = asyncio.get_running_loop()
+        servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+        async with servidor:
+            await servidor.serve_forever()
+
+    # Chamado na thread de streaming a cada frame publicado num hub assinado
+    def _novo_frame(self, hub):
+        self.loop.call_soon_threadsafe(self._distribuir, hub)
+
+    def _distribuir(self, hub):
+        jpegs = hub.atual()
+        for cliente in self.clientes:
+            if cliente.hub is not hub:
+                continue
+            jpeg = jpegs.get(cliente.variante)
+            if jpeg is None:
+                continue
+            if cliente.fila.full():
+                cliente.fila.get_nowait()
+                self.frames_descartados += 1
+            cliente.fila.put_nowait(jpeg)
+
+    async def _atender(self, reader, writer):
+        try:
+            linha = await asyncio.wait_for(reader.readline(), 10)
+            while True:
+                cabecalho = await asyncio.wait_for(reader.readline(), 10)
+                if cabecalho in (b'\r\n', b'\n', b''):
+                    break
+
+            metodo, alvo, _ = linha.decode('latin-1').split(' ', 2)
+            url = urlsplit(alvo)
+            caminho = url.path.rstrip('/')
+            if metodo != 'GET' or not (caminho == '/video_feed' or caminho.startswith('/video_feed/')):
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            if len(self.clientes) >= self.max_espectadores:
+                self.conexoes_recusadas += 1
+                writer.write(b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            camera = caminho[len('/video_feed/'):] or "principal"
+            await self._transmitir(reader, writer, obter_hub(camera), variante_da_query(url.query))
+
+        except (ConnectionError, asyncio.TimeoutError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # O cliente não deveria enviar mais nada: descarta o que chegar, em blocos pequenos,
+    # até o EOF que indica a desconexão
+    @staticmethod
+    async def _aguardar_desconexao(reader):
+        while await reader.read(1024):
+            pass
+
+    async def _transmitir(self, reader, writer, hub, variante):
+        if hub not in self.hubs_assinados:
+            self.hubs_assinados.add(hub)
+            hub.assinar(self._novo_frame)
+
+        writer.transport.set_write_buffer_limits(high=LIMITE_BUFFER_SOCKET)
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+
+        cliente = ClienteStreaming(hub, variante)
+        self.clientes.add(cliente)
+        hub.registrar(variante)
+        desconectou = asyncio.ensure_future(self._aguardar_desconexao(reader))
+        try:
+            while True:
+                proximo = asyncio.ensure_future(cliente.fila.get())
+                await asyncio.wait({proximo, desconectou}, return_when=asyncio.FIRST_COMPLETED)
+                if desconectou.done():
+                    proximo.cancel()
+                    break
+
+                parte = (b'--frame\r\n'
+                         b'Content-Type: image/jpeg\r\n\r\n' + proximo.result() + b'\r\n')
+                writer.write(parte)
+                await writer.drain()
+                self.bytes_enviados += len(parte)
+                self.frames_enviados += 1
+        finally:
+            desconectou.cancel()
+            self.clientes.discard(cliente)
+            hub.remover(variante)
+
+    def metricas(self):
+        return {
+            "espectadores": len(self.clientes),
+            "max_espectadores": self.max_espectadores,
+            "bytes_enviados": self.bytes_enviados,
+            "frames_enviados": self.frames_enviados,
+            "frames_descartados": self.frames_descartados,
+            "conexoes_recusadas": self.conexoes_recusadas,
+        }
+
+
+servidor_streaming = ServidorStreaming()
+
+
+# Contadores do motor de detecção em execução (vazio se não houver gravação ativa)
+@app.route('/metricas')
+def metricas():
+    motor = motor_ativo
+    return jsonify({
+        "cameras": motor.estatisticas() if motor else {},
+        "servico": servico_deteccao.estatisticas() if servico_deteccao else {},
+        "registro_cameras": registro_cameras.estatisticas(),
+        "inicializacao": tempos_inicializacao,
+        "mqtt": despachante_alertas.metricas(),
+        "youtube": pool_youtube.estatisticas() if pool_youtube else {},
+        "credenciais_google": credenciais_google.estatisticas(),
+        "obs": reconciliador_obs.estatisticas(),
+        "eventos_locais": armazem_eventos.estatisticas(),
+        "status_db": repositorio_status.estatisticas(),
+        "uploads": fila_uploads.estatisticas(),
+        "filmagens_db": escritor_filmagens.estatisticas(),
+        "camera_virtual": saida_camera_virtual.estatisticas() if saida_camera_virtual else {},
+        "dispositivos": {dispositivo: sessao.estatisticas() for dispositivo, sessao in list(sessoes.items())},
+        "streaming": servidor_streaming.metricas(),
+    })
+
+
+# Adicione esta função para iniciar o servidor Flask
+def iniciar_servidor_flask():
+    app.run(host='0.0.0.0', port=PORTA_FLASK, threaded=True)
+
+# Registros de Tb_Filmagens: eventos "filmagem" do armazém local, enviados em lotes (por
+# tamanho ou tempo). A URL do vídeo é a chave de idempotência: depois de uma falha, o lote
+# é conferido no banco antes do novo insert, para não duplicar linhas que já tinham chegado.
+TAMANHO_LOTE_FILMAGENS = 20
+INTERVALO_LOTE_FILMAGENS = 2.0     # segundos que a linha mais antiga espera por companhia
+# O dispositivo padrão (tópicos legados) mantém o nome usado antes no banco
+NOME_DISPOSITIVO_PADRAO = os.getenv("NOME_DISPOSITIVO_PADRAO", "ESP32_CAM_01")
+
+
+class EscritorFilmagens:
+    tipo = "filmagem"
+    tamanho_lote = TAMANHO_LOTE_FILMAGENS
+    janela = INTERVALO_LOTE_FILMAGENS
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conferir_existentes = False
+        self.linhas_inseridas = 0
+        self.duplicadas_evitadas = 0
+        self.lotes = 0
+        self.vazoes_linhas_s = deque(maxlen=20)
+
+    def adicionar(self, dados):
+        armazem_eventos.registrar(self.tipo, dados, chave=f"{self.tipo}:{dados['url_video']}")
+
+    def replicar(self, eventos):
+        linhas = [evento["dados"] for evento in eventos]
+        inicio = time.time()
+        if self.conferir_existentes:
+            res = supabase.table('Tb_Filmagens')\
+                .select('url_video')\
+                .in_('url_video', [linha['url_video'] for linha in linhas])\
+                .execute()
+            existentes = {linha['url_video'] for linha in res.data or []}
+            with self.lock:
+                self.duplicadas_evitadas += len(existentes)
+            linhas = [linha for linha in linhas if linha['url_video'] not in existentes]
+
+        if linhas:
             try:
-                # Verificar se o arquivo client_secret.json existe
-                if not os.path.exists(client_secrets_file):
-                    print(f"❌ Erro: Arquivo de cliente 'client_secret.json' não encontrado em: {client_secrets_file}")
-                    return None
+                res = supabase.table('Tb_Filmagens').insert(linhas).execute()
+                if not res.data:
+                    raise RuntimeError(getattr(res, "error", "resposta vazia"))
+            except Exception:
+                # O insert pode ter chegado ao banco mesmo com erro na resposta
+                self.conferir_existentes = True
+                raise
+            print(f"✅ {len(linhas)} filmagens registradas no Supabase.")
+        self.conferir_existentes = False
+
+        with self.lock:
+            self.linhas_inseridas += len(linhas)
+            self.lotes += 1
+            self.vazoes_linhas_s.append(len(linhas) / max(time.time() - inicio, 1e-6))
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                "linhas_inseridas": self.linhas_inseridas,
+                "duplicadas_evitadas": self.duplicadas_evitadas,
+                "lotes": self.lotes,
+                "linhas_por_s_media": round(sum(self.vazoes_linhas_s) / len(self.vazoes_linhas_s), 1) if self.vazoes_linhas_s else None,
+            }
 
-                # Inicializar o fluxo de autenticação
-                flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, SCOPES)
-                print("🌐 Abrindo navegador para autenticação...")
-                creds = flow.run_local_server(port=0)
 
-                # Salvar o token para futuras execuções
-                with open(TOKEN_PICKLE, 'wb') as token:
-                    pickle.dump(creds, token)
-                print("✅ Token salvo com sucesso!")
-            except Exception as e:
-                print(f"❌ Erro ao autenticar: {str(e)}")
-                return None
+escritor_filmagens = EscritorFilmagens()
+
+
+# Salva as informações da filmagem no banco de dados (via armazém local de eventos)
+def salvar_informacoes_filmagem(inicio, fim, duracao, url_video, caminho_video_local, dispositivo, evento):
+    global usuario_id
+    if url_video is None:
+        print("❌ Erro: URL do vídeo é None, não será salvo no banco de dados")
+        return
 
-    # Criar a instância da API do YouTube
     try:
-        youtube = build('youtube', 'v3', credentials=creds)
-        print("🎉 Autenticação concluída com sucesso!")
-        return youtube
+        if not usuario_id:
+            print("❌ Erro: ID_Usuarios não fornecido!")
+            return
+
+        if os.path.isdir(caminho_video_local):
+            # Gravação segmentada: soma a playlist e os segmentos
+            tamanho_bytes = sum(e.stat().st_size for e in os.scandir(caminho_video_local) if e.is_file())
+        else:
+            tamanho_bytes = os.path.getsize(caminho_video_local)
+        tamanho_mb = round(tamanho_bytes / (1024 * 1024), 2)
+
+        data = {
+            'ID_Usuarios': usuario_id,
+            'inicio': inicio.isoformat(),
+            'fim': fim.isoformat(),
+            'duracao': duracao,
+            'url_video': url_video,
+            'data': inicio.date().isoformat(),
+            'hora_inicio': inicio.time().strftime('%H:%M:%S'),
+            'hora_fim': fim.time().strftime('%H:%M:%S'),
+            'evento': evento,
+            'dispositivo': NOME_DISPOSITIVO_PADRAO if dispositivo == DISPOSITIVO_PADRAO else dispositivo,
+            'enviado_com_sucesso': True,
+            'tamanho_arquivo_mb': tamanho_mb
+        }
+        escritor_filmagens.adicionar(data)
+
     except Exception as e:
-        print(f"❌ Erro ao criar a instância da API do YouTube: {str(e)}")
+        print("❌ Erro ao salvar filmagem:", str(e))
+
+
+# Função de autenticação para o YouTube
+def authenticate_youtube():
+    return credenciais_google.cliente()
+
+
+# Autentica e deixa o pool de transmissões abastecido antes do primeiro alerta
+def iniciar_youtube():
+    global pool_youtube
+    youtube = credenciais_google.cliente()
+    if youtube is not None:
+        credenciais_google.iniciar()
+        if os.getenv("YOUTUBE_STREAM_KEY"):
+            pool_youtube = PoolYoutube(credenciais_google.cliente)
+            pool_youtube.iniciar()
+    return youtube
+
+
+# Tópicos assinados: o legado "alert" e os de status publicados pelos ESP32
+TOPICOS_MQTT = ["alert", "status/#"]
+
+# Eventos reconhecidos nas mensagens MQTT
+EVENTO_ALERTA = "alerta"
+EVENTO_CANCELAMENTO = "cancelamento"
+MAX_TRABALHADORES_ALERTA = 4
+
+
+# "status/<id>/alert" -> id; os tópicos legados "alert" e "status/alert" vão para o
+# dispositivo padrão; outros tópicos (ex.: "status/connection") são ignorados
+def dispositivo_do_topico(topico):
+    partes = topico.split("/")
+    if partes[-1] != "alert":
         return None
+    if len(partes) == 3 and partes[0] == "status" and partes[1]:
+        return partes[1]
+    if len(partes) <= 2:
+        return DISPOSITIVO_PADRAO
+    return None
 
 
-def on_mqtt_message(client, userdata, msg):
-    global grava, obs, transmite, usuario_id
-    mensagem = msg.payload.decode().lower()
-    print(f"📡 MQTT Message Received: {mensagem}")
+def classificar_mensagem(mensagem):
+    if "acesso negado" in mensagem:
+        return EVENTO_ALERTA
+    if "alerta cancelado, acesso liberado" in mensagem:
+        return EVENTO_CANCELAMENTO
+    return None
 
-    try:
-        if "acesso negado" in mensagem and not grava:
-            print("🚨 Alerta de acesso negado detectado - Iniciando procedimentos...")
-            
-            # 1. Primeiro verifica/cria registro no banco    
-            atualizar_ao_vivo_no_db(True)
-                
 
-            # 2. Marca estado de gravação
-            grava = True
-            
-            # 3. Inicia thread de detecção
-            try:
-                detection_thread = threading.Thread(target=processar_deteccoes, daemon=True)
-                detection_thread.start()
-                print("🔍 Thread de detecção iniciada com sucesso")
-            except Exception as thread_error:
-                print(f"❌ Falha ao iniciar thread: {thread_error}")
-                grava = False
-                atualizar_ao_vivo_no_db(False)
-                return
+def alerta_cancelado(cancelado):
+    return cancelado is not None and cancelado.is_set()
 
-            # 4. Configura OBS (com retry)
-            max_obs_attempts = 3
-            obs_configured = False
-            for attempt in range(max_obs_attempts):
-                try:
-                    if configurar_cena_obs("Camera_Seguranca"):
-                        print(f"🎬 Cena OBS configurada (tentativa {attempt + 1}/{max_obs_attempts})")
-                        obs_configured = True
-                        break
-                    time.sleep(1)
-                except Exception as obs_error:
-                    print(f"⚠️ Erro OBS tentativa {attempt + 1}: {obs_error}")
-
-            if not obs_configured:
-                print("❌ Falha crítica ao configurar OBS")
-                grava = False
-                atualizar_ao_vivo_no_db(False)
-                return
 
-            # 5. Verifica stream do YouTube
-            if not os.getenv("YOUTUBE_STREAM_KEY"):
-                print("⚠️ AVISO: Streaming desativado (chave YouTube não configurada)")
+# Espera que termina antes se o alerta for cancelado; retorna True nesse caso
+def aguardar_ou_cancelar(cancelado, segundos):
+    if cancelado is None:
+        time.sleep(segundos)
+        return False
+    return cancelado.wait(segundos)
+
+
+# Despachante de eventos MQTT: o callback do paho só classifica a mensagem e enfileira.
+# Cada dispositivo tem sua fila, tratada em ordem por um trabalhador do pool (no máximo
+# um por dispositivo). Um cancelamento sinaliza na hora o alerta em andamento ou pendente
+# do mesmo dispositivo, que aborta entre as etapas de OBS/YouTube/Supabase.
+class DespachanteAlertas:
+    def __init__(self, max_trabalhadores=MAX_TRABALHADORES_ALERTA):
+        self.executor = ThreadPoolExecutor(max_workers=max_trabalhadores, thread_name_prefix="alerta")
+        self.lock = threading.Lock()
+        self.filas = {}          # dispositivo -> deque de (tipo, mensagem, cancelado)
+        self.ocupados = set()    # dispositivos com um trabalhador drenando a fila
+        self.cancelamentos = {}  # dispositivo -> Event do último alerta
+        self.tempos_callback_us = deque(maxlen=1000)
+        self.eventos = 0
+        self.abortados = 0
+
+    def publicar(self, dispositivo, tipo, mensagem):
+        cancelado = threading.Event()
+        with self.lock:
+            if tipo == EVENTO_CANCELAMENTO and dispositivo in self.cancelamentos:
+                self.cancelamentos.pop(dispositivo).set()
+            elif tipo == EVENTO_ALERTA:
+                self.cancelamentos[dispositivo] = cancelado
+            self.filas.setdefault(dispositivo, deque()).append((tipo, mensagem, cancelado))
+            self.eventos += 1
+            if dispositivo in self.ocupados:
                 return
+            self.ocupados.add(dispositivo)
+        self.executor.submit(self._drenar, dispositivo)
 
-            # 6. Autenticação YouTube
+    def _drenar(self, dispositivo):
+        while True:
+            with self.lock:
+                fila = self.filas[dispositivo]
+                if not fila:
+                    self.ocupados.discard(dispositivo)
+                    return
+                tipo, mensagem, cancelado = fila.popleft()
+
+            print(f"📡 MQTT Message Received ({dispositivo}): {mensagem}")
+            sessao = obter_sessao(dispositivo)
             try:
-                youtube = authenticate_youtube()
-                if not youtube:
-                    raise RuntimeError("Autenticação falhou")
-                
-                if not configurar_e_iniciar_stream_youtube(obs, youtube):
-                    print("⚠️ Tentando fallback de configuração...")
-                    debug_obs_config()
-                    if not configurar_e_iniciar_stream_youtube(obs, youtube):
-                        raise RuntimeError("Falha após fallback")
-                
-                print("✅ Transmissão YouTube iniciada com sucesso")
-            except Exception as youtube_error:
-                print(f"❌ Falha no YouTube: {youtube_error}")
-                grava = False
-                atualizar_ao_vivo_no_db(False)
-
-        elif "alerta cancelado, acesso liberado" in mensagem and grava:
-            print("🟢 Alerta cancelado - Encerrando procedimentos...")
-            grava = False
-            
-            if not parar_transmissao(obs):
-                print("⚠️ Aviso: Problema ao parar transmissão,可能需要 limpeza manual")
-            
-            print("📴 Sistemas desativados")
+                if tipo == EVENTO_ALERTA:
+                    sessao.evento = mensagem
+                    tratar_alerta(sessao, cancelado)
+                else:
+                    tratar_cancelamento(sessao)
+            except Exception as e:
+                print(f"‼️ ERRO GLOBAL: {str(e)}")
+                tratar_erro_alerta(sessao)
+
+            with self.lock:
+                if cancelado.is_set():
+                    self.abortados += 1
+                if self.cancelamentos.get(dispositivo) is cancelado:
+                    del self.cancelamentos[dispositivo]
+
+    def registrar_callback(self, duracao_ns):
+        self.tempos_callback_us.append(duracao_ns / 1000)
+
+    def metricas(self):
+        with self.lock:
+            tempos = list(self.tempos_callback_us)
+            return {
+                "eventos": self.eventos,
+                "alertas_abortados": self.abortados,
+                "pendentes": {dispositivo: len(fila) for dispositivo, fila in self.filas.items() if fila},
+                "callback_us_medio": round(sum(tempos) / len(tempos), 1) if tempos else None,
+                "callback_us_max": round(max(tempos), 1) if tempos else None,
+            }
 
-    except Exception as e:
-        print(f"‼️ ERRO GLOBAL: {str(e)}")
-        grava = False
+
+despachante_alertas = DespachanteAlertas()
+
+
+# Callback do paho: roda na thread de rede, então só classifica e enfileira
+def on_mqtt_message(client, userdata, msg):
+    inicio = time.perf_counter_ns()
+    dispositivo = dispositivo_do_topico(msg.topic)
+    if dispositivo is not None:
+        mensagem = msg.payload.decode().lower()
+        tipo = classificar_mensagem(mensagem)
+        if tipo is not None:
+            despachante_alertas.publicar(dispositivo, tipo, mensagem)
+    despachante_alertas.registrar_callback(time.perf_counter_ns() - inicio)
+
+
+# Procedimentos de um alerta de acesso negado; retorna cedo se o alerta for cancelado
+# no meio do caminho (a limpeza fica com o cancelamento, que vem logo atrás na fila)
+def tratar_alerta(sessao, cancelado):
+    if sessao.grava or cancelado.is_set():
+        return
+    print(f"🚨 Alerta de acesso negado em '{sessao.dispositivo}' - Iniciando procedimentos...")
+    sessao.alertas += 1
+    sessao.instante_alerta = time.time()
+
+    # 1. Marca estado de gravação e coloca o serviço de detecção em modo gravação
+    # (ou sobe o caminho de reserva) antes de qualquer chamada de rede
+    sessao.grava = True
+    try:
+        if servico_deteccao is not None:
+            if not servico_deteccao.gravar(sessao):
+                raise RuntimeError("nenhuma câmera livre")
+            print("🔍 Serviço de detecção em modo gravação")
+        else:
+            detection_thread = threading.Thread(target=processar_deteccoes, args=(sessao,), daemon=True)
+            detection_thread.start()
+            print("🔍 Thread de detecção iniciada com sucesso")
+    except Exception as thread_error:
+        print(f"❌ Falha ao iniciar thread: {thread_error}")
+        tratar_erro_alerta(sessao)
+        return
+
+    # 2. Verifica/cria registro no banco
+    atualizar_ao_vivo_no_db(True)
+
+    # 3. OBS e YouTube (uma transmissão para todos os dispositivos)
+    with transmissao_lock:
+        iniciar_transmissao_sessao(sessao, cancelado)
+
+
+# Só um dispositivo por vez configura o OBS/YouTube; quem chega depois encontra a
+# transmissão no ar e passa a compartilhá-la
+transmissao_lock = threading.Lock()
+
+
+def iniciar_transmissao_sessao(sessao, cancelado):
+    if cancelado.is_set():
+        return
+
+    # Transmissão já no ar por outro dispositivo: esta sessão só passa a compartilhá-la
+    if outras_sessoes(sessao, "transmite"):
+        sessao.transmite = True
+        print(f"📺 '{sessao.dispositivo}' compartilha a transmissão já em andamento")
+        return
+
+    # 1. Configura OBS (com retry)
+    max_obs_attempts = 3
+    obs_configured = False
+    for attempt in range(max_obs_attempts):
+        if cancelado.is_set():
+            return
         try:
-            atualizar_ao_vivo_no_db(False)
-        except:
-            pass
+            if configurar_cena_obs("Camera_Seguranca"):
+                print(f"🎬 Cena OBS configurada (tentativa {attempt + 1}/{max_obs_attempts})")
+                obs_configured = True
+                break
+            if aguardar_ou_cancelar(cancelado, 1):
+                return
+        except Exception as obs_error:
+            print(f"⚠️ Erro OBS tentativa {attempt + 1}: {obs_error}")
 
+    if not obs_configured:
+        print("❌ Falha crítica ao configurar OBS")
+        tratar_erro_alerta(sessao)
+        return
 
+    # 2. Verifica stream do YouTube
+    if not os.getenv("YOUTUBE_STREAM_KEY"):
+        print("⚠️ AVISO: Streaming desativado (chave YouTube não configurada)")
+        return
 
-def main():
-    # Configuração inicial
-    print("\n" + "="*50)
-    print("Sistema de Segurança - Inicializando...")
-    print("="*50 + "\n")
-    
-    # 1. Verificar e carregar configurações
+    # 3. Autenticação YouTube
     try:
-        print("✅ Configurações carregadas com sucesso")
-    except Exception as e:
-        print(f"⚠️ Erro ao carregar configurações: {e}")
-        print("⚠️ Usando configurações padrão")
+        youtube = credenciais_google.cliente()
+        if not youtube:
+            raise RuntimeError("Autenticação falhou")
+        if cancelado.is_set():
+            return
 
-    # 2. Iniciar OBS Studio
-    print("\n[1/5] Verificando OBS Studio...")
-    if not iniciar_obs():
-        print("❌ Falha ao iniciar OBS Studio")
+        if not configurar_e_iniciar_stream_youtube(obs, youtube, cancelado):
+            if cancelado.is_set():
+                return
+            print("⚠️ Tentando fallback de configuração...")
+            debug_obs_config()
+            if not configurar_e_iniciar_stream_youtube(obs, youtube, cancelado):
+                if cancelado.is_set():
+                    return
+                raise RuntimeError("Falha após fallback")
+
+        sessao.transmite = True
+        sessao.latencias_transmissao_ms.append((time.time() - sessao.instante_alerta) * 1000)
+        print("✅ Transmissão YouTube iniciada com sucesso")
+    except Exception as youtube_error:
+        print(f"❌ Falha no YouTube: {youtube_error}")
+        credenciais_google.descartar()
+        tratar_erro_alerta(sessao)
+
+
+# Encerra a sessão do dispositivo; a transmissão e o status "Ao Vivo" são compartilhados,
+# então só são desligados quando nenhum outro dispositivo ainda precisa deles
+def tratar_cancelamento(sessao):
+    if not sessao.grava:
         return
-    
-    # 3. Conectar ao OBS via WebSocket
-    print("\n[2/5] Conectando ao OBS WebSocket...")
-    obs_conectado = False
-    for tentativa in range(1, 6):  # 5 tentativas
-        if conectar_obs():
-            obs_conectado = True
-            break
-        print(f"⚠️ Tentativa {tentativa}/5 falhou. Tentando novamente em 3 segundos...")
-        time.sleep(3)
-    
-    if not obs_conectado:
-        print("❌ Falha na conexão com OBS após várias tentativas")
+    print(f"🟢 Alerta cancelado em '{sessao.dispositivo}' - Encerrando procedimentos...")
+    sessao.cancelamentos += 1
+    sessao.grava = False
+
+    if sessao.transmite:
+        sessao.transmite = False
+        if not outras_sessoes(sessao, "transmite") and not parar_transmissao(obs):
+            print("⚠️ Aviso: Problema ao parar transmissão,可能需要 limpeza manual")
+    if not outras_sessoes(sessao, "grava"):
+        atualizar_ao_vivo_no_db(False)
+
+    print("📴 Sistemas desativados")
+
+
+def tratar_erro_alerta(sessao):
+    sessao.grava = False
+    if outras_sessoes(sessao, "grava"):
         return
+    try:
+        atualizar_ao_vivo_no_db(False)
+    except:
+        pass
+
+
+# Executa uma fase da inicialização medindo o tempo; erros viram None para não
+# derrubar as fases vizinhas
+def executar_fase(nome, funcao, *args):
+    inicio = time.time()
+    try:
+        return funcao(*args)
+    except Exception as e:
+        print(f"⚠️ Erro na fase '{nome}': {e}")
+        return None
+    finally:
+        registrar_fase(nome, inicio)
+
 
-    # 4. Configurar MQTT
-    print("\n[3/5] Configurando MQTT Client...")
+# Configura o cliente MQTT, assina o tópico de alertas e inicia o loop em segundo plano
+def iniciar_mqtt():
+    print("\n📡 Configurando MQTT Client...")
     try:
         client = mqtt.Client()
         client.username_pw_set(os.getenv("MQTT_USERNAME"), os.getenv("MQTT_PASSWORD"))
         client.tls_set()
         client.on_message = on_mqtt_message
-        
+
         # Adicionar tratamento para conexão perdida
         def on_disconnect(client, userdata, rc):
             if rc != 0:
@@ -1247,35 +3981,121 @@ def main():
                     except Exception as e:
                         print(f"⚠️ Falha na reconexão: {e}. Tentando novamente em 5 segundos...")
                         time.sleep(5)
-        
+
         client.on_disconnect = on_disconnect
-        
+
         # Conectar e subscrever
         client.connect(os.getenv("MQTT_CLUSTER_URL"), 8883)
-        client.subscribe("alert")
+        client.subscribe([(topico, 0) for topico in TOPICOS_MQTT])
+        client.loop_start()
         print("✅ MQTT configurado e conectado")
+        return client
     except Exception as e:
         print(f"❌ Erro na configuração MQTT: {e}")
-        return
+        return None
 
-    # 5. Iniciar servidor Flask em thread separada
-    print("\n[4/5] Iniciando servidor Flask...")
-    flask_thread = threading.Thread(target=iniciar_servidor_flask, daemon=True)
-    flask_thread.start()
-    print("✅ Servidor Flask iniciado em http://localhost:5000/video_feed")
 
-    print("="*50 + "\n")
-    print("\n[5/5] Iniciando conta do google...")
-    print("Verificando login com o gooogle")
-    autenticar_google_api()
+# Abre o OBS (se necessário) e conecta ao WebSocket com novas tentativas
+def iniciar_e_conectar_obs():
+    print("\n🎬 Verificando OBS Studio...")
+    if not iniciar_obs():
+        print("❌ Falha ao iniciar OBS Studio")
+        return False
+
+    # Câmera virtual aberta antes de reconciliar a cena, para o OBS encontrar o dispositivo
+    if SAIDA_OBS == "camera_virtual" and saida_camera_virtual is None:
+        iniciar_camera_virtual()
+
+    for tentativa in range(1, 6):  # 5 tentativas
+        if conectar_obs():
+            # Cena e fonte prontas antes do primeiro alerta (o navegador do OBS já conecta ao feed)
+            configurar_cena_obs(FONTE_VIDEO)
+            return True
+        print(f"⚠️ Tentativa {tentativa}/5 falhou. Tentando novamente em 3 segundos...")
+        time.sleep(3)
+    return False
+
+
+# Câmeras abertas e modelos aquecidos desde já, monitorando em baixa taxa
+def iniciar_servico_deteccao():
+    global servico_deteccao
+    servico = ServicoDeteccao()
+    if servico.iniciar():
+        servico_deteccao = servico
+        print(f"✅ Serviço de detecção ativo ({PRE_EVENTO_SEGUNDOS} s de pré-evento por câmera)")
+    else:
+        print("⚠️ Nenhuma câmera para o serviço de detecção; as câmeras serão abertas a cada alerta")
+    return servico_deteccao
+
+
+# Carrega YOLO e MediaPipe em paralelo com a varredura de câmeras, para que nem o
+# serviço de detecção nem o caminho de reserva paguem o carregamento no primeiro alerta
+# Uma falha aqui é só avisada (o carregamento é tentado de novo no primeiro uso), mas
+# precisa aparecer na inicialização e não como um erro confuso no primeiro alerta
+def pre_carregar_modelos():
+    with ThreadPoolExecutor(max_workers=2) as carregamento:
+        futuros = {"YOLO": carregamento.submit(yolo_model.carregar), "MediaPipe": carregamento.submit(mp_face.carregar)}
+    for nome, futuro in futuros.items():
+        if futuro.exception() is not None:
+            print(f"❌ Falha ao carregar o modelo {nome}: {futuro.exception()}")
+
+
+def main():
+    # Configuração inicial
+    print("\n" + "="*50)
+    print("Sistema de Segurança - Inicializando...")
     print("="*50 + "\n")
     
-    # 6. Configuração inicial do banco de dados
+    # 1. Verificar e carregar configurações
     try:
-        atualizar_ao_vivo_no_db(False)
-        print("✅ Status 'Ao Vivo' atualizado no banco de dados")
+        print("✅ Configurações carregadas com sucesso")
     except Exception as e:
-        print(f"⚠️ Erro ao atualizar status no banco de dados: {e}")
+        print(f"⚠️ Erro ao carregar configurações: {e}")
+        print("⚠️ Usando configurações padrão")
+
+    # Fases independentes rodam em paralelo; o MQTT vem primeiro porque até a
+    # assinatura estar ativa nenhum alerta é recebido
+    inicio_processo = psutil.Process().create_time()
+    inicio = time.time()
+    registro_cameras.iniciar()
+    fila_uploads.iniciar()
+    armazem_eventos.iniciar()
+    inicializacao = ThreadPoolExecutor(max_workers=6, thread_name_prefix="inicializacao")
+    fases = {
+        "mqtt": inicializacao.submit(executar_fase, "mqtt", iniciar_mqtt),
+        "obs": inicializacao.submit(executar_fase, "obs", iniciar_e_conectar_obs),
+        "deteccao": inicializacao.submit(executar_fase, "deteccao", iniciar_servico_deteccao),
+        "modelos": inicializacao.submit(executar_fase, "modelos", pre_carregar_modelos),
+        "google": inicializacao.submit(executar_fase, "google", iniciar_youtube),
+        "banco": inicializacao.submit(executar_fase, "banco", atualizar_ao_vivo_no_db, False),
+    }
+
+    # Servidores de streaming e Flask não dependem de nenhuma fase
+    print("\n🌐 Iniciando servidores de streaming e Flask...")
+    streaming_thread = threading.Thread(target=servidor_streaming.iniciar, daemon=True)
+    streaming_thread.start()
+    print(f"✅ Streaming iniciado em http://localhost:{PORTA_STREAMING}/video_feed")
+    flask_thread = threading.Thread(target=iniciar_servidor_flask, daemon=True)
+    flask_thread.start()
+    print(f"✅ Servidor Flask iniciado em http://localhost:{PORTA_FLASK}/metricas")
+
+    client = fases["mqtt"].result()
+    if client is None:
+        inicializacao.shutdown(wait=False)
+        return
+    tempos_inicializacao["alerta_ativo_desde_processo"] = round((time.time() - inicio_processo) * 1000)
+    print(f"✅ Recebendo alertas {tempos_inicializacao['alerta_ativo_desde_processo']} ms após o início do processo")
+
+    if not fases["obs"].result():
+        print("❌ Falha na conexão com OBS após várias tentativas")
+        client.loop_stop()
+        client.disconnect()
+        inicializacao.shutdown(wait=False)
+        return
+    wait(fases.values())
+    inicializacao.shutdown()
+    registrar_fase("inicializacao_total", inicio)
+    print("⏱️ Inicialização: " + " | ".join(f"{nome} {ms} ms" for nome, ms in tempos_inicializacao.items()))
 
     # 7. Informações do sistema
     print("\n" + "="*50)
@@ -1285,9 +4105,10 @@ def main():
     print(f"• Cena OBS: {NOME_CENA}")
     print("="*50 + "\n")
 
-    # 8. Loop principal com tratamento de exceções
+    # 8. Loop principal com tratamento de exceções (o MQTT já roda em thread própria)
     try:
-        client.loop_forever()
+        while True:
+            time.sleep(1)
     except KeyboardInterrupt:
         print("\n👋 Recebido comando para encerrar...")
     except Exception as e:
@@ -1297,13 +4118,23 @@ def main():
         print("\nEncerrando recursos...")
         
         # Parar transmissão se estiver ativa
-        if transmite:
-            try:
-                parar_transmissao()
+        if obs and alguma_sessao_transmitindo():
+            if parar_transmissao(obs):
                 print("✅ Transmissão encerrada")
-            except Exception as e:
-                print(f"⚠️ Erro ao parar transmissão: {e}")
         
+        if servico_deteccao is not None:
+            servico_deteccao.parar()
+        registro_cameras.parar()
+        fila_uploads.parar()
+        if not armazem_eventos.esvaziar(timeout=10):
+            print("⚠️ Eventos ainda não sincronizados ficam no armazém local para o próximo início")
+        armazem_eventos.parar()
+        if pool_youtube is not None:
+            pool_youtube.parar()
+        credenciais_google.parar()
+        if saida_camera_virtual is not None:
+            saida_camera_virtual.fechar()
+
         # Desconectar OBS
         if obs:
             try:
@@ -1314,6 +4145,7 @@ def main():
         
         # Desconectar MQTT
         try:
+            client.loop_stop()
             client.disconnect()
             print("✅ Desconectado do MQTT")
         except Exception as e:
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os testes importam o main.py direto de src/, como os benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
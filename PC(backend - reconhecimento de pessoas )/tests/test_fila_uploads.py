@@ -0,0 +1,192 @@
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+
+# Endpoint TUS mínimo, como o do Supabase Storage (ver benchmark_upload.py); 'falhar'
+# faz os PATCH seguintes ao primeiro responderem 500
+class ServidorTus(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), TratadorTus)
+        self.uploads = {}
+        self.objetos = {}
+        self.ordem = []
+        self.criados = 0
+        self.bytes_recebidos = 0
+        self.falhar = False
+        self.lock = threading.Lock()
+
+
+class TratadorTus(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, status, **cabecalhos):
+        self.send_response(status)
+        for nome, valor in cabecalhos.items():
+            self.send_header(nome.replace("_", "-"), valor)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        metadados = dict(par.split(" ") for par in self.headers["Upload-Metadata"].split(","))
+        with self.server.lock:
+            identificador = str(len(self.server.uploads))
+            self.server.uploads[identificador] = {
+                "nome": base64.b64decode(metadados["objectName"]).decode(),
+                "tamanho": int(self.headers["Upload-Length"]),
+                "recebido": bytearray(),
+            }
+            self.server.criados += 1
+        self._responder(201, Location=f"/upload/{identificador}")
+
+    def do_HEAD(self):
+        upload = self.server.uploads.get(self.path.rsplit("/", 1)[-1])
+        if upload is None:
+            self._responder(404)
+            return
+        self._responder(200, Upload_Offset=str(len(upload["recebido"])), Upload_Length=str(upload["tamanho"]))
+
+    def do_PATCH(self):
+        upload = self.server.uploads[self.path.rsplit("/", 1)[-1]]
+        corpo = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            if self.server.falhar and upload["recebido"]:
+                self._responder(500)
+                return
+            if int(self.headers["Upload-Offset"]) != len(upload["recebido"]):
+                self._responder(409)
+                return
+            upload["recebido"] += corpo
+            self.server.bytes_recebidos += len(corpo)
+            if len(upload["recebido"]) == upload["tamanho"]:
+                self.server.objetos[upload["nome"]] = bytes(upload["recebido"])
+                self.server.ordem.append(upload["nome"])
+        self._responder(204, Upload_Offset=str(len(upload["recebido"])))
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    monkeypatch.setattr(main, "ESPERA_MAXIMA_UPLOAD", 0.05)
+    servidor = ServidorTus()
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+def criar_arquivo(pasta, nome, tamanho):
+    caminho = os.path.join(pasta, nome)
+    with open(caminho, "wb") as f:
+        f.write(os.urandom(tamanho))
+    return caminho
+
+
+def nova_fila(servidor, arquivo, concluidos, trabalhadores=1):
+    return main.FilaUploads(url=f"http://127.0.0.1:{servidor.server_port}/upload", arquivo=arquivo,
+                            trabalhadores=trabalhadores, tamanho_chunk=1000,
+                            ao_concluir=lambda item: concluidos.append(item) or True)
+
+
+def aguardar(condicao, timeout=10):
+    limite = time.time() + timeout
+    while not condicao():
+        assert time.time() < limite, "tempo esgotado"
+        time.sleep(0.01)
+
+
+def test_retoma_do_offset_salvo_apos_reinicio(servidor, tmp_path):
+    caminho = criar_arquivo(tmp_path, "gravacao.mp4", 3500)
+    arquivo_fila = str(tmp_path / "fila_uploads.json")
+    concluidos = []
+
+    # Primeira instância: o servidor aceita um chunk e passa a falhar; o processo "cai"
+    servidor.falhar = True
+    fila = nova_fila(servidor, arquivo_fila, concluidos)
+    fila.enfileirar(caminho, "gravacoes/teste/gravacao.mp4", "video/mp4", registro={"duracao": 1})
+    fila.iniciar()
+    aguardar(lambda: fila.tentativas_falhas >= 1)
+    fila.parar()
+
+    with open(arquivo_fila, encoding="utf-8") as f:
+        item, = json.load(f)
+    assert item["offset"] == 1000
+    assert item["url_upload"] is not None
+
+    # Segunda instância: lê a fila do disco e continua do byte 1000, no mesmo upload
+    servidor.falhar = False
+    fila = nova_fila(servidor, arquivo_fila, concluidos)
+    fila.iniciar()
+    aguardar(lambda: not fila.estatisticas()["na_fila"])
+    fila.parar()
+
+    with open(caminho, "rb") as f:
+        assert servidor.objetos["gravacoes/teste/gravacao.mp4"] == f.read()
+    assert servidor.criados == 1
+    assert servidor.bytes_recebidos == 3500
+    assert [c["registro"] for c in concluidos] == [{"duracao": 1}]
+    with open(arquivo_fila, encoding="utf-8") as f:
+        assert json.load(f) == []
+
+
+def test_upload_expirado_no_servidor_recomeca(servidor, tmp_path):
+    caminho = criar_arquivo(tmp_path, "gravacao.mp4", 2500)
+    arquivo_fila = str(tmp_path / "fila_uploads.json")
+    concluidos = []
+
+    servidor.falhar = True
+    fila = nova_fila(servidor, arquivo_fila, concluidos)
+    fila.enfileirar(caminho, "gravacoes/teste/gravacao.mp4", "video/mp4")
+    fila.iniciar()
+    aguardar(lambda: fila.tentativas_falhas >= 1)
+    fila.parar()
+
+    servidor.uploads.clear()
+    servidor.falhar = False
+    fila = nova_fila(servidor, arquivo_fila, concluidos)
+    fila.iniciar()
+    aguardar(lambda: not fila.estatisticas()["na_fila"])
+    fila.parar()
+
+    with open(caminho, "rb") as f:
+        assert servidor.objetos["gravacoes/teste/gravacao.mp4"] == f.read()
+    assert servidor.criados == 2
+
+
+def test_playlist_so_sobe_depois_dos_segmentos(servidor, tmp_path):
+    concluidos = []
+    fila = nova_fila(servidor, str(tmp_path / "fila_uploads.json"), concluidos, trabalhadores=3)
+    segmentos = [fila.enfileirar(criar_arquivo(tmp_path, f"seg_{i}.m4s", 2500), f"hls/seg_{i}.m4s", "video/iso.segment")
+                 for i in range(2)]
+    playlist = criar_arquivo(tmp_path, "index.m3u8", 10)
+    fila.enfileirar(playlist, "hls/index.m3u8", "application/vnd.apple.mpegurl", depende_de=segmentos, cache_control="0")
+    fila.iniciar()
+    aguardar(lambda: not fila.estatisticas()["na_fila"])
+    fila.parar()
+
+    assert servidor.ordem[-1] == "hls/index.m3u8"
+    assert len(servidor.ordem) == 3
+
+
+def test_sem_playlist_enfileira_os_segmentos_do_disco(tmp_path, monkeypatch):
+    fila = main.FilaUploads(url="http://127.0.0.1:9/upload", arquivo=str(tmp_path / "fila_uploads.json"))
+    monkeypatch.setattr(main, "fila_uploads", fila)
+    pasta = tmp_path / "gravacao"
+    pasta.mkdir()
+    for nome in ["init.mp4", "seg_00000.m4s", "seg_00001.m4s"]:
+        criar_arquivo(pasta, nome, 100)
+
+    main.EnvioSegmentos(str(pasta)).enfileirar_pendentes({"duracao": 1})
+
+    remotos = sorted(item["caminho_remoto"].rsplit("/", 1)[-1] for item in fila.itens.values())
+    assert remotos == ["init.mp4", "seg_00000.m4s", "seg_00001.m4s"]
+    assert all(item["registro"] is None for item in fila.itens.values())
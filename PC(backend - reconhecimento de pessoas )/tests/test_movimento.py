@@ -0,0 +1,53 @@
+import numpy as np
+
+import main
+
+
+def rastreador_em_movimento():
+    # Pessoa andando ~5 px por frame, com keyframes a cada 2 frames até o 29 (x1 = 245)
+    rastreador = main.RastreadorPessoas()
+    for sequencia in range(1, 30, 2):
+        rastreador.atualizar([(100 + 5 * sequencia, 100, 200 + 5 * sequencia, 400)], sequencia)
+    return rastreador
+
+
+def test_previsao_para_no_horizonte_maximo():
+    rastreador = rastreador_em_movimento()
+
+    no_horizonte = rastreador.prever(29 + main.HORIZONTE_MAXIMO_PREVISAO)
+    muito_depois = rastreador.prever(29 + 10 * main.HORIZONTE_MAXIMO_PREVISAO)
+    assert no_horizonte == muito_depois
+
+
+def test_congelar_para_a_trilha_nos_frames_sem_movimento():
+    rastreador = rastreador_em_movimento()
+
+    rastreador.congelar(31)
+    (_, congelada), = rastreador.prever(31)
+    (_, depois), = rastreador.prever(60)
+    assert congelada == depois
+    assert rastreador.movimento() == 0.0
+
+
+def test_filtro_movimento_bloqueia_cena_parada():
+    filtro = main.FiltroMovimento()
+    frame = np.full((main.ALTURA_FRAME, main.LARGURA_FRAME, 3), 90, dtype=np.uint8)
+    assert filtro.avaliar(frame)  # primeiro frame sempre passa
+    assert not filtro.avaliar(frame.copy())
+    assert filtro.contadores()["bloqueados"] == 1
+
+
+def test_filtro_movimento_libera_area_alterada():
+    filtro = main.FiltroMovimento()
+    frame = np.full((main.ALTURA_FRAME, main.LARGURA_FRAME, 3), 90, dtype=np.uint8)
+    filtro.avaliar(frame)
+    frame[200:500, 400:600] = 220
+    assert filtro.avaliar(frame)
+    assert filtro.contadores()["area_alterada"] > main.LIMIAR_AREA_MOVIMENTO
+
+
+def test_filtro_movimento_forca_avaliacao_apos_intervalo():
+    filtro = main.FiltroMovimento(intervalo_maximo=0)
+    frame = np.full((main.ALTURA_FRAME, main.LARGURA_FRAME, 3), 90, dtype=np.uint8)
+    assert filtro.avaliar(frame)
+    assert filtro.avaliar(frame)
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+CONFIGURACOES = {"url": "http://localhost:5000/video_feed", "width": 1920, "height": 1080, "fps": 30}
+
+
+# OBS falso: responde às leituras a partir do próprio estado e registra as escritas.
+# Como no OBS de verdade, GetInputSettings só traz o que difere dos padrões do tipo.
+class ObsFalso:
+    def __init__(self, cenas=(), programa="Cena", entradas=None, configuracoes=None, itens=None):
+        self.cenas = list(cenas)
+        self.programa = programa
+        self.entradas = dict(entradas or {})
+        self.configuracoes = dict(configuracoes or {})
+        self.itens = list(itens or [])
+        self.padroes = {"browser_source": {"fps": 30, "width": 800, "height": 600, "url": ""}}
+        self.leituras = []
+        self.escritas = []
+
+    def send(self, requisicao, dados=None):
+        if requisicao == "GetSceneList":
+            self.leituras.append(requisicao)
+            return SimpleNamespace(scenes=[{"sceneName": c} for c in self.cenas],
+                                   current_program_scene_name=self.programa)
+        if requisicao == "GetInputList":
+            self.leituras.append(requisicao)
+            return SimpleNamespace(inputs=[{"inputName": n, "inputKind": t} for n, t in self.entradas.items()])
+        if requisicao == "GetInputSettings":
+            self.leituras.append(requisicao)
+            return SimpleNamespace(input_settings=dict(self.configuracoes.get(dados["inputName"], {})))
+        if requisicao == "GetInputDefaultSettings":
+            self.leituras.append(requisicao)
+            return SimpleNamespace(default_input_settings=dict(self.padroes.get(dados["inputKind"], {})))
+        if requisicao == "GetSceneItemList":
+            self.leituras.append(requisicao)
+            return SimpleNamespace(scene_items=self.itens)
+        self.escritas.append((requisicao, dados))
+        return SimpleNamespace(scene_item_id=1)
+
+
+@pytest.fixture
+def reconciliador(monkeypatch):
+    monkeypatch.setattr(main, "saida_camera_virtual", None)
+    reconciliador = main.ReconciliadorOBS()
+    reconciliador.configuracoes = dict(CONFIGURACOES)
+    return reconciliador
+
+
+def obs_configurado():
+    # fps igual ao padrão: o OBS não devolve a chave nas configurações da fonte
+    return ObsFalso(
+        cenas=[main.NOME_CENA], programa=main.NOME_CENA,
+        entradas={main.FONTE_VIDEO: "browser_source"},
+        configuracoes={main.FONTE_VIDEO: {"url": CONFIGURACOES["url"], "width": 1920, "height": 1080}},
+        itens=[{"sourceName": main.FONTE_VIDEO, "sceneItemId": 3, "sceneItemEnabled": True}],
+    )
+
+
+def test_obs_vazio_cria_cena_e_fonte(reconciliador, monkeypatch):
+    obs = ObsFalso(cenas=["Cena"])
+    monkeypatch.setattr(main, "obs", obs)
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+
+    assert [r for r, _ in obs.escritas] == ["CreateScene", "CreateInput", "SetCurrentProgramScene"]
+    _, criar = obs.escritas[1]
+    assert criar["inputKind"] == "browser_source"
+    assert criar["inputSettings"] == CONFIGURACOES
+
+
+def test_obs_configurado_nao_recebe_requisicoes(reconciliador, monkeypatch):
+    obs = obs_configurado()
+    monkeypatch.setattr(main, "obs", obs)
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+    assert obs.escritas == []
+
+    # Segundo alerta: tudo vem do cache, nem as leituras se repetem
+    leituras = len(obs.leituras)
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+    assert obs.escritas == []
+    assert len(obs.leituras) == leituras
+    assert reconciliador.estatisticas()["sem_alteracoes"] == 2
+
+
+def test_evento_de_configuracao_nao_reenvia_padroes(reconciliador, monkeypatch):
+    obs = obs_configurado()
+    monkeypatch.setattr(main, "obs", obs)
+    reconciliador.reconciliar(main.FONTE_VIDEO)
+
+    # InputSettingsChanged traz só as chaves fora do padrão; o fps não pode voltar no plano
+    reconciliador.on_input_settings_changed(SimpleNamespace(
+        input_name=main.FONTE_VIDEO, input_settings={"url": "http://outro", "width": 1920, "height": 1080}))
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+    assert obs.escritas == [("SetInputSettings", {
+        "inputName": main.FONTE_VIDEO, "inputSettings": {"url": CONFIGURACOES["url"]}, "overlay": True})]
+
+
+def test_fonte_de_outro_tipo_e_recriada(reconciliador, monkeypatch):
+    obs = obs_configurado()
+    obs.entradas[main.FONTE_VIDEO] = "dshow_input"
+    monkeypatch.setattr(main, "obs", obs)
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+    assert [r for r, _ in obs.escritas] == ["RemoveInput", "CreateInput"]
+
+
+def test_item_desativado_e_cena_fora_do_programa(reconciliador, monkeypatch):
+    obs = obs_configurado()
+    obs.programa = "Outra"
+    obs.itens = [{"sourceName": main.FONTE_VIDEO, "sceneItemId": 3, "sceneItemEnabled": False}]
+    monkeypatch.setattr(main, "obs", obs)
+    assert reconciliador.reconciliar(main.FONTE_VIDEO)
+    assert obs.escritas == [
+        ("SetSceneItemEnabled", {"sceneName": main.NOME_CENA, "sceneItemId": 3, "sceneItemEnabled": True}),
+        ("SetCurrentProgramScene", {"sceneName": main.NOME_CENA}),
+    ]
@@ -0,0 +1,50 @@
+
+import main
+
+
+def caixa_deslocada(caixa, dx):
+    x1, y1, x2, y2 = caixa
+    return (x1 + dx, y1, x2 + dx, y2)
+
+
+def test_mantem_id_entre_keyframes():
+    rastreador = main.RastreadorPessoas()
+    ids, incerteza = rastreador.atualizar([(100, 100, 200, 400)], 1)
+    assert ids == [1]
+    assert incerteza == 1.0  # trilha nova
+
+    ids, incerteza = rastreador.atualizar([(110, 100, 210, 400)], 3)
+    assert ids == [1]
+    assert incerteza < 0.3
+
+
+def test_propaga_caixa_pela_velocidade_entre_keyframes():
+    rastreador = main.RastreadorPessoas()
+    caixa = (100, 100, 200, 400)
+    for sequencia in range(1, 30, 2):
+        rastreador.atualizar([caixa_deslocada(caixa, 5 * sequencia)], sequencia)
+
+    # Último keyframe em 29 (x1 = 245); a pessoa anda ~5 px por frame
+    (id_trilha, (x1, _, _, _)), = rastreador.prever(31)
+    assert id_trilha == 1
+    assert abs(x1 - 255) <= 3
+    assert rastreador.movimento() > 3
+
+
+def test_trilha_sem_deteccao_some_e_expira():
+    rastreador = main.RastreadorPessoas()
+    rastreador.atualizar([(100, 100, 200, 400)], 1)
+    rastreador.atualizar([], 3)
+    assert rastreador.prever(3) == []  # trilha perdida não é desenhada
+
+    for sequencia in range(5, 5 + 2 * main.MAX_DETECCOES_PERDIDAS, 2):
+        rastreador.atualizar([], sequencia)
+    assert rastreador.trilhas == []
+
+
+def test_caixas_ficam_dentro_do_frame():
+    rastreador = main.RastreadorPessoas(largura=640, altura=480)
+    rastreador.atualizar([(500, 100, 630, 400)], 1)
+    rastreador.atualizar([(560, 100, 690, 400)], 2)
+    (_, (x1, y1, x2, y2)), = rastreador.prever(10)
+    assert 0 <= x1 <= x2 <= 639 and 0 <= y1 <= y2 <= 479
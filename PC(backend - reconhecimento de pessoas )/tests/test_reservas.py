@@ -0,0 +1,57 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def servico(monkeypatch):
+    monkeypatch.setattr(main, "CAMERAS_POR_DISPOSITIVO", {"porta1": ["cam0"]})
+    servico = main.ServicoDeteccao()
+    servico.motor = SimpleNamespace(fontes=[main.FonteCamera(nome, i) for i, nome in enumerate(["cam0", "cam1"])],
+                                    modo=main.MODO_MONITORANDO)
+    return servico
+
+
+def nomes(fontes):
+    return [f.nome for f in fontes]
+
+
+def test_dispositivos_sem_mapa_compartilham_cameras(servico):
+    assert nomes(servico._reservar("porta2")) == ["cam0", "cam1"]
+    assert nomes(servico._reservar("porta3")) == ["cam0", "cam1"]
+    assert servico.motor.modo == main.MODO_GRAVANDO
+
+    servico._liberar(servico.motor.fontes, "porta2")
+    assert servico.reservas == {"cam0": ["porta3"], "cam1": ["porta3"]}
+    servico._liberar(servico.motor.fontes, "porta3")
+    assert servico.motor.modo == main.MODO_MONITORANDO
+
+
+def test_camera_mapeada_e_exclusiva(servico):
+    assert nomes(servico._reservar("porta1")) == ["cam0"]
+    assert nomes(servico._reservar("porta2")) == ["cam1"]
+    assert servico._reservar("porta1") == []
+
+
+def test_camera_ocupada_nao_e_reservada_pelo_dispositivo_mapeado(servico):
+    servico._reservar("porta2")
+    assert servico._reservar("porta1") == []
+
+
+def test_camera_desconectada_nao_e_reservada(servico):
+    servico.motor.fontes[1].viva = False
+    assert nomes(servico._reservar("porta2")) == ["cam0"]
+
+
+def test_exibicao_passa_para_a_sessao_que_continua():
+    fonte = main.FonteCamera("cam0", 0)
+    primeira, segunda = threading.Event(), threading.Event()
+    assert fonte.assumir_exibicao(primeira)
+    assert not fonte.assumir_exibicao(segunda)
+
+    primeira.set()  # a primeira sessão foi cancelada
+    assert fonte.assumir_exibicao(segunda)
+    assert not fonte.assumir_exibicao(threading.Event())
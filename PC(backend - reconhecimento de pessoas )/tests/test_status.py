@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+# Supabase falso com uma única linha de ngrok_links; registra cada ida ao banco
+class SupabaseFalso:
+    def __init__(self, linha=None):
+        self.linha = linha
+        self.chamadas = []
+
+    def table(self, nome):
+        assert nome == "ngrok_links"
+        return ConsultaFalsa(self)
+
+
+class ConsultaFalsa:
+    def __init__(self, banco):
+        self.banco = banco
+        self.operacao = None
+        self.dados = None
+        self.filtros = {}
+
+    def select(self, colunas):
+        self.operacao = "select"
+        return self
+
+    def insert(self, dados):
+        self.operacao, self.dados = "insert", dados
+        return self
+
+    def update(self, dados):
+        self.operacao, self.dados = "update", dados
+        return self
+
+    def eq(self, coluna, valor):
+        self.filtros[coluna] = valor
+        return self
+
+    def lt(self, coluna, valor):
+        self.filtros[coluna + "<"] = valor
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def execute(self):
+        banco = self.banco
+        banco.chamadas.append((self.operacao, self.dados))
+        if self.operacao == "select":
+            return SimpleNamespace(data=[{"ID": banco.linha["ID"]}] if banco.linha else [])
+        if self.operacao == "insert":
+            banco.linha = {"ID": 1, **self.dados}
+            return SimpleNamespace(data=[banco.linha])
+        if banco.linha is None or banco.linha["updated_at"] >= self.filtros["updated_at<"]:
+            return SimpleNamespace(data=[])
+        banco.linha.update(self.dados)
+        return SimpleNamespace(data=[banco.linha])
+
+
+@pytest.fixture
+def armazem(tmp_path, monkeypatch):
+    armazem = main.ArmazemEventos(str(tmp_path / "eventos.db"))
+    monkeypatch.setattr(main, "armazem_eventos", armazem)
+    yield armazem
+    armazem.parar()
+
+
+def preparar(armazem, monkeypatch, linha=None):
+    banco = SupabaseFalso(linha)
+    monkeypatch.setattr(main, "supabase", banco)
+    repositorio = main.RepositorioStatus("usuario")
+    armazem.adicionar_replicador(repositorio)
+    return banco, repositorio
+
+
+def test_alternancias_dentro_da_janela_viram_uma_escrita(armazem, monkeypatch):
+    banco, repositorio = preparar(armazem, monkeypatch, {"ID": 7, "AoVivo": False, "updated_at": "2000-01-01T00:00:00"})
+    repositorio.definir(True, url="https://youtu.be/x")
+    repositorio.definir(False)
+    repositorio.definir(True)
+
+    armazem.iniciar()
+    assert armazem.esvaziar(timeout=5)
+
+    assert [operacao for operacao, _ in banco.chamadas] == ["select", "update"]
+    assert banco.linha["AoVivo"] is True
+    assert banco.linha["url"] == "https://youtu.be/x"
+    estatisticas = repositorio.estatisticas()
+    assert estatisticas["escritas"] == 1
+    assert estatisticas["combinadas"] == 2
+
+
+def test_estado_ja_confirmado_nao_vai_ao_banco(armazem, monkeypatch):
+    banco, repositorio = preparar(armazem, monkeypatch, {"ID": 7, "AoVivo": False, "updated_at": "2000-01-01T00:00:00"})
+    repositorio.definir(True)
+    armazem.iniciar()
+    assert armazem.esvaziar(timeout=5)
+    chamadas = len(banco.chamadas)
+
+    repositorio.definir(False)
+    repositorio.definir(True)
+    assert armazem.esvaziar(timeout=5)
+    assert len(banco.chamadas) == chamadas
+    assert repositorio.estatisticas()["escritas"] == 1
+
+
+def test_sem_registro_cria_a_linha(armazem, monkeypatch):
+    banco, repositorio = preparar(armazem, monkeypatch)
+    repositorio.definir(True)
+    armazem.iniciar()
+    assert armazem.esvaziar(timeout=5)
+
+    assert [operacao for operacao, _ in banco.chamadas] == ["select", "insert"]
+    assert banco.linha["AoVivo"] is True
+    assert banco.linha["ID_Usuarios"] == "usuario"
+
+
+def test_linha_alterada_depois_do_evento_prevalece(armazem, monkeypatch):
+    futuro = (datetime.utcnow() + timedelta(hours=1)).isoformat()
+    banco, repositorio = preparar(armazem, monkeypatch, {"ID": 7, "AoVivo": False, "updated_at": futuro})
+    repositorio.definir(True)
+    armazem.iniciar()
+    assert armazem.esvaziar(timeout=5)
+
+    assert banco.linha["AoVivo"] is False
+    assert repositorio.estatisticas()["conflitos"] == 1
+
+
+def test_eventos_pendentes_sobrevivem_ao_reinicio(tmp_path, monkeypatch):
+    arquivo = str(tmp_path / "eventos.db")
+    primeiro = main.ArmazemEventos(arquivo)
+    monkeypatch.setattr(main, "armazem_eventos", primeiro)
+    main.RepositorioStatus("usuario").definir(True)
+    primeiro.banco.close()
+
+    armazem = main.ArmazemEventos(arquivo)
+    monkeypatch.setattr(main, "armazem_eventos", armazem)
+    banco, repositorio = preparar(armazem, monkeypatch, {"ID": 7, "AoVivo": False, "updated_at": "2000-01-01T00:00:00"})
+    assert armazem.estatisticas()["pendentes"] == {"status": 1}
+    armazem.iniciar()
+    assert armazem.esvaziar(timeout=5)
+    armazem.parar()
+    assert banco.linha["AoVivo"] is True